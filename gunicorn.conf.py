@@ -0,0 +1,77 @@
+"""
+Profil serveur de production (chargé automatiquement par `gunicorn`).
+
+Modèle de worker choisi par GUNICORN_WORKER_MODEL :
+- sync    : un process par requête en cours (défaut historique) ;
+- gthread : process + threads, une requête PayPal lente ne bloque plus tout le worker ;
+- asgi    : workers uvicorn sur sh.asgi (nécessite `uvicorn`).
+"""
+import multiprocessing
+import os
+
+
+WORKER_MODELS = {
+    "sync": ("sync", "sh.wsgi:application"),
+    "gthread": ("gthread", "sh.wsgi:application"),
+    "asgi": ("uvicorn.workers.UvicornWorker", "sh.asgi:application"),
+}
+
+worker_model = os.environ.get("GUNICORN_WORKER_MODEL", "gthread")
+if worker_model not in WORKER_MODELS:
+    raise RuntimeError(f"GUNICORN_WORKER_MODEL inconnu : {worker_model}")
+worker_class, wsgi_app = WORKER_MODELS[worker_model]
+
+bind = f"0.0.0.0:{os.environ.get('PORT', '8000')}"
+# Chaque thread de chaque worker garde sa connexion à la base : défaut
+# prudent, à relever explicitement (WEB_CONCURRENCY) selon max_connections
+workers = int(os.environ.get("WEB_CONCURRENCY", min(multiprocessing.cpu_count(), 4)))
+threads = int(os.environ.get("GUNICORN_THREADS", 4 if worker_model == "gthread" else 1))
+
+# Charger Django une fois dans le master : les workers partagent ses pages
+# mémoire en copy-on-write et démarrent plus vite.
+preload_app = os.environ.get("GUNICORN_PRELOAD", "1") == "1"
+
+# Recyclage des workers (fuites mémoire), avec gigue pour éviter qu'ils
+# redémarrent tous en même temps.
+max_requests = int(os.environ.get("GUNICORN_MAX_REQUESTS", 1000))
+max_requests_jitter = int(os.environ.get("GUNICORN_MAX_REQUESTS_JITTER", 100))
+
+timeout = int(os.environ.get("GUNICORN_TIMEOUT", 30))
+graceful_timeout = int(os.environ.get("GUNICORN_GRACEFUL_TIMEOUT", 30))
+keepalive = int(os.environ.get("GUNICORN_KEEPALIVE", 5))
+
+# Heartbeat des workers en mémoire plutôt que sur disque
+if os.path.isdir("/dev/shm"):
+    worker_tmp_dir = "/dev/shm"
+
+accesslog = os.environ.get("GUNICORN_ACCESS_LOG", "-")
+errorlog = "-"
+
+
+def on_starting(server):
+    # Schéma OpenAPI généré une fois par déploiement, dans le master : les
+    # workers servent le fichier (sh/openapi.py) sans introspecter l'API
+    import django
+    from django.core.management import call_command
+
+    django.setup()
+    call_command("build_openapi_schema")
+
+
+def post_fork(server, worker):
+    if not preload_app:
+        return
+    # Connexions ouvertes par le master pendant le preload : ne pas les
+    # partager entre process.
+    from django.db import connections
+
+    for connection in connections.all(initialized_only=True):
+        connection.close()
+
+
+def post_worker_init(worker):
+    # Index d'autocomplétion construit en arrière-plan dès le démarrage du
+    # worker, plutôt qu'à sa première requête
+    from market.autocomplete import index
+
+    index.warm()
@@ -1,6 +1,175 @@
-from django.contrib import admin
-from .models import User, Item
+from django.contrib import admin, messages
+from django.core.paginator import Paginator
+from django.db import connection
+from django.utils import timezone
+from django.utils.functional import cached_property
 
-admin.site.register(User)
-# admin.site.register(Category)
-admin.site.register(Item)
+from .models import User, Item, ArchivedItem, ArchivedItemImage, Cart, CartItem, Order, OrderLine, Payment
+from .tasks import abandon_payments
+from .signals import items_bulk_updated
+
+
+# =============================
+# 🔹 Pagination à comptage approximatif
+# =============================
+class ApproximateCountPaginator(Paginator):
+    """
+    Sur une liste non filtrée d'une grosse table, utilise l'estimation du
+    moteur (information_schema / pg_class) au lieu d'un COUNT(*) complet.
+    Dès qu'un filtre ou une recherche est actif, on revient au vrai COUNT.
+    """
+    threshold = 10000
+
+    @cached_property
+    def count(self):
+        query = getattr(self.object_list, 'query', None)
+        if query is not None and not query.where:
+            estimate = self._estimate(self.object_list.model._meta.db_table)
+            if estimate and estimate > self.threshold:
+                return estimate
+        return super().count
+
+    def _estimate(self, table):
+        if connection.vendor == 'mysql':
+            sql = ("SELECT TABLE_ROWS FROM information_schema.TABLES "
+                   "WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s")
+        elif connection.vendor == 'postgresql':
+            sql = "SELECT reltuples::bigint FROM pg_class WHERE relname = %s"
+        else:
+            return None
+        with connection.cursor() as cursor:
+            cursor.execute(sql, [table])
+            row = cursor.fetchone()
+        return int(row[0]) if row and row[0] is not None else None
+
+
+class ScalableModelAdmin(admin.ModelAdmin):
+    paginator = ApproximateCountPaginator
+    show_full_result_count = False  # évite un second COUNT(*) lors d'une recherche
+    list_per_page = 50
+
+
+# =============================
+# 🔹 Utilisateurs
+# =============================
+@admin.register(User)
+class UserAdmin(ScalableModelAdmin):
+    list_display = ('username', 'email', 'first_name', 'last_name', 'role', 'city', 'is_active')
+    list_filter = ('role', 'is_active')
+    # "=" / "^" : égalité ou préfixe, qui peuvent utiliser les index email / username
+    search_fields = ('=email', '^username')
+
+
+# =============================
+# 🔹 Annonces
+# =============================
+@admin.register(Item)
+class ItemAdmin(ScalableModelAdmin):
+    list_display = ('title', 'item_type', 'price', 'city', 'owner', 'is_available', 'created_at')
+    list_select_related = ('owner',)
+    list_filter = ('item_type', 'is_available')
+    search_fields = ('^title', '=city')
+    raw_id_fields = ('owner',)
+    actions = ['mark_unavailable', 'mark_available']
+
+    @admin.action(description="Marquer comme indisponible")
+    def mark_unavailable(self, request, queryset):
+        ids = list(queryset.filter(is_available=True).values_list('id', flat=True))
+        updated = Item.objects.filter(id__in=ids).update(is_available=False, updated_at=timezone.now())
+        items_bulk_updated.send(sender=Item, ids=ids)
+        self.message_user(request, f"{updated} annonce(s) marquée(s) indisponible(s).", messages.SUCCESS)
+
+    @admin.action(description="Marquer comme disponible")
+    def mark_available(self, request, queryset):
+        ids = list(queryset.filter(is_available=False).values_list('id', flat=True))
+        updated = Item.objects.filter(id__in=ids).update(is_available=True, updated_at=timezone.now())
+        items_bulk_updated.send(sender=Item, ids=ids)
+        self.message_user(request, f"{updated} annonce(s) remise(s) en ligne.", messages.SUCCESS)
+
+
+# =============================
+# 🔹 Paniers
+# =============================
+class CartItemInline(admin.TabularInline):
+    model = CartItem
+    raw_id_fields = ('item',)
+    extra = 0
+
+
+@admin.register(Cart)
+class CartAdmin(ScalableModelAdmin):
+    list_display = ('id', 'user', 'created_at')
+    list_select_related = ('user',)
+    search_fields = ('=user__email',)
+    raw_id_fields = ('user',)
+    inlines = [CartItemInline]
+
+
+# =============================
+# 🔹 Paiements
+# =============================
+@admin.register(Payment)
+class PaymentAdmin(ScalableModelAdmin):
+    list_display = ('id', 'user', 'payment_method', 'amount', 'currency', 'status', 'created_at')
+    list_select_related = ('user',)
+    list_filter = ('status', 'payment_method')
+    search_fields = ('=paypal_order_id', '=stripe_payment_intent_id', '=user__email')
+    raw_id_fields = ('user', 'cart', 'order')
+    actions = ['cancel_pending']
+
+    @admin.action(description="Annuler les paiements en attente (après vérification du fournisseur)")
+    def cancel_pending(self, request, queryset):
+        # Le fournisseur tranche : un client qui a payé entre-temps garde sa vente
+        count = abandon_payments(queryset)
+        self.message_user(
+            request, f"{count} paiement(s) en attente confiés à la vérification du fournisseur.", messages.SUCCESS,
+        )
+
+
+# =============================
+# 🔹 Commandes (lecture seule : instantanés figés)
+# =============================
+class OrderLineInline(admin.TabularInline):
+    model = OrderLine
+    fields = ('title', 'item_type', 'unit_price', 'quantity', 'line_total', 'item', 'seller')
+    readonly_fields = fields
+    can_delete = False
+    extra = 0
+
+    def has_add_permission(self, request, obj=None):
+        return False
+
+
+@admin.register(Order)
+class OrderAdmin(ScalableModelAdmin):
+    list_display = ('id', 'user', 'total', 'currency', 'item_count', 'created_at')
+    list_select_related = ('user',)
+    search_fields = ('=user__email',)
+    readonly_fields = ('user', 'cart', 'total', 'currency', 'item_count', 'created_at')
+    inlines = [OrderLineInline]
+
+
+# =============================
+# 🔹 Archives (lecture seule)
+# =============================
+class ArchivedItemImageInline(admin.TabularInline):
+    model = ArchivedItemImage
+    readonly_fields = ('id', 'image', 'updated_at')
+    can_delete = False
+    extra = 0
+
+    def has_add_permission(self, request, obj=None):
+        return False
+
+
+@admin.register(ArchivedItem)
+class ArchivedItemAdmin(ScalableModelAdmin):
+    list_display = ('id', 'title', 'item_type', 'owner', 'reason', 'archived_at')
+    list_select_related = ('owner',)
+    list_filter = ('item_type', 'reason')
+    search_fields = ('=id', '=owner__email')
+    raw_id_fields = ('owner',)
+    inlines = [ArchivedItemImageInline]
+
+    def has_change_permission(self, request, obj=None):
+        return False
@@ -0,0 +1,101 @@
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Exists, OuterRef, Q
+from django.utils import timezone
+
+from .media import acquire_names
+from .models import ArchivedItem, ArchivedItemImage, CartItem, Item, ItemImage, ItemVector, OrderLine, Reservation
+from .signals import items_bulk_deleted
+
+
+ITEM_FIELDS = (
+    'id', 'title', 'description', 'price', 'item_type', 'owner_id', 'city', 'address',
+    'contact_phone', 'image', 'is_available', 'created_at', 'updated_at',
+)
+
+
+def candidates(now=None):
+    """Annonces vendues/retirées depuis longtemps, ou en ligne mais périmées, sans réservation active."""
+    now = now or timezone.now()
+    unavailable_before = now - timedelta(days=settings.ARCHIVE_UNAVAILABLE_AFTER_DAYS)
+    stale_before = now - timedelta(days=settings.ARCHIVE_STALE_AFTER_DAYS)
+    held = Reservation.objects.filter(item=OuterRef('pk'), status='ACTIVE', expires_at__gt=now)
+    return (
+        Item.objects.filter(
+            Q(is_available=False, updated_at__lt=unavailable_before)
+            | Q(updated_at__lt=stale_before)
+        )
+        .exclude(Exists(held))
+        .order_by('updated_at', 'id')
+    )
+
+
+def _delete_rows(model, field, ids):
+    """DELETE … WHERE field IN (ids) sans passer par le Collector : aucun signal par ligne."""
+    if not ids:
+        return
+    table = connection.ops.quote_name(model._meta.db_table)
+    column = connection.ops.quote_name(model._meta.get_field(field).column)
+    with connection.cursor() as cursor:
+        cursor.execute(f"DELETE FROM {table} WHERE {column} IN ({', '.join(['%s'] * len(ids))})", list(ids))
+
+
+def archive_batch(batch_size=None, dry_run=False):
+    """
+    Déplace un lot d'annonces (et leurs images) vers les tables d'archive,
+    dans une transaction. Les lignes sont verrouillées avec SKIP LOCKED pour
+    ne jamais attendre un checkout en cours. Les fichiers gardent leur
+    référence : l'archive en prend une avant que la suppression ne rende
+    celle de l'annonce. La suppression se fait table par table, sans signal
+    par ligne : un seul `items_bulk_deleted` par lot fait le reste.
+    Renvoie les ids archivés.
+    """
+    batch_size = batch_size or settings.ARCHIVE_BATCH_SIZE
+    now = timezone.now()
+    unavailable_before = now - timedelta(days=settings.ARCHIVE_UNAVAILABLE_AFTER_DAYS)
+    with transaction.atomic():
+        rows = list(
+            candidates(now).select_for_update(skip_locked=True)
+            .values(*ITEM_FIELDS)[:batch_size]
+        )
+        if not rows or dry_run:
+            return [row['id'] for row in rows]
+        ids = [row['id'] for row in rows]
+        images = list(ItemImage.objects.filter(item_id__in=ids).values('id', 'item_id', 'image', 'updated_at'))
+
+        ArchivedItem.objects.bulk_create([
+            ArchivedItem(
+                **row,
+                reason='unavailable' if not row['is_available'] and row['updated_at'] < unavailable_before else 'stale',
+            )
+            for row in rows
+        ])
+        ArchivedItemImage.objects.bulk_create([ArchivedItemImage(**image) for image in images])
+        acquire_names([image['image'] for image in images])
+
+        # Dépendances de Item (CASCADE / SET_NULL), puis les annonces elles-mêmes
+        OrderLine.objects.filter(item_id__in=ids).update(item=None)
+        for model in (ItemImage, CartItem, Reservation, ItemVector):
+            _delete_rows(model, 'item', ids)
+        _delete_rows(Item, 'id', ids)
+        # Tombstones du flux de changements, références média, caches, voisins, statistiques
+        items_bulk_deleted.send(sender=Item, rows=rows, images=images)
+    return ids
+
+
+def archive(batch_size=None, max_batches=None, pause=0.0, dry_run=False):
+    """Enchaîne les lots jusqu'à épuisement ; `pause` laisse respirer la base entre deux."""
+    total = 0
+    batches = 0
+    while max_batches is None or batches < max_batches:
+        ids = archive_batch(batch_size, dry_run=dry_run)
+        total += len(ids)
+        batches += 1
+        if dry_run or len(ids) < (batch_size or settings.ARCHIVE_BATCH_SIZE):
+            break
+        if pause:
+            time.sleep(pause)
+    return total
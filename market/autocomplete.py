@@ -0,0 +1,326 @@
+"""
+Autocomplétion des recherches servie depuis la mémoire du worker.
+
+Deux index de préfixes en tableaux triés : les mots des titres et les
+villes des annonces disponibles, classés par nombre d'annonces. L'index est
+construit au démarrage du worker (gunicorn.conf.post_worker_init) ou à la
+première requête, tenu à jour par les signaux Item du process, et rattrape
+les écritures des autres process en relisant l'index (updated_at, id) au
+plus toutes les AUTOCOMPLETE_SYNC_INTERVAL secondes.
+"""
+import bisect
+import heapq
+import re
+import sys
+import threading
+import time
+import unicodedata
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import close_old_connections
+from django.utils import timezone
+
+from .changes import rows_after
+from .models import DeletionLog, Item
+from .similar import STOPWORDS
+
+
+ROW_FIELDS = ('id', 'title', 'city', 'is_available', 'updated_at')
+WORD = re.compile(r'\w+')
+
+
+def normalize(text):
+    return unicodedata.normalize('NFKD', text or '').encode('ascii', 'ignore').decode().lower().strip()
+
+
+def title_words(title):
+    """{mot normalisé: libellé} des mots utiles d'un titre."""
+    words = {}
+    for word in WORD.findall(title or ''):
+        key = normalize(word)
+        if len(key) > 1 and key not in STOPWORDS and not key.isdigit():
+            words.setdefault(sys.intern(key), word.lower())
+    return words
+
+
+# ===================================
+# 🔹 Index de préfixes : tableau trié + compteurs
+# ===================================
+class PrefixIndex:
+    """
+    `keys` est trié : les termes d'un préfixe forment une plage contiguë
+    (bisect). Un terme retombé à zéro reste dans le tableau (ignoré) pour
+    ne pas décaler la liste ; au-delà de COMPACT_RATIO du tableau, ces
+    termes morts sont écartés par `compacted()` (appelé au rattrapage).
+
+    Les préfixes courts (HEAD_DEPTH caractères au plus) couvrent des plages
+    trop longues pour être classées à chaque frappe : leurs HEAD_SIZE
+    meilleurs termes sont gardés à jour à chaque incrément, et recalculés
+    à la demande après une baisse. Seuls les termes vivants comptent dans
+    la borne `max_terms` : un terme mort laisse sa place à un nouveau.
+    """
+
+    HEAD_DEPTH = 2
+    HEAD_SIZE = 20
+    COMPACT_RATIO = 0.25
+
+    def __init__(self, max_terms):
+        self.max_terms = max_terms
+        self.keys = []
+        self.counts = {}
+        self.labels = {}
+        self.live = 0  # termes de compteur non nul
+        self.dropped = 0
+        self._heads = {}  # préfixe court → meilleurs termes, dans l'ordre
+
+    @classmethod
+    def build(cls, counts, labels, max_terms):
+        index = cls(max_terms)
+        kept = heapq.nlargest(max_terms, counts, key=counts.get) if len(counts) > max_terms else counts
+        index.keys = sorted(kept)
+        index.counts = {key: counts[key] for key in index.keys}
+        index.labels = {key: labels[key] for key in index.keys}
+        index.live = len(index.keys)
+        index.dropped = len(counts) - len(index.keys)
+        return index
+
+    @property
+    def dead(self):
+        return len(self.keys) - self.live
+
+    def needs_compaction(self):
+        return self.dead > self.COMPACT_RATIO * len(self.keys)
+
+    def compacted(self):
+        """Nouvel index sans les termes morts : les lectures en cours gardent l'ancien, intact."""
+        index = self.build({key: count for key, count in self.counts.items() if count}, self.labels, self.max_terms)
+        index.dropped = self.dropped
+        return index
+
+    def _rank(self, key):
+        return (-self.counts[key], len(key), key)
+
+    def _scan(self, prefix, limit):
+        start = bisect.bisect_left(self.keys, prefix)
+        end = bisect.bisect_left(self.keys, prefix + '\uffff', start)
+        return heapq.nsmallest(limit, (key for key in self.keys[start:end] if self.counts[key]), key=self._rank)
+
+    def add(self, key, label):
+        """Compte le terme ; False s'il n'a pas sa place dans l'index (vocabulaire plein)."""
+        count = self.counts.get(key)
+        if count:
+            self.counts[key] = count + 1
+        elif self.live >= self.max_terms:
+            self.dropped += 1
+            return False
+        else:
+            if count is None:
+                bisect.insort(self.keys, key)
+                self.labels[key] = label
+            self.counts[key] = 1
+            self.live += 1
+        for depth in range(1, min(len(key), self.HEAD_DEPTH) + 1):
+            head = self._heads.get(key[:depth])
+            if head is not None:
+                # Nouvelle liste plutôt que tri sur place : les lectures se font sans verrou
+                candidates = head if key in head else [*head, key]
+                self._heads[key[:depth]] = sorted(candidates, key=self._rank)[:self.HEAD_SIZE]
+        return True
+
+    def discard(self, key):
+        if self.counts.get(key):
+            self.counts[key] -= 1
+            if not self.counts[key]:
+                self.live -= 1
+            # Un terme moins bien classé peut céder sa place : recalcul à la demande
+            for depth in range(1, self.HEAD_DEPTH + 1):
+                head = self._heads.get(key[:depth])
+                if head is not None and key in head:
+                    del self._heads[key[:depth]]
+
+    def top(self, prefix, limit):
+        if len(prefix) <= self.HEAD_DEPTH and limit <= self.HEAD_SIZE:
+            head = self._heads.get(prefix)
+            if head is None:
+                head = self._heads[prefix] = self._scan(prefix, self.HEAD_SIZE)
+            best = head[:limit]
+        else:
+            best = self._scan(prefix, limit)
+        return [{'text': self.labels[key], 'count': self.counts[key]} for key in best]
+
+    def __len__(self):
+        return self.live
+
+
+# ===================================
+# 🔹 Index du worker
+# ===================================
+class Autocomplete:
+    def __init__(self):
+        self.titles = None
+        self.cities = None
+        self._items = {}  # id → (mots du titre, ville) comptés dans les index
+        self.dropped_items = 0
+        self._lock = threading.RLock()
+        self._sync_lock = threading.Lock()
+        self._position = None
+        self._deleted_position = None
+        self._synced_at = 0.0
+
+    @property
+    def ready(self):
+        return self.titles is not None
+
+    # --- construction complète ---
+    def build(self):
+        started = timezone.now() - timedelta(seconds=settings.CHANGE_FEED_LAG)
+        title_counts, title_labels = {}, {}
+        city_counts, city_labels = {}, {}
+        entries, dropped_items = [], 0
+        rows = Item.objects.filter(is_available=True).values_list('id', 'title', 'city')
+        for item_id, title, city in rows.iterator(chunk_size=2000):
+            words = title_words(title)
+            city_key = sys.intern(normalize(city)) if city else None
+            if not (words or city_key):
+                continue
+            if len(entries) >= settings.AUTOCOMPLETE_MAX_ITEMS:
+                dropped_items += 1
+                continue
+            for key, label in words.items():
+                title_counts[key] = title_counts.get(key, 0) + 1
+                title_labels.setdefault(key, label)
+            if city_key:
+                city_counts[city_key] = city_counts.get(city_key, 0) + 1
+                city_labels.setdefault(city_key, city.strip())
+            entries.append((item_id, tuple(words), city_key))
+
+        titles = PrefixIndex.build(title_counts, title_labels, settings.AUTOCOMPLETE_MAX_TERMS)
+        cities = PrefixIndex.build(city_counts, city_labels, settings.AUTOCOMPLETE_MAX_TERMS)
+        # Seuls les termes gardés sont retenus par annonce : ce sont eux qu'un retrait décompte
+        items = {}
+        for item_id, words, city_key in entries:
+            words = tuple(key for key in words if key in titles.counts)
+            city_key = city_key if city_key in cities.counts else None
+            if words or city_key:
+                items[item_id] = (words, city_key)
+        with self._lock:
+            self.titles, self.cities, self._items = titles, cities, items
+            self.dropped_items = dropped_items
+            # Rejoue ce qui a pu changer pendant la lecture
+            self._position = self._deleted_position = (started, 0)
+            self._synced_at = time.monotonic()
+
+    def ensure_built(self):
+        if not self.ready:
+            with self._lock:
+                if not self.ready:
+                    self.build()
+
+    def warm(self):
+        """Construction en tâche de fond (démarrage du worker)."""
+        def run():
+            try:
+                self.ensure_built()
+            finally:
+                close_old_connections()
+
+        threading.Thread(target=run, name='autocomplete-warm', daemon=True).start()
+
+    # --- mises à jour incrémentales ---
+    def _index(self, item_id, words, city_key, city_label):
+        """
+        Remplace l'entrée de l'annonce ; seuls les termes qui changent sont
+        comptés, et seuls ceux admis dans l'index sont retenus pour l'annonce.
+        """
+        old_words, old_city = self._items.pop(item_id, ((), None))
+        if (words or city_key) and not (old_words or old_city) and len(self._items) >= settings.AUTOCOMPLETE_MAX_ITEMS:
+            self.dropped_items += 1
+            return
+        kept = [key for key in old_words if key in words]
+        for key in set(old_words) - words.keys():
+            self.titles.discard(key)
+        for key in words.keys() - set(old_words):
+            if self.titles.add(key, words[key]):
+                kept.append(key)
+        if old_city != city_key:
+            if old_city:
+                self.cities.discard(old_city)
+            if city_key and not self.cities.add(city_key, city_label):
+                city_key = None
+        if kept or city_key:
+            self._items[item_id] = (tuple(kept), city_key)
+
+    def _compact(self):
+        if self.titles.needs_compaction():
+            self.titles = self.titles.compacted()
+        if self.cities.needs_compaction():
+            self.cities = self.cities.compacted()
+
+    def apply(self, rows):
+        """Lignes (champs ROW_FIELDS) lues en base ou issues d'un signal."""
+        if not self.ready:
+            return
+        with self._lock:
+            for row in rows:
+                if not row['is_available']:
+                    self._index(row['id'], {}, None, None)
+                    continue
+                city = (row['city'] or '').strip()
+                self._index(row['id'], title_words(row['title']), sys.intern(normalize(city)) or None, city)
+
+    def remove(self, ids):
+        if not self.ready:
+            return
+        with self._lock:
+            for item_id in ids:
+                self._index(item_id, {}, None, None)
+
+    def sync(self):
+        """Rattrape les écritures des autres process ; une seule requête à la fois s'en charge."""
+        if time.monotonic() - self._synced_at < settings.AUTOCOMPLETE_SYNC_INTERVAL:
+            return
+        if not self._sync_lock.acquire(blocking=False):
+            return
+        try:
+            self._synced_at = time.monotonic()
+            upper = timezone.now() - timedelta(seconds=settings.CHANGE_FEED_LAG)
+            rows = rows_after(Item, 'updated_at', self._position, upper, ROW_FIELDS, settings.AUTOCOMPLETE_SYNC_BATCH)
+            deleted = rows_after(
+                DeletionLog, 'deleted_at', self._deleted_position, upper,
+                ('id', 'kind', 'object_id', 'deleted_at'), settings.AUTOCOMPLETE_SYNC_BATCH,
+            )
+            self.apply(rows)
+            self.remove([row['object_id'] for row in deleted if row['kind'] == 'item'])
+            with self._lock:
+                self._compact()
+                self._position = (rows[-1]['updated_at'], rows[-1]['id']) if rows else (upper, 0)
+                self._deleted_position = (deleted[-1]['deleted_at'], deleted[-1]['id']) if deleted else (upper, 0)
+            if len(rows) > settings.AUTOCOMPLETE_SYNC_BATCH or len(deleted) > settings.AUTOCOMPLETE_SYNC_BATCH:
+                self._synced_at = 0.0  # retard à rattraper : la requête suivante continue
+        finally:
+            self._sync_lock.release()
+
+    # --- lecture ---
+    def suggest(self, query, limit):
+        self.ensure_built()
+        self.sync()
+        text = normalize(query)
+        words = WORD.findall(text)
+        return {
+            'titles': self.titles.top(words[-1], limit) if words else [],
+            'cities': self.cities.top(text, limit) if text else [],
+        }
+
+    def stats(self):
+        return {
+            'ready': self.ready,
+            'items': len(self._items),
+            'title_terms': len(self.titles) if self.ready else 0,
+            'city_terms': len(self.cities) if self.ready else 0,
+            'dropped_terms': (self.titles.dropped + self.cities.dropped) if self.ready else 0,
+            'dropped_items': self.dropped_items,
+        }
+
+
+index = Autocomplete()
@@ -0,0 +1,65 @@
+from django.db import transaction
+from django.db.models import Case, F, Value, When
+from django.utils import timezone
+
+from .models import Item
+from .signals import items_bulk_updated
+
+
+# Champs modifiables en masse : ni la ville ni le type, qui déplacent
+# l'annonce entre groupes de statistiques et de voisinage
+BULK_FIELDS = ('title', 'description', 'price', 'contact_phone', 'is_available')
+
+
+class BulkUpdateError(Exception):
+    """Requête de modification groupée invalide (réponse 400)."""
+
+    def __init__(self, message, errors=None):
+        super().__init__(message)
+        self.errors = errors
+
+
+class NotOwned(Exception):
+    """Annonces absentes ou appartenant à un autre vendeur (réponse 403)."""
+
+    def __init__(self, item_ids):
+        super().__init__("Annonces introuvables ou appartenant à un autre vendeur.")
+        self.item_ids = item_ids
+
+
+def _case(field, changes):
+    output_field = Item._meta.get_field(field)
+    whens = [
+        When(id=item_id, then=Value(values[field], output_field=output_field))
+        for item_id, values in changes.items() if field in values
+    ]
+    return Case(*whens, default=F(field), output_field=output_field)
+
+
+def update_items(owner, item_type, changes):
+    """
+    Applique `changes` ({id: {champ: valeur}}) aux annonces `item_type` de
+    `owner`, en un contrôle de propriété puis un seul UPDATE : direct si
+    toutes les annonces reçoivent les mêmes valeurs, sinon un CASE par
+    champ. Les récepteurs de `items_bulk_updated` prennent le relais
+    (caches, tableau de bord, statistiques, voisins, SSE).
+    """
+    ids = sorted(changes)
+    owned = set(
+        Item.objects.filter(id__in=ids, owner=owner, item_type=item_type).values_list('id', flat=True)
+    )
+    missing = [item_id for item_id in ids if item_id not in owned]
+    if missing:
+        raise NotOwned(missing)
+
+    patches = list(changes.values())
+    if all(patch == patches[0] for patch in patches):
+        values = dict(patches[0])
+    else:
+        fields = sorted({field for patch in patches for field in patch})
+        values = {field: _case(field, changes) for field in fields}
+
+    with transaction.atomic():
+        updated = Item.objects.filter(id__in=ids, owner=owner).update(**values, updated_at=timezone.now())
+        items_bulk_updated.send(sender=Item, ids=ids)
+    return updated
@@ -0,0 +1,200 @@
+import threading
+import time
+from collections import Counter, OrderedDict
+
+from django.conf import settings
+from django.core.cache import caches
+
+
+_MISSING = object()
+
+
+# ===================================
+# 🔹 Niveau 1 : LRU borné en mémoire du process
+# ===================================
+class LocalLRU:
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """Renvoie (trouvé, valeur)."""
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return False, None
+            value, expires = entry
+            if expires < time.monotonic():
+                del self._data[key]
+                return False, None
+            self._data.move_to_end(key)
+            return True, value
+
+    def set(self, key, value, ttl):
+        with self._lock:
+            self._data[key] = (value, time.monotonic() + ttl)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def delete_prefix(self, prefix):
+        with self._lock:
+            for key in [k for k in self._data if k.startswith(prefix)]:
+                del self._data[key]
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+
+# ===================================
+# 🔹 Cache à deux niveaux (local + partagé)
+# ===================================
+class TwoLevelCache:
+    """
+    LRU local devant le cache partagé (settings.CACHES). Les clés sont
+    rangées par namespace versionné : `invalidate("items")` incrémente la
+    version dans le cache partagé, ce qui rend toutes les anciennes clés
+    inaccessibles sans les parcourir. Chaque worker relit la version au plus
+    toutes les VERSION_TTL secondes, ce qui borne la péremption locale. Les
+    versions connues du worker sont gardées dans un LRU borné (un namespace
+    par vendeur pour les tableaux de bord).
+    """
+
+    def __init__(self, alias=None, max_entries=None, local_ttl=None, version_ttl=None):
+        conf = getattr(settings, 'APP_CACHE', {})
+        self.alias = alias or conf.get('SHARED_ALIAS', 'default')
+        self.local_ttl = local_ttl if local_ttl is not None else conf.get('LOCAL_TTL', 30)
+        self.version_ttl = version_ttl if version_ttl is not None else conf.get('VERSION_TTL', 2)
+        self.lock_timeout = conf.get('LOCK_TIMEOUT', 10)
+        self.local = LocalLRU(max_entries or conf.get('LOCAL_MAX_ENTRIES', 2048))
+        self.counters = Counter()
+        self._versions = LocalLRU(conf.get('MAX_NAMESPACES', 4096))
+        self._key_locks = {}
+        self._guard = threading.Lock()
+
+    @property
+    def shared(self):
+        return caches[self.alias]
+
+    # --- versions de namespace ---
+    def _version(self, namespace):
+        found, version = self._versions.get(namespace)
+        if found:
+            return version
+        version = self.shared.get(f"ns:{namespace}")
+        if version is None:
+            self.shared.add(f"ns:{namespace}", 1, None)
+            version = self.shared.get(f"ns:{namespace}", 1)
+        self._versions.set(namespace, version, self.version_ttl)
+        return version
+
+    def make_key(self, namespace, key):
+        return f"{namespace}:{self._version(namespace)}:{key}"
+
+    # --- lecture / écriture ---
+    def _lookup(self, full_key, count=True):
+        found, value = self.local.get(full_key)
+        if found:
+            if count:
+                self.counters['local_hits'] += 1
+            return value
+        value = self.shared.get(full_key, _MISSING)
+        if value is not _MISSING:
+            if count:
+                self.counters['shared_hits'] += 1
+            self.local.set(full_key, value, self.local_ttl)
+            return value
+        if count:
+            self.counters['misses'] += 1
+        return _MISSING
+
+    def get(self, namespace, key, default=None):
+        value = self._lookup(self.make_key(namespace, key))
+        return default if value is _MISSING else value
+
+    def set(self, namespace, key, value, ttl=300):
+        full_key = self.make_key(namespace, key)
+        self.shared.set(full_key, value, ttl)
+        self.local.set(full_key, value, min(ttl, self.local_ttl))
+        self.counters['sets'] += 1
+
+    def delete(self, namespace, key):
+        full_key = self.make_key(namespace, key)
+        self.shared.delete(full_key)
+        self.local.delete(full_key)
+
+    def get_or_set(self, namespace, key, producer, ttl=300):
+        """
+        Renvoie la valeur en cache ou la calcule avec `producer()`.
+        Anti-stampede : un seul thread par process (verrou local) et un seul
+        process (verrou `add` dans le cache partagé) recalcule une clé
+        manquante ; les autres attendent sa valeur jusqu'à LOCK_TIMEOUT.
+        """
+        full_key = self.make_key(namespace, key)
+        value = self._lookup(full_key)
+        if value is not _MISSING:
+            return value
+
+        with self._guard:
+            key_lock = self._key_locks.setdefault(full_key, threading.Lock())
+        with key_lock:
+            try:
+                value = self._lookup(full_key, count=False)
+                if value is not _MISSING:
+                    return value
+
+                lock_key = f"lock:{full_key}"
+                acquired = self.shared.add(lock_key, 1, self.lock_timeout)
+                if not acquired:
+                    self.counters['lock_waits'] += 1
+                    deadline = time.monotonic() + self.lock_timeout
+                    while time.monotonic() < deadline:
+                        time.sleep(0.05)
+                        value = self.shared.get(full_key, _MISSING)
+                        if value is not _MISSING:
+                            self.local.set(full_key, value, min(ttl, self.local_ttl))
+                            return value
+                try:
+                    value = producer()
+                    self.shared.set(full_key, value, ttl)
+                    self.local.set(full_key, value, min(ttl, self.local_ttl))
+                    self.counters['sets'] += 1
+                finally:
+                    if acquired:
+                        self.shared.delete(lock_key)
+                return value
+            finally:
+                with self._guard:
+                    self._key_locks.pop(full_key, None)
+
+    # --- invalidation ---
+    def invalidate(self, namespace):
+        try:
+            version = self.shared.incr(f"ns:{namespace}")
+        except ValueError:
+            self.shared.add(f"ns:{namespace}", 2, None)
+            version = self.shared.get(f"ns:{namespace}", 2)
+        self._versions.set(namespace, version, self.version_ttl)
+        self.local.delete_prefix(f"{namespace}:")
+        self.counters['invalidations'] += 1
+
+    def stats(self):
+        lookups = self.counters['local_hits'] + self.counters['shared_hits'] + self.counters['misses']
+        hits = self.counters['local_hits'] + self.counters['shared_hits']
+        return {
+            **self.counters,
+            'local_entries': len(self.local),
+            'hit_rate': round(hits / lookups, 4) if lookups else None,
+        }
+
+
+app_cache = TwoLevelCache()
@@ -0,0 +1,112 @@
+import base64
+import json
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+from django.conf import settings
+from django.db.models import Q
+from django.utils import timezone
+
+from .models import DeletionLog, Item, ItemImage
+
+
+ITEM_FIELDS = (
+    'id', 'title', 'description', 'price', 'item_type', 'city', 'address',
+    'contact_phone', 'is_available', 'owner_id', 'created_at', 'updated_at',
+)
+IMAGE_FIELDS = ('id', 'item_id', 'image', 'updated_at')
+DELETION_FIELDS = ('id', 'kind', 'object_id', 'parent_id', 'deleted_at')
+
+# flux → (modèle, colonne horodatée, champs renvoyés)
+STREAMS = {
+    'items': (Item, 'updated_at', ITEM_FIELDS),
+    'images': (ItemImage, 'updated_at', IMAGE_FIELDS),
+    'deleted': (DeletionLog, 'deleted_at', DELETION_FIELDS),
+}
+
+EPOCH = datetime(1970, 1, 1, tzinfo=dt_timezone.utc)
+
+
+class CursorError(Exception):
+    pass
+
+
+class CursorExpired(Exception):
+    pass
+
+
+# ===================================
+# 🔹 Curseur opaque : position (horodatage, id) par flux
+# ===================================
+def encode_cursor(positions):
+    raw = {name: [ts.isoformat(), pk] for name, (ts, pk) in positions.items()}
+    return base64.urlsafe_b64encode(json.dumps(raw, separators=(',', ':')).encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    try:
+        raw = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+        return {name: (datetime.fromisoformat(raw[name][0]), int(raw[name][1])) for name in STREAMS}
+    except (ValueError, KeyError, TypeError, IndexError):
+        raise CursorError("Curseur invalide.")
+
+
+def initial_positions(now):
+    # Premier passage : tout le catalogue, et les suppressions à partir de maintenant
+    return {'items': (EPOCH, 0), 'images': (EPOCH, 0), 'deleted': (now, 0)}
+
+
+# ===================================
+# 🔁 Lecture du flux
+# ===================================
+def rows_after(model, column, position, upper, fields, limit):
+    ts, pk = position
+    # Keyset sur l'index (colonne, id) : strictement après la position du curseur
+    rows = (
+        model.objects.filter(Q(**{f"{column}__gt": ts}) | Q(**{column: ts, 'id__gt': pk}))
+        .filter(**{f"{column}__lte": upper})
+        .order_by(column, 'id')
+        .values(*fields)[:limit + 1]
+    )
+    return list(rows)
+
+
+def read_changes(cursor=None, limit=None):
+    """
+    Annonces et images créées ou modifiées, et suppressions, depuis `cursor`.
+
+    Les horodatages sont posés à l'écriture, pas au commit : une ligne peut
+    devenir visible après qu'un curseur plus récent a déjà été rendu. Les
+    lignes plus récentes que CHANGE_FEED_LAG secondes sont donc laissées
+    pour le prochain appel. C'est une marge, pas une garantie : une
+    transaction restée ouverte plus longtemps que CHANGE_FEED_LAG (ou une
+    horloge de serveur en retard d'autant) publie derrière le curseur, et
+    la ligne n'est revue qu'à sa prochaine modification ou à une
+    resynchronisation complète. CHANGE_FEED_LAG doit donc dépasser la durée
+    de la plus longue transaction d'écriture sur ces tables.
+    """
+    limit = limit or settings.CHANGE_FEED_PAGE_SIZE
+    now = timezone.now()
+    upper = now - timedelta(seconds=settings.CHANGE_FEED_LAG)
+    if cursor:
+        positions = decode_cursor(cursor)
+        if positions['deleted'][0] < now - timedelta(days=settings.CHANGE_FEED_RETENTION_DAYS):
+            raise CursorExpired("Curseur trop ancien : resynchronisation complète nécessaire.")
+    else:
+        positions = initial_positions(upper)
+
+    result = {'has_more': False}
+    for name, (model, column, fields) in STREAMS.items():
+        rows = rows_after(model, column, positions[name], upper, fields, limit)
+        if len(rows) > limit:
+            rows = rows[:limit]
+            result['has_more'] = True
+            positions[name] = (rows[-1][column], rows[-1]['id'])
+        elif not rows or rows[-1][column] < upper:
+            # Flux épuisé : le curseur avance jusqu'à la borne lue
+            positions[name] = (upper, 0)
+        else:
+            positions[name] = (rows[-1][column], rows[-1]['id'])
+        result[name] = rows
+    result['cursor'] = encode_cursor(positions)
+    return result
+
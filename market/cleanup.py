@@ -0,0 +1,172 @@
+import time
+from collections import Counter
+from datetime import timedelta
+
+from django.conf import settings
+from django.contrib.sessions.models import Session
+from django.db import transaction
+from django.db.models import Exists, OuterRef
+from django.utils import timezone
+
+from .media import release_name
+from .models import Cart, CartItem, DeletionLog, IdempotencyKey, Job, Payment, Reservation, ThrottleCounter, UploadSession
+from .uploads import discard_parts
+
+
+# ===================================
+# 🔹 Suppression par lots de clés primaires croissantes
+# ===================================
+def in_batches(queryset, batch_size, pause=0.0):
+    """
+    Itère sur les clés primaires de `queryset` par lots croissants (keyset
+    sur pk) : chaque lecture est bornée par l'index de clé primaire, et le
+    traitement de chaque lot tient dans une transaction courte. `pause`
+    secondes entre deux lots laissent passer le trafic (et les réplicas).
+    """
+    last = None
+    while True:
+        page = queryset if last is None else queryset.filter(pk__gt=last)
+        ids = list(page.order_by('pk').values_list('pk', flat=True)[:batch_size])
+        if not ids:
+            return
+        last = ids[-1]
+        yield ids
+        if len(ids) < batch_size:
+            return
+        if pause:
+            time.sleep(pause)
+
+
+def purge(queryset, batch_size, pause=0.0, dry_run=False, before_delete=None):
+    """
+    Supprime `queryset` par lots ; renvoie {modèle: lignes} (cascades
+    comprises). `before_delete` reçoit le lot verrouillé, dans la
+    transaction de sa suppression.
+    """
+    removed = Counter()
+    for ids in in_batches(queryset, batch_size, pause):
+        if dry_run:
+            removed[queryset.model._meta.label] += len(ids)
+            continue
+        with transaction.atomic():
+            # Condition rejouée : une ligne redevenue vivante entre-temps est épargnée
+            batch = queryset.filter(pk__in=ids)
+            if before_delete:
+                # Lignes verrouillées : le hook voit exactement ce qui sera supprimé
+                before_delete(batch.select_for_update())
+            _, per_model = batch.delete()
+        removed.update(per_model)
+    return removed
+
+
+# ===================================
+# 🧹 Cibles du nettoyage
+# ===================================
+def _days(key):
+    return timedelta(days=settings.CLEANUP[key])
+
+
+def expired_sessions(now):
+    return Session.objects.filter(expire_date__lt=now)
+
+
+def empty_carts(now):
+    # Recréés à la demande (get_or_create) au prochain ajout
+    return Cart.objects.filter(created_at__lt=now - _days('EMPTY_CART_DAYS')).exclude(
+        Exists(CartItem.objects.filter(cart=OuterRef('pk')))
+    )
+
+
+def abandoned_carts(now):
+    # Activité du panier lui-même : la connexion par e-mail ne touche pas last_login
+    pending = Payment.objects.filter(cart=OuterRef('pk'), status='PENDING')
+    return Cart.objects.filter(updated_at__lt=now - _days('ABANDONED_CART_DAYS')).exclude(Exists(pending))
+
+
+def stale_pending_payments(now):
+    return Payment.objects.filter(
+        status='PENDING', created_at__lt=now - timedelta(hours=settings.CLEANUP['PENDING_PAYMENT_HOURS'])
+    )
+
+
+def finished_jobs(now):
+    return Job.objects.filter(status='DONE', updated_at__lt=now - _days('FINISHED_JOB_DAYS'))
+
+
+def closed_reservations(now):
+    return Reservation.objects.exclude(status='ACTIVE').filter(updated_at__lt=now - _days('CLOSED_RESERVATION_DAYS'))
+
+
+def stale_upload_sessions(now):
+    # Uploads terminés jamais utilisés compris : leur référence média est rendue
+    return UploadSession.objects.filter(updated_at__lt=now - _days('UPLOAD_SESSION_DAYS'))
+
+
+def expired_idempotency_keys(now):
+    # Seule purge des clés d'idempotence (ancienne commande purge_idempotency_keys retirée)
+    return IdempotencyKey.objects.filter(expires_at__lte=now)
+
+
+def old_tombstones(now):
+    return DeletionLog.objects.filter(deleted_at__lt=now - timedelta(days=settings.CHANGE_FEED_RETENTION_DAYS))
+
+
+def expired_throttle_counters(now):
+    return ThrottleCounter.objects.filter(expires_at__lt=now)
+
+
+def _release_upload_sessions(batch):
+    for session in batch.only('pk', 'status', 'stored_name'):
+        if session.status == 'UPLOADING':
+            discard_parts(session)
+        elif session.status == 'COMPLETE':
+            release_name(session.stored_name)
+
+
+# cible → (queryset à purger, hook avant suppression)
+TARGETS = {
+    'sessions': (expired_sessions, None),
+    'empty_carts': (empty_carts, None),
+    'abandoned_carts': (abandoned_carts, None),
+    'jobs': (finished_jobs, None),
+    'reservations': (closed_reservations, None),
+    'uploads': (stale_upload_sessions, _release_upload_sessions),
+    'idempotency_keys': (expired_idempotency_keys, None),
+    'tombstones': (old_tombstones, None),
+    'throttle_counters': (expired_throttle_counters, None),
+}
+# Les paiements ne sont jamais supprimés : rapprochés du fournisseur, qui tranche
+PAYMENT_TARGET = 'pending_payments'
+
+
+def reconcile_stale_payments(batch_size, pause=0.0, dry_run=False):
+    """Paiements restés PENDING confiés à leur fournisseur (tasks.abandon_payments)."""
+    from .tasks import abandon_payments
+
+    queued = Counter()
+    queryset = stale_pending_payments(timezone.now())
+    for ids in in_batches(queryset, batch_size, pause):
+        if dry_run:
+            queued['market.Payment'] += len(ids)
+            continue
+        queued['market.Payment'] += abandon_payments(queryset.filter(pk__in=ids))
+    return queued
+
+
+def run(targets=None, batch_size=None, pause=None, dry_run=False):
+    """
+    Nettoie les cibles demandées (toutes par défaut) et renvoie le rapport
+    {cible: {'rows': {modèle: lignes}, 'seconds': durée}}.
+    """
+    batch_size = batch_size or settings.CLEANUP['BATCH_SIZE']
+    pause = settings.CLEANUP['PAUSE'] if pause is None else pause
+    report = {}
+    for target in targets or [*TARGETS, PAYMENT_TARGET]:
+        started = time.monotonic()
+        if target == PAYMENT_TARGET:
+            rows = reconcile_stale_payments(batch_size, pause, dry_run)
+        else:
+            build, before_delete = TARGETS[target]
+            rows = purge(build(timezone.now()), batch_size, pause, dry_run, before_delete)
+        report[target] = {'rows': dict(rows), 'seconds': round(time.monotonic() - started, 2)}
+    return report
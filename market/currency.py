@@ -0,0 +1,115 @@
+import logging
+import time
+from decimal import ROUND_HALF_UP, Decimal
+
+from django.conf import settings
+from django.db import transaction
+
+from .cache import app_cache
+
+
+logger = logging.getLogger(__name__)
+
+BASE_CURRENCY = 'MAD'
+CENT = Decimal('0.01')
+RATES_NAMESPACE = 'fx'
+
+
+class UnsupportedCurrency(Exception):
+    pass
+
+
+class RatesUnavailable(Exception):
+    """Aucun taux relu pour cette devise : un montant à encaisser n'est pas converti au taux de secours."""
+
+
+# ===================================
+# 🔹 Table des taux : rafraîchie par un job, jamais pendant une requête
+# ===================================
+def fetch_rates():
+    """Taux 1 MAD → devise d'affichage, lus sur l'API de change (job uniquement)."""
+    import requests  # chargé à la demande (démarrage des workers)
+
+    response = requests.get(settings.EXCHANGE_RATES_URL, timeout=10)
+    response.raise_for_status()
+    rates = response.json()["rates"]
+    return {code: str(rates[code]) for code in settings.DISPLAY_CURRENCIES if code in rates}
+
+
+def refresh_rates():
+    rates = fetch_rates()
+    table = {'rates': rates, 'fetched_at': time.time()}
+    app_cache.set(RATES_NAMESPACE, 'table', table, ttl=settings.EXCHANGE_RATES_TTL)
+    return rates
+
+
+def _schedule_refresh():
+    from .tasks import refresh_exchange_rates
+
+    # Au plus un job par période, quel que soit le nombre de workers
+    if app_cache.shared.add('fx:refresh-scheduled', 1, settings.EXCHANGE_RATES_REFRESH):
+        transaction.on_commit(lambda: refresh_exchange_rates.enqueue())
+
+
+def _fetched_table():
+    """Dernière table relue (LRU local puis partagé) ; son rafraîchissement est mis en file si elle manque ou vieillit."""
+    table = app_cache.get(RATES_NAMESPACE, 'table')
+    if table is None or time.time() - table['fetched_at'] > settings.EXCHANGE_RATES_REFRESH:
+        _schedule_refresh()
+    return table
+
+
+def rate_table():
+    """
+    {devise: Decimal} pour l'affichage. Une table plus vieille que
+    EXCHANGE_RATES_REFRESH reste servie pendant son rafraîchissement ;
+    sans table, taux de secours.
+    """
+    table = _fetched_table()
+    rates = {**settings.EXCHANGE_RATES_FALLBACK, **(table['rates'] if table else {})}
+    rates = {code: Decimal(rates[code]) for code in settings.DISPLAY_CURRENCIES if code in rates}
+    rates[BASE_CURRENCY] = Decimal(1)
+    return rates
+
+
+def conversion_for(code):
+    """(devise, taux) pour ?currency= ; UnsupportedCurrency si inconnue."""
+    code = code.upper()
+    rate = rate_table().get(code)
+    if rate is None:
+        choices = ", ".join([BASE_CURRENCY, *settings.DISPLAY_CURRENCIES])
+        raise UnsupportedCurrency(f"Devise non prise en charge : {code} (au choix : {choices}).")
+    return code, rate
+
+
+def payment_rate(code):
+    """
+    Taux d'un montant à encaisser : uniquement une table relue sur l'API
+    (EXCHANGE_RATES_TTL au plus), jamais les taux de secours des settings.
+    RatesUnavailable sinon : le checkout est refusé plutôt que mal facturé.
+    """
+    table = _fetched_table()
+    rate = table['rates'].get(code) if table else None
+    if rate is None:
+        logger.error("Paiement refusé : aucun taux %s relu (worker run_jobs arrêté ?)", code)
+        raise RatesUnavailable("Taux de change indisponible, réessayez dans quelques minutes.")
+    return Decimal(rate)
+
+
+# ===================================
+# 🔁 Conversion
+# ===================================
+def convert(amount, rate):
+    """Montant converti, arrondi au centime le plus proche (moitié vers le haut)."""
+    return (Decimal(amount) * rate).quantize(CENT, rounding=ROUND_HALF_UP)
+
+
+def convert_rows(rows, conversion):
+    """Ajoute converted_price / converted_currency à chaque ligne sérialisée, en une passe."""
+    if conversion:
+        code, rate = conversion
+        for row in rows:
+            price = row.get('price')
+            row['converted_price'] = str(convert(price, rate)) if price is not None else None
+            row['converted_currency'] = code
+    return rows
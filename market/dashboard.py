@@ -0,0 +1,82 @@
+from decimal import Decimal
+from functools import partial
+
+from django.db import transaction
+from django.db.models import Count, Exists, OuterRef, Sum
+
+from .cache import app_cache
+from .models import CartItem, Item, OrderLine, Payment
+
+
+DASHBOARD_TTL = 300
+CENTS = Decimal('0.01')
+
+
+def namespace(owner_id):
+    # Un namespace par vendeur : invalider un tableau de bord ne touche pas les autres
+    return f"dashboard:{owner_id}"
+
+
+def _amount(value):
+    return str(Decimal(value or 0).quantize(CENTS))  # même format que `price`
+
+
+def compute(owner):
+    """
+    Tableau de bord d'un vendeur en 4 requêtes, quel que soit son nombre
+    d'annonces : compteurs groupés, liste de ses annonces, paniers par annonce
+    et chiffre d'affaires des paiements complétés.
+    """
+    items = Item.objects.filter(owner=owner)
+
+    counts = {key: {"available": 0, "unavailable": 0} for key, _ in Item.TYPE_CHOICES}
+    for row in items.order_by().values('item_type', 'is_available').annotate(n=Count('id')):
+        bucket = counts.setdefault(row['item_type'], {"available": 0, "unavailable": 0})
+        bucket["available" if row['is_available'] else "unavailable"] += row['n']
+
+    in_carts = {
+        row['item_id']: row
+        for row in CartItem.objects.filter(item__owner=owner)
+        .order_by()
+        .values('item_id')
+        .annotate(carts=Count('cart_id', distinct=True), quantity=Sum('quantity'))
+    }
+
+    listings = []
+    for row in items.order_by('-created_at').values('id', 'title', 'item_type', 'is_available', 'price', 'city'):
+        carts = in_carts.get(row['id'], {})
+        listings.append({
+            **row,
+            "price": _amount(row['price']) if row['price'] is not None else None,
+            "in_carts": carts.get('carts', 0),
+            "quantity_in_carts": carts.get('quantity', 0),
+        })
+
+    # Chiffre d'affaires lu sur les lignes de commande figées au paiement
+    paid = Payment.objects.filter(order=OuterRef('order'), status='COMPLETED')
+    revenue = (
+        OrderLine.objects.filter(seller=owner)
+        .filter(Exists(paid))
+        .aggregate(total=Sum('line_total'), units=Sum('quantity'), orders=Count('order', distinct=True))
+    )
+
+    return {
+        "counts": counts,
+        "listings": listings,
+        "revenue": {
+            "total": _amount(revenue['total']),
+            "units": revenue['units'] or 0,
+            "orders": revenue['orders'],
+        },
+    }
+
+
+def get_dashboard(owner):
+    return app_cache.get_or_set(namespace(owner.pk), "summary", lambda: compute(owner), ttl=DASHBOARD_TTL)
+
+
+def invalidate(owner_ids):
+    """Invalide après le commit : une lecture concurrente ne peut pas remettre en cache l'état d'avant."""
+    for owner_id in set(owner_ids):
+        if owner_id:
+            transaction.on_commit(partial(app_cache.invalidate, namespace(owner_id)))
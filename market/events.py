@@ -0,0 +1,159 @@
+import asyncio
+import json
+import threading
+from collections import OrderedDict
+from datetime import timedelta
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.utils import timezone
+
+from .changes import rows_after
+from .models import Item
+
+
+EVENT_FIELDS = ('id', 'title', 'price', 'item_type', 'city', 'is_available', 'owner_id', 'created_at', 'updated_at')
+
+
+def event_for(row, created=None):
+    """listing.created / listing.updated / listing.sold à partir d'une ligne EVENT_FIELDS."""
+    if created is None:
+        # Ligne lue en base : créée si jamais modifiée depuis
+        created = row['updated_at'] - row['created_at'] < timedelta(seconds=1)
+    if created:
+        kind = 'listing.created'
+    elif not row['is_available']:
+        kind = 'listing.sold'
+    else:
+        kind = 'listing.updated'
+    item = {**row, 'price': str(row['price']) if row['price'] is not None else None}
+    return {'type': kind, 'item': item}
+
+
+def format_sse(event):
+    data = json.dumps(event['item'], cls=DjangoJSONEncoder, separators=(',', ':'))
+    return f"event: {event['type']}\ndata: {data}\n\n"
+
+
+# ===================================
+# 🔹 Abonné : une file bornée dans la boucle asyncio de sa connexion
+# ===================================
+class Subscriber:
+    __slots__ = ('loop', 'queue', 'city', 'item_type', 'overflowed')
+
+    def __init__(self, loop, city=None, item_type=None, queue_size=100):
+        self.loop = loop
+        self.queue = asyncio.Queue(maxsize=queue_size)
+        self.city = city.lower() if city else None
+        self.item_type = item_type
+        self.overflowed = False
+
+    def matches(self, event):
+        item = event['item']
+        if self.item_type and item['item_type'] != self.item_type:
+            return False
+        return not self.city or (item['city'] or '').lower() == self.city
+
+    def offer(self, event):
+        # Exécuté dans la boucle de l'abonné ; un client trop lent est déconnecté
+        try:
+            self.queue.put_nowait(event)
+        except asyncio.QueueFull:
+            self.overflowed = True
+
+
+# ===================================
+# 📣 Diffusion en mémoire du process
+# ===================================
+class Broadcaster:
+    """
+    Diffuse les événements d'annonces aux connexions SSE du process.
+    Deux sources, dédoublonnées par (id, updated_at) :
+    - les signaux Item du process, publiés après commit (latence minimale) ;
+    - une tâche par boucle asyncio qui relit l'index (updated_at, id) toutes
+      les SSE_POLL_INTERVAL secondes tant qu'il y a des abonnés, pour les
+      écritures faites dans d'autres workers ou par `run_jobs`.
+    Le filtrage ville/type se fait à la publication : une connexion inactive
+    ne coûte qu'une file vide et un réveil par heartbeat.
+    """
+
+    def __init__(self, seen_size=10000):
+        self._subscribers = set()
+        self._lock = threading.Lock()
+        self._seen = OrderedDict()
+        self._seen_size = seen_size
+        self._pollers = {}
+
+    def __len__(self):
+        return len(self._subscribers)
+
+    def subscribe(self, city=None, item_type=None):
+        loop = asyncio.get_running_loop()
+        subscriber = Subscriber(loop, city, item_type, settings.SSE_QUEUE_SIZE)
+        with self._lock:
+            self._subscribers.add(subscriber)
+            poller = self._pollers.get(loop)
+            if poller is None or poller.done():
+                self._pollers[loop] = loop.create_task(self._poll(loop))
+        return subscriber
+
+    def unsubscribe(self, subscriber):
+        with self._lock:
+            self._subscribers.discard(subscriber)
+
+    def publish(self, event):
+        """Utilisable depuis n'importe quel thread."""
+        key = (event['item']['id'], event['item']['updated_at'])
+        with self._lock:
+            if key in self._seen:
+                return
+            self._seen[key] = True
+            while len(self._seen) > self._seen_size:
+                self._seen.popitem(last=False)
+            subscribers = [s for s in self._subscribers if s.matches(event)]
+        for subscriber in subscribers:
+            try:
+                subscriber.loop.call_soon_threadsafe(subscriber.offer, event)
+            except RuntimeError:  # boucle fermée (worker arrêté)
+                self.unsubscribe(subscriber)
+
+    def publish_rows(self, rows, created=None):
+        for row in rows:
+            self.publish(event_for(row, created))
+
+    async def _poll(self, loop):
+        position = (timezone.now(), 0)
+        while any(s.loop is loop for s in list(self._subscribers)):
+            await asyncio.sleep(settings.SSE_POLL_INTERVAL)
+            position = await sync_to_async(self._poll_once)(position)
+        with self._lock:
+            self._pollers.pop(loop, None)
+
+    def _poll_once(self, position):
+        upper = timezone.now() - timedelta(seconds=settings.CHANGE_FEED_LAG)
+        rows = rows_after(Item, 'updated_at', position, upper, EVENT_FIELDS, 500)
+        self.publish_rows(rows)
+        return (rows[-1]['updated_at'], rows[-1]['id']) if rows else position
+
+
+broadcaster = Broadcaster()
+
+
+# ===================================
+# 🔌 Flux d'une connexion
+# ===================================
+async def stream(subscriber):
+    """Générateur SSE : événements, et un commentaire heartbeat pendant les silences."""
+    heartbeat = settings.SSE_HEARTBEAT
+    try:
+        yield f"retry: {heartbeat * 1000}\n\n"
+        while not subscriber.overflowed:
+            try:
+                event = await asyncio.wait_for(subscriber.queue.get(), timeout=heartbeat)
+            except asyncio.TimeoutError:
+                yield ": ping\n\n"
+                continue
+            yield format_sse(event)
+    finally:
+        broadcaster.unsubscribe(subscriber)
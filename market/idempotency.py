@@ -0,0 +1,128 @@
+import functools
+import hashlib
+import json
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.response import Response
+
+from .models import IdempotencyKey
+
+
+HEADER = 'Idempotency-Key'
+
+
+def _fingerprint(request):
+    body = json.dumps(request.data, sort_keys=True, default=str)
+    return hashlib.sha256(f"{request.method}:{request.path}:{body}".encode()).hexdigest()
+
+
+def _owner(request):
+    """Appelant auquel la clé est rattachée : utilisateur connecté, sinon email du corps."""
+    if request.user.is_authenticated:
+        return f"user:{request.user.pk}"
+    email = request.data.get('email') if hasattr(request.data, 'get') else None
+    return f"email:{str(email).strip().lower()}"[:255] if email else ''
+
+
+def _claim(key, scope, owner, fingerprint):
+    """
+    Crée la clé (IN_PROGRESS) ; renvoie (record, True) ou (existant, False).
+    Une clé restée IN_PROGRESS plus de IDEMPOTENCY_LOCK_TIMEOUT secondes
+    (processus mort en pleine requête) est reprise par la même requête.
+    """
+    now = timezone.now()
+    expires_at = now + timedelta(seconds=settings.IDEMPOTENCY_KEY_TTL)
+    lookup = {'key': key, 'scope': scope, 'owner': owner}
+    for _ in range(2):
+        try:
+            with transaction.atomic():
+                record = IdempotencyKey.objects.create(**lookup, request_hash=fingerprint, expires_at=expires_at)
+            return record, True
+        except IntegrityError:
+            existing = IdempotencyKey.objects.filter(**lookup).first()
+            if existing is None:
+                continue
+            if existing.expires_at <= now:
+                # Clé expirée : on la remplace
+                IdempotencyKey.objects.filter(pk=existing.pk, expires_at__lte=now).delete()
+                continue
+            stale = now - timedelta(seconds=settings.IDEMPOTENCY_LOCK_TIMEOUT)
+            if existing.status == 'IN_PROGRESS' and existing.request_hash == fingerprint and existing.updated_at < stale:
+                # Mise à jour conditionnelle : un seul repreneur
+                taken = IdempotencyKey.objects.filter(
+                    pk=existing.pk, status='IN_PROGRESS', updated_at=existing.updated_at
+                ).update(updated_at=now, expires_at=expires_at)
+                if taken:
+                    return existing, True
+            return existing, False
+    return IdempotencyKey.objects.get(**lookup), False
+
+
+def _replay(record):
+    response = Response(record.response_body, status=record.response_status)
+    response['Idempotent-Replayed'] = 'true'
+    return response
+
+
+# ===================================
+# 🔁 Décorateur pour les actions de ViewSet
+# ===================================
+def idempotent(view_method):
+    """
+    Rend une action rejouable avec l'en-tête `Idempotency-Key` :
+    - première requête : exécutée, réponse enregistrée ;
+    - même clé ensuite : réponse enregistrée renvoyée telle quelle,
+      sans rappeler PayPal / Stripe ;
+    - même clé pendant que la première est en cours : 409 immédiat
+      (Retry-After), sans occuper le worker ;
+    - même clé avec un autre corps : 422.
+    Les réponses 5xx et les exceptions libèrent la clé pour permettre un nouvel essai.
+    Les clés sont propres à chaque appelant (utilisateur ou email).
+    Sans en-tête, l'action se comporte comme avant.
+    """
+    @functools.wraps(view_method)
+    def wrapper(self, request, *args, **kwargs):
+        key = request.headers.get(HEADER)
+        if not key:
+            return view_method(self, request, *args, **kwargs)
+
+        scope = f"{self.basename}:{self.action}"
+        fingerprint = _fingerprint(request)
+        record, created = _claim(key[:255], scope, _owner(request), fingerprint)
+
+        if not created:
+            if record.request_hash != fingerprint:
+                return Response(
+                    {"error": "Cette clé d'idempotence a déjà été utilisée pour une autre requête."},
+                    status=status.HTTP_422_UNPROCESSABLE_ENTITY,
+                )
+            if record.status == 'DONE':
+                return _replay(record)
+            response = Response(
+                {"error": "Une requête avec cette clé d'idempotence est déjà en cours."},
+                status=status.HTTP_409_CONFLICT,
+            )
+            response['Retry-After'] = '1'
+            return response
+
+        try:
+            response = view_method(self, request, *args, **kwargs)
+        except Exception:
+            IdempotencyKey.objects.filter(pk=record.pk).delete()
+            raise
+
+        if response.status_code >= 500:
+            IdempotencyKey.objects.filter(pk=record.pk).delete()
+            return response
+
+        IdempotencyKey.objects.filter(pk=record.pk).update(
+            status='DONE',
+            response_status=response.status_code,
+            response_body=response.data,
+        )
+        return response
+    return wrapper
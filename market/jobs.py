@@ -0,0 +1,149 @@
+import logging
+import random
+import traceback
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F, Q
+from django.utils import timezone
+
+from .models import Job, JobQueue
+
+
+logger = logging.getLogger(__name__)
+
+_registry = {}
+
+
+# ===================================
+# 🔹 Déclaration des tâches
+# ===================================
+def task(name, queue='default', max_attempts=5):
+    """
+    Enregistre une fonction comme tâche différable :
+
+        @task('media.collect_garbage', queue='media')
+        def collect_garbage(grace_hours=24): ...
+
+        collect_garbage.enqueue(grace_hours=1)
+
+    Le payload (kwargs) doit être sérialisable en JSON.
+    """
+    def decorator(func):
+        _registry[name] = (func, queue, max_attempts)
+
+        def enqueue_task(delay=None, **payload):
+            return enqueue(name, payload, delay=delay)
+
+        func.enqueue = enqueue_task
+        func.task_name = name
+        return func
+    return decorator
+
+
+def enqueue(name, payload=None, delay=None, queue=None):
+    """
+    Ajoute un job. Appelé dans une transaction, le job n'est visible par les
+    workers qu'au commit : il part en même temps que les données qu'il traite.
+    """
+    _, default_queue, max_attempts = _registry.get(name, (None, 'default', 5))
+    run_at = timezone.now() + (delay or timedelta(0))
+    return Job.objects.create(
+        name=name,
+        queue=queue or default_queue,
+        payload=payload or {},
+        max_attempts=max_attempts,
+        run_at=run_at,
+    )
+
+
+# ===================================
+# 🔐 Réservation des jobs (SKIP LOCKED)
+# ===================================
+def queue_concurrency(queue):
+    return settings.JOB_QUEUES.get(queue, {}).get('concurrency', 1)
+
+
+def claim(queue, worker_id, limit):
+    """
+    Réserve jusqu'à `limit` jobs prêts de la file, sans attendre les lignes
+    déjà verrouillées par un autre worker (SELECT ... FOR UPDATE SKIP LOCKED).
+    Les jobs RUNNING dont le verrou a expiré (worker mort) sont repris.
+    La limite de concurrence de la file est appliquée sur les jobs en cours :
+    la ligne JobQueue de la file reste verrouillée du comptage à la mise à
+    jour, deux workers ne peuvent pas occuper la même place libre.
+    """
+    now = timezone.now()
+    stale = now - timedelta(seconds=settings.JOB_LOCK_TIMEOUT)
+    JobQueue.objects.get_or_create(name=queue)
+
+    with transaction.atomic():
+        JobQueue.objects.select_for_update().get(name=queue)
+        running = Job.objects.filter(queue=queue, status='RUNNING', locked_at__gte=stale).count()
+        slots = min(limit, queue_concurrency(queue) - running)
+        if slots <= 0:
+            return []
+
+        ids = list(
+            Job.objects.select_for_update(skip_locked=True)
+            .filter(queue=queue)
+            .filter(Q(status='PENDING', run_at__lte=now) | Q(status='RUNNING', locked_at__lt=stale))
+            .order_by('run_at', 'id')
+            .values_list('id', flat=True)[:slots]
+        )
+        if not ids:
+            return []
+        Job.objects.filter(id__in=ids).update(
+            status='RUNNING',
+            locked_by=worker_id,
+            locked_at=now,
+            attempts=F('attempts') + 1,
+            updated_at=now,
+        )
+    return list(Job.objects.filter(id__in=ids, locked_by=worker_id).order_by('run_at', 'id'))
+
+
+def retry_delay(attempts):
+    """Backoff exponentiel plafonné, avec gigue pour étaler les reprises."""
+    base = settings.JOB_RETRY_BACKOFF * (2 ** max(0, attempts - 1))
+    delay = min(base, settings.JOB_RETRY_BACKOFF_MAX)
+    return timedelta(seconds=delay * random.uniform(0.8, 1.2))
+
+
+# ===================================
+# ▶️ Exécution
+# ===================================
+def run(job, worker_id):
+    """
+    Exécute un job réservé. Les mises à jour finales sont conditionnées par
+    `locked_by` : si le verrou a expiré et qu'un autre worker a repris le job,
+    on n'écrase pas son état.
+    """
+    mine = Job.objects.filter(id=job.id, locked_by=worker_id, status='RUNNING')
+    entry = _registry.get(job.name)
+    if entry is None:
+        mine.update(status='FAILED', last_error=f"Tâche inconnue : {job.name}", updated_at=timezone.now())
+        return False
+
+    func = entry[0]
+    try:
+        func(**job.payload)
+    except Exception:
+        error = traceback.format_exc()
+        logger.warning("Job %s (%s) en échec, tentative %s/%s", job.id, job.name, job.attempts, job.max_attempts)
+        if job.attempts >= job.max_attempts:
+            mine.update(status='FAILED', last_error=error, locked_by='', updated_at=timezone.now())
+        else:
+            mine.update(
+                status='PENDING',
+                last_error=error,
+                locked_by='',
+                locked_at=None,
+                run_at=timezone.now() + retry_delay(job.attempts),
+                updated_at=timezone.now(),
+            )
+        return False
+
+    mine.update(status='DONE', locked_by='', updated_at=timezone.now())
+    return True
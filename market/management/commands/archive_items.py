@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand
+
+from market.archive import archive
+
+
+class Command(BaseCommand):
+    help = (
+        "Déplace par lots les annonces vendues/retirées ou périmées (et leurs images) "
+        "vers les tables d'archive."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=None)
+        parser.add_argument('--max-batches', type=int, default=None)
+        parser.add_argument('--pause', type=float, default=0.5, help="Secondes de pause entre deux lots.")
+        parser.add_argument('--dry-run', action='store_true', help="Compte le premier lot sans rien déplacer.")
+
+    def handle(self, *args, **options):
+        total = archive(options['batch_size'], options['max_batches'], options['pause'], options['dry_run'])
+        verb = "à archiver" if options['dry_run'] else "archivée(s)"
+        self.stdout.write(self.style.SUCCESS(f"{total} annonce(s) {verb}."))
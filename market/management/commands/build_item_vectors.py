@@ -0,0 +1,20 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from market.similar import build_all
+
+
+class Command(BaseCommand):
+    help = "Recalcule les vecteurs des annonces et leurs k plus proches voisines."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--k', type=int, default=None)
+        parser.add_argument('--batch-size', type=int, default=500)
+
+    def handle(self, *args, **options):
+        start = time.perf_counter()
+        total = build_all(k=options['k'], batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(
+            f"{total} annonce(s) indexée(s) en {time.perf_counter() - start:.2f} s."
+        ))
@@ -0,0 +1,28 @@
+import os
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from drf_yasg.codecs import OpenAPICodecJson
+from drf_yasg.generators import OpenAPISchemaGenerator
+
+from sh.openapi import api_info
+
+
+class Command(BaseCommand):
+    help = "Génère le schéma OpenAPI au build ; /swagger/ sert ensuite ce fichier."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--output', default=str(settings.OPENAPI_SCHEMA_PATH))
+
+    def handle(self, *args, **options):
+        generator = OpenAPISchemaGenerator(info=api_info)
+        schema = generator.get_schema(request=None, public=True)
+        content = OpenAPICodecJson(validators=[]).encode(schema)
+
+        output = options['output']
+        os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+        with open(output, 'wb') as fh:
+            fh.write(content)
+        self.stdout.write(self.style.SUCCESS(
+            f"Schéma OpenAPI écrit dans {output} ({len(content)} octets, {len(schema.paths)} chemins)."
+        ))
@@ -0,0 +1,28 @@
+from django.core.management.base import BaseCommand
+
+from market.cleanup import PAYMENT_TARGET, TARGETS, run
+
+
+class Command(BaseCommand):
+    help = (
+        "Supprime par lots les lignes expirées (sessions, paniers vides ou abandonnés, "
+        "jobs terminés, réservations closes, uploads, clés d'idempotence, tombstones) "
+        "et fait vérifier par leur fournisseur les paiements restés en attente."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--only', nargs='+', choices=[*TARGETS, PAYMENT_TARGET], default=None)
+        parser.add_argument('--batch-size', type=int, default=None)
+        parser.add_argument('--pause', type=float, default=None, help="Secondes de pause entre deux lots.")
+        parser.add_argument('--dry-run', action='store_true', help="Compte les lignes concernées sans rien modifier.")
+
+    def handle(self, *args, **options):
+        report = run(options['only'], options['batch_size'], options['pause'], options['dry_run'])
+        verb = "à traiter" if options['dry_run'] else "traitée(s)"
+        total = 0
+        for target, result in report.items():
+            rows = sum(result['rows'].values())
+            total += rows
+            details = ", ".join(f"{model} {count}" for model, count in sorted(result['rows'].items()))
+            self.stdout.write(f"  - {target} : {rows} ligne(s) en {result['seconds']} s" + (f" ({details})" if details else ""))
+        self.stdout.write(self.style.SUCCESS(f"{total} ligne(s) {verb}."))
@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from market.reservations import expire_holds
+
+
+class Command(BaseCommand):
+    help = "Marque expirées, par lots, les réservations d'annonces dont le délai est écoulé."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=None)
+
+    def handle(self, *args, **options):
+        expired = expire_holds(options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f"{expired} réservation(s) expirée(s)."))
@@ -0,0 +1,32 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+
+from market.media import collect_garbage
+
+
+class Command(BaseCommand):
+    help = "Supprime du stockage les fichiers dédupliqués qui ne sont plus référencés."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--grace-hours', type=int, default=24,
+                            help="Délai minimal depuis la dernière référence retirée.")
+        parser.add_argument('--batch-size', type=int, default=100)
+        parser.add_argument('--dry-run', action='store_true')
+
+    def handle(self, *args, **options):
+        grace = timedelta(hours=options['grace_hours'])
+        total_files = total_bytes = 0
+        while True:
+            removed = collect_garbage(grace, options['batch_size'], options['dry_run'])
+            total_files += len(removed)
+            total_bytes += sum(size for _, size in removed)
+            for name, _ in removed:
+                self.stdout.write(f"  - {name}")
+            if options['dry_run'] or len(removed) < options['batch_size']:
+                break
+
+        verb = "à supprimer" if options['dry_run'] else "supprimés"
+        self.stdout.write(self.style.SUCCESS(
+            f"{total_files} fichier(s) {verb} ({total_bytes} octets)."
+        ))
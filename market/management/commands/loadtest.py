@@ -0,0 +1,118 @@
+import http.client
+import os
+import statistics
+import subprocess
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+
+DEFAULT_PATHS = "/api/sell-items/,/api/rent-items/,/api/changes/"
+
+
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, int(round(pct / 100 * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+class Command(BaseCommand):
+    help = (
+        "Test de charge local reproductible : démarre gunicorn avec gunicorn.conf.py "
+        "pour chaque modèle de worker et compare débit et latences de queue."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--models', default="sync,gthread,asgi",
+                            help="Modèles de worker à comparer (GUNICORN_WORKER_MODEL).")
+        parser.add_argument('--paths', default=DEFAULT_PATHS, help="Chemins séparés par des virgules.")
+        parser.add_argument('--requests', type=int, default=500, help="Requêtes par modèle.")
+        parser.add_argument('--concurrency', type=int, default=16)
+        parser.add_argument('--workers', type=int, default=2)
+        parser.add_argument('--threads', type=int, default=4)
+        parser.add_argument('--port', type=int, default=8765)
+        parser.add_argument('--warmup', type=int, default=20)
+
+    def handle(self, *args, **options):
+        paths = [p.strip() for p in options['paths'].split(',') if p.strip()]
+        results = []
+        for model in [m.strip() for m in options['models'].split(',') if m.strip()]:
+            self.stdout.write(f"→ {model} …")
+            server = self._start_server(model, options)
+            try:
+                self._wait_ready(options['port'], paths[0])
+                self._run(options['port'], paths, options['warmup'], options['concurrency'])
+                results.append((model, *self._run(
+                    options['port'], paths, options['requests'], options['concurrency'])))
+            finally:
+                server.terminate()
+                server.wait(timeout=30)
+
+        self.stdout.write("")
+        self.stdout.write(f"{'modèle':<10}{'req/s':>10}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'erreurs':>10}")
+        for model, rps, p50, p95, p99, errors in results:
+            self.stdout.write(f"{model:<10}{rps:>10.1f}{p50:>10.1f}{p95:>10.1f}{p99:>10.1f}{errors:>10}")
+
+    def _start_server(self, model, options):
+        env = {
+            **os.environ,
+            "DJANGO_SETTINGS_MODULE": settings.SETTINGS_MODULE,
+            "GUNICORN_WORKER_MODEL": model,
+            "WEB_CONCURRENCY": str(options['workers']),
+            "GUNICORN_THREADS": str(options['threads']),
+            "GUNICORN_ACCESS_LOG": "/dev/null",
+            "PORT": str(options['port']),
+        }
+        return subprocess.Popen(
+            [sys.executable, "-m", "gunicorn", "-c", "gunicorn.conf.py", "--bind", f"127.0.0.1:{options['port']}"],
+            cwd=str(settings.BASE_DIR), env=env,
+            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+        )
+
+    def _wait_ready(self, port, path, timeout=30):
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            try:
+                self._request(port, path)
+                return
+            except OSError:
+                time.sleep(0.2)
+        raise CommandError(f"Le serveur n'a pas démarré sur le port {port}.")
+
+    def _request(self, port, path):
+        conn = http.client.HTTPConnection("127.0.0.1", port, timeout=30)
+        try:
+            conn.request("GET", path, headers={"Host": "localhost"})
+            response = conn.getresponse()
+            response.read()
+            return response.status
+        finally:
+            conn.close()
+
+    def _run(self, port, paths, total, concurrency):
+        def one(i):
+            start = time.perf_counter()
+            try:
+                ok = self._request(port, paths[i % len(paths)]) < 500
+            except OSError:
+                ok = False
+            return time.perf_counter() - start, ok
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            samples = list(pool.map(one, range(total)))
+        elapsed = time.perf_counter() - started
+
+        latencies = sorted(duration * 1000 for duration, _ in samples)
+        errors = sum(1 for _, ok in samples if not ok)
+        return (
+            total / elapsed if elapsed else 0.0,
+            statistics.median(latencies) if latencies else 0.0,
+            percentile(latencies, 95),
+            percentile(latencies, 99),
+            errors,
+        )
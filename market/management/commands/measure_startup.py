@@ -0,0 +1,63 @@
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+
+# Script exécuté dans un interpréteur neuf : chargement complet d'un worker
+# (application WSGI + urlconf), sans traiter de requête.
+PROBE = r"""
+import json, os, resource, sys, time
+start = time.perf_counter()
+from django.core.wsgi import get_wsgi_application
+application = get_wsgi_application()
+from django.urls import get_resolver
+get_resolver().url_patterns
+elapsed = time.perf_counter() - start
+print(json.dumps({
+    "seconds": elapsed,
+    "max_rss_kb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+    "modules": len(sys.modules),
+    "heavy": sorted(m for m in ("stripe", "requests", "boto3") if m in sys.modules),
+}))
+"""
+
+
+class Command(BaseCommand):
+    help = "Mesure le temps de démarrage et la mémoire d'un worker à froid."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--runs', type=int, default=5)
+        parser.add_argument('--json', action='store_true', help="Sortie JSON brute.")
+
+    def handle(self, *args, **options):
+        env = {**os.environ, "DJANGO_SETTINGS_MODULE": settings.SETTINGS_MODULE}
+        samples = []
+        for _ in range(options['runs']):
+            out = subprocess.run(
+                [sys.executable, "-c", PROBE],
+                env=env, capture_output=True, text=True, check=True,
+                cwd=str(settings.BASE_DIR),
+            )
+            samples.append(json.loads(out.stdout.strip().splitlines()[-1]))
+
+        report = {
+            "runs": len(samples),
+            "median_seconds": round(statistics.median(s["seconds"] for s in samples), 4),
+            "median_max_rss_mb": round(statistics.median(s["max_rss_kb"] for s in samples) / 1024, 1),
+            "modules": samples[-1]["modules"],
+            "heavy_modules_loaded": samples[-1]["heavy"],
+        }
+        if options['json']:
+            self.stdout.write(json.dumps(report))
+            return
+        self.stdout.write(
+            f"Démarrage à froid ({report['runs']} essais) : "
+            f"{report['median_seconds'] * 1000:.0f} ms, "
+            f"{report['median_max_rss_mb']} Mo RSS, {report['modules']} modules"
+        )
+        self.stdout.write(f"SDK lourds chargés au démarrage : {report['heavy_modules_loaded'] or 'aucun'}")
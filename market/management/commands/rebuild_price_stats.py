@@ -0,0 +1,16 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from market.price_stats import rebuild_all
+
+
+class Command(BaseCommand):
+    help = "Reconstruit entièrement les statistiques de prix par ville / type / mois."
+
+    def handle(self, *args, **options):
+        start = time.perf_counter()
+        groups = rebuild_all()
+        self.stdout.write(self.style.SUCCESS(
+            f"{groups} groupe(s) recalculé(s) en {time.perf_counter() - start:.2f} s."
+        ))
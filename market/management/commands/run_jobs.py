@@ -0,0 +1,61 @@
+import os
+import signal
+import socket
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import connection
+
+from market import jobs
+
+
+class Command(BaseCommand):
+    help = "Worker de la file de tâches en base (aucune dépendance hors base de données)."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--queue', action='append', dest='queues',
+                            help="File(s) à traiter (par défaut : toutes celles de JOB_QUEUES).")
+        parser.add_argument('--poll-interval', type=float, default=1.0)
+        parser.add_argument('--once', action='store_true',
+                            help="Traiter les jobs prêts puis s'arrêter.")
+
+    def handle(self, *args, **options):
+        queues = options['queues'] or list(settings.JOB_QUEUES)
+        worker_id = f"{socket.gethostname()}:{os.getpid()}"
+        self.stopping = False
+        signal.signal(signal.SIGTERM, self._stop)
+        signal.signal(signal.SIGINT, self._stop)
+
+        max_threads = sum(jobs.queue_concurrency(q) for q in queues)
+        self.stdout.write(f"Worker {worker_id} sur {', '.join(queues)} ({max_threads} threads)")
+
+        in_flight = {queue: set() for queue in queues}
+        with ThreadPoolExecutor(max_workers=max_threads) as pool:
+            while not self.stopping:
+                claimed = 0
+                for queue in queues:
+                    in_flight[queue] = {f for f in in_flight[queue] if not f.done()}
+                    free = jobs.queue_concurrency(queue) - len(in_flight[queue])
+                    if free <= 0:
+                        continue
+                    for job in jobs.claim(queue, worker_id, free):
+                        in_flight[queue].add(pool.submit(self._run, job, worker_id))
+                        claimed += 1
+
+                if options['once'] and not claimed and not any(in_flight.values()):
+                    break
+                if not claimed:
+                    time.sleep(options['poll_interval'])
+
+    def _run(self, job, worker_id):
+        try:
+            ok = jobs.run(job, worker_id)
+            self.stdout.write(f"{'✓' if ok else '✗'} {job.name} #{job.id} (tentative {job.attempts})")
+        finally:
+            connection.close()
+
+    def _stop(self, signum, frame):
+        self.stdout.write("Arrêt demandé, fin des jobs en cours…")
+        self.stopping = True
@@ -0,0 +1,132 @@
+import hashlib
+import os
+from collections import Counter, defaultdict
+
+from django.core.files.storage import default_storage
+from django.db import IntegrityError, transaction
+from django.db.models import F
+from django.db.models.functions import Greatest
+from django.utils import timezone
+
+from .models import MediaBlob
+
+
+# ===================================
+# 🔹 Empreinte du contenu
+# ===================================
+def content_hash(file):
+    """Calcule le SHA-256 du fichier par morceaux (mémoire bornée)."""
+    digest = hashlib.sha256()
+    for chunk in file.chunks():
+        digest.update(chunk)
+    file.seek(0)
+    return digest.hexdigest()
+
+
+def _acquire(digest):
+    """Incrémente le compteur de références ; renvoie le nom stocké ou None."""
+    updated = MediaBlob.objects.filter(sha256=digest).update(
+        ref_count=F('ref_count') + 1,
+        updated_at=timezone.now(),
+    )
+    if not updated:
+        return None
+    return MediaBlob.objects.values_list('name', flat=True).get(sha256=digest)
+
+
+# ===================================
+# 💾 Stockage dédupliqué
+# ===================================
+def store_file(file, upload_to):
+    """
+    Stocke `file` sous `<upload_to>/<sha256><ext>` et renvoie le nom à
+    affecter au champ fichier. Si le même contenu existe déjà, aucun PUT
+    n'est envoyé au stockage : on pointe simplement vers l'objet existant.
+    """
+    digest = content_hash(file)
+
+    name = _acquire(digest)
+    if name:
+        return name
+
+    ext = os.path.splitext(file.name or '')[1].lower()
+    name = f"{upload_to.rstrip('/')}/{digest}{ext}"
+    if not default_storage.exists(name):
+        name = default_storage.save(name, file)
+
+    try:
+        with transaction.atomic():
+            MediaBlob.objects.create(sha256=digest, name=name, size=file.size or 0, ref_count=1)
+    except IntegrityError:
+        # Un upload concurrent du même contenu a gagné : on se rattache à lui
+        winner = _acquire(digest)
+        if winner and winner != name:
+            default_storage.delete(name)
+        name = winner or name
+    return name
+
+
+def acquire_names(names):
+    """Une référence de plus par occurrence de chaque nom, en une requête par multiplicité."""
+    by_count = defaultdict(list)
+    for name, count in Counter(n for n in names if n).items():
+        by_count[count].append(name)
+    for count, group in by_count.items():
+        MediaBlob.objects.filter(name__in=group).update(
+            ref_count=F('ref_count') + count,
+            updated_at=timezone.now(),
+        )
+
+
+def release_name(name):
+    """
+    Retire une référence. Les fichiers antérieurs à la déduplication
+    (sans MediaBlob) ne sont pas concernés.
+    """
+    if name:
+        MediaBlob.objects.filter(name=name, ref_count__gt=0).update(
+            ref_count=F('ref_count') - 1,
+            updated_at=timezone.now(),
+        )
+
+
+def release_names(names):
+    """release_name pour une liste de noms, en une requête par multiplicité."""
+    by_count = defaultdict(list)
+    for name, count in Counter(n for n in names if n).items():
+        by_count[count].append(name)
+    for count, group in by_count.items():
+        MediaBlob.objects.filter(name__in=group, ref_count__gt=0).update(
+            ref_count=Greatest(F('ref_count') - count, 0),
+            updated_at=timezone.now(),
+        )
+
+
+# ===================================
+# 🗑️ Ramasse-miettes
+# ===================================
+def collect_garbage(grace, batch_size=100, dry_run=False):
+    """
+    Supprime les objets sans référence depuis plus de `grace` (timedelta).
+    La ligne reste verrouillée pendant la suppression de l'objet stocké : un
+    store_file concurrent (UPDATE de ref_count) attend la fin de la
+    transaction, ne trouve plus la ligne et renvoie le fichier. Une ligne
+    ré-référencée entre-temps n'est pas touchée.
+    """
+    cutoff = timezone.now() - grace
+    candidates = MediaBlob.objects.filter(
+        ref_count__lte=0, updated_at__lt=cutoff
+    ).values_list('pk', 'name', 'size')[:batch_size]
+
+    removed = []
+    for pk, name, size in candidates:
+        if dry_run:
+            removed.append((name, size))
+            continue
+        with transaction.atomic():
+            if not list(MediaBlob.objects.select_for_update().filter(pk=pk, ref_count__lte=0).values_list('pk')):
+                continue
+            default_storage.delete(name)
+            MediaBlob.objects.filter(pk=pk).delete()
+        removed.append((name, size))
+    return removed
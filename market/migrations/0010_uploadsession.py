@@ -0,0 +1,28 @@
+# Generated by Django 4.2.25 on 2026-10-19 15:20
+
+from django.db import migrations, models
+import uuid
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('market', '0009_mediablob'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UploadSession',
+            fields=[
+                ('id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('purpose', models.CharField(choices=[('PROFILE', 'Photo de profil'), ('DOCUMENT', 'Justificatif étudiant'), ('ITEM', "Photo d'annonce")], max_length=10)),
+                ('filename', models.CharField(max_length=255)),
+                ('total_size', models.PositiveBigIntegerField()),
+                ('chunk_size', models.PositiveIntegerField()),
+                ('status', models.CharField(choices=[('UPLOADING', 'En cours'), ('COMPLETE', 'Terminé'), ('CONSUMED', 'Utilisé')], default='UPLOADING', max_length=10)),
+                ('stored_name', models.CharField(blank=True, max_length=255)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+    ]
@@ -0,0 +1,39 @@
+# Generated by Django 4.2.25 on 2026-10-19 15:30
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('market', '0015_itemvector'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PriceStat',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('city', models.CharField(max_length=100)),
+                ('item_type', models.CharField(choices=[('SELL', 'Vente'), ('RENT', 'Location')], max_length=4)),
+                ('period', models.CharField(max_length=7)),
+                ('count', models.PositiveIntegerField(default=0)),
+                ('min_price', models.DecimalField(decimal_places=2, max_digits=10)),
+                ('max_price', models.DecimalField(decimal_places=2, max_digits=10)),
+                ('mean_price', models.DecimalField(decimal_places=2, max_digits=10)),
+                ('p25', models.DecimalField(decimal_places=2, max_digits=10)),
+                ('median', models.DecimalField(decimal_places=2, max_digits=10)),
+                ('p75', models.DecimalField(decimal_places=2, max_digits=10)),
+                ('p90', models.DecimalField(decimal_places=2, max_digits=10)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='item',
+            index=models.Index(fields=['item_type', 'city', 'created_at'], name='item_type_city_created_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='pricestat',
+            constraint=models.UniqueConstraint(fields=('city', 'item_type', 'period'), name='pricestat_group_uniq'),
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 4.2.25 on 2026-10-19 15:32
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('market', '0016_pricestat'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='item',
+            index=models.Index(fields=['owner', 'item_type', 'is_available'], name='item_owner_type_available_idx'),
+        ),
+    ]
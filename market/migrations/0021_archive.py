@@ -0,0 +1,75 @@
+# Generated by Django 4.2.25 on 2026-10-19 15:40
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+FALLBACK_INDEX = 'item_live_fallback_idx'
+
+
+def create_mysql_fallback(apps, schema_editor):
+    # MySQL ignore l'index partiel item_live_idx : index composite équivalent
+    # (is_available en tête), pour que les requêtes « annonces en ligne »
+    # restent sur les lignes chaudes.
+    if schema_editor.connection.vendor == 'mysql':
+        schema_editor.execute(
+            f"CREATE INDEX {FALLBACK_INDEX} ON market_item (is_available, item_type, created_at)"
+        )
+
+
+def drop_mysql_fallback(apps, schema_editor):
+    if schema_editor.connection.vendor == 'mysql':
+        schema_editor.execute(f"DROP INDEX {FALLBACK_INDEX} ON market_item")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('market', '0020_change_feed'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ArchivedItem',
+            fields=[
+                ('id', models.BigIntegerField(primary_key=True, serialize=False)),
+                ('title', models.CharField(max_length=200)),
+                ('description', models.TextField(blank=True)),
+                ('price', models.DecimalField(blank=True, decimal_places=2, max_digits=10, null=True)),
+                ('item_type', models.CharField(choices=[('SELL', 'Vente'), ('RENT', 'Location')], max_length=4)),
+                ('city', models.CharField(blank=True, max_length=100)),
+                ('address', models.CharField(blank=True, max_length=255, null=True)),
+                ('contact_phone', models.CharField(blank=True, max_length=20, null=True)),
+                ('image', models.ImageField(blank=True, null=True, upload_to='items/')),
+                ('is_available', models.BooleanField(default=False)),
+                ('created_at', models.DateTimeField()),
+                ('updated_at', models.DateTimeField()),
+                ('archived_at', models.DateTimeField(auto_now_add=True)),
+                ('reason', models.CharField(choices=[('unavailable', 'Vendue ou retirée'), ('stale', 'Sans mise à jour depuis longtemps')], max_length=12)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='ArchivedItemImage',
+            fields=[
+                ('id', models.BigIntegerField(primary_key=True, serialize=False)),
+                ('image', models.ImageField(upload_to='items/')),
+                ('updated_at', models.DateTimeField()),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='item',
+            index=models.Index(condition=models.Q(('is_available', True)), fields=['item_type', 'created_at'], name='item_live_idx'),
+        ),
+        migrations.AddField(
+            model_name='archiveditemimage',
+            name='item',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='images', to='market.archiveditem'),
+        ),
+        migrations.AddField(
+            model_name='archiveditem',
+            name='owner',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='archived_items', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.RunPython(create_mysql_fallback, drop_mysql_fallback),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 4.2.25 on 2026-10-19 16:04
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('market', '0021_archive'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='JobQueue',
+            fields=[
+                ('name', models.CharField(max_length=50, primary_key=True, serialize=False)),
+            ],
+        ),
+    ]
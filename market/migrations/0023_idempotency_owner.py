@@ -0,0 +1,31 @@
+# Generated by Django 4.2.25 on 2026-10-19 16:06
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('market', '0022_job_queue'),
+    ]
+
+    operations = [
+        migrations.RemoveConstraint(
+            model_name='idempotencykey',
+            name='idempotency_key_scope_uniq',
+        ),
+        migrations.AddField(
+            model_name='idempotencykey',
+            name='owner',
+            field=models.CharField(blank=True, max_length=255),
+        ),
+        migrations.AddField(
+            model_name='idempotencykey',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True),
+        ),
+        migrations.AddConstraint(
+            model_name='idempotencykey',
+            constraint=models.UniqueConstraint(fields=('key', 'scope', 'owner'), name='idempotency_key_owner_uniq'),
+        ),
+    ]
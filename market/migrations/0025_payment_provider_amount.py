@@ -0,0 +1,23 @@
+# Generated by Django 4.2.25 on 2026-10-19 16:13
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('market', '0024_throttle_counter'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='payment',
+            name='provider_amount',
+            field=models.DecimalField(blank=True, decimal_places=2, max_digits=10, null=True),
+        ),
+        migrations.AddField(
+            model_name='payment',
+            name='provider_currency',
+            field=models.CharField(blank=True, default='', max_length=3),
+        ),
+    ]
@@ -0,0 +1,27 @@
+# Generated by Django 4.2.25 on 2026-10-19 18:02
+
+from django.db import migrations, models
+from django.db.models import F
+import django.utils.timezone
+
+
+def from_created_at(apps, schema_editor):
+    # Paniers existants : dernière activité connue = création
+    apps.get_model('market', 'Cart').objects.update(updated_at=F('created_at'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('market', '0025_payment_provider_amount'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='cart',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True, default=django.utils.timezone.now),
+            preserve_default=False,
+        ),
+        migrations.RunPython(from_created_at, migrations.RunPython.noop),
+    ]
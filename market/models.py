@@ -1,6 +1,10 @@
+import uuid
+
 from django.db import models
 from django.contrib.auth.models import AbstractUser
 from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.utils import timezone
 
 # =============================
 # 🔹 UTILISATEUR (Étudiant / Vendeur)
@@ -23,6 +27,11 @@ class User(AbstractUser):
     ]
     role = models.CharField(max_length=10, choices=ROLE_CHOICES, default='STUDENT')
 
+    class Meta(AbstractUser.Meta):
+        indexes = [
+            models.Index(fields=['email'], name='user_email_idx'),
+        ]
+
     def __str__(self):
         return f"{self.username} ({self.role})"
 
@@ -56,6 +65,23 @@ class Item(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['title'], name='item_title_idx'),
+            models.Index(fields=['city'], name='item_city_idx'),
+            models.Index(fields=['item_type', 'is_available'], name='item_type_available_idx'),
+            models.Index(fields=['item_type', 'city', 'created_at'], name='item_type_city_created_idx'),
+            models.Index(fields=['owner', 'item_type', 'is_available'], name='item_owner_type_available_idx'),
+            models.Index(fields=['updated_at', 'id'], name='item_changes_idx'),
+            # Index partiel : seules les annonces en ligne y figurent (PostgreSQL,
+            # SQLite). MySQL ne les supporte pas : voir la migration 0021.
+            models.Index(
+                fields=['item_type', 'created_at'],
+                condition=models.Q(is_available=True),
+                name='item_live_idx',
+            ),
+        ]
+
     def __str__(self):
         return f"{self.title} ({self.get_item_type_display()})"
 
@@ -66,6 +92,12 @@ class ItemImage(models.Model):
         related_name='images'
     )
     image = models.ImageField(upload_to='items/')
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['updated_at', 'id'], name='itemimage_changes_idx'),
+        ]
 
     def __str__(self):
         return f"Image de {self.item.title}"
@@ -73,6 +105,10 @@ class ItemImage(models.Model):
 class Cart(models.Model):
     user = models.OneToOneField(User, on_delete=models.CASCADE, related_name="cart")
     created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)  # dernier ajout / retrait d'article
+
+    def touch(self):
+        Cart.objects.filter(pk=self.pk).update(updated_at=timezone.now())
 
     def __str__(self):
         return f"Panier de {self.user.email}"
@@ -123,6 +159,15 @@ class Payment(models.Model):
         related_name='payments'
     )
 
+    # Instantané figé du panier au moment du paiement (montant, lignes)
+    order = models.ForeignKey(
+        'Order',
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name='payments'
+    )
+
     # =====================
     # 🔑 Identifiants paiement
     # =====================
@@ -149,6 +194,10 @@ class Payment(models.Model):
     amount = models.DecimalField(max_digits=10, decimal_places=2)
     currency = models.CharField(max_length=10, default='USD')
 
+    # Montant demandé au fournisseur (après conversion) : la capture doit l'égaler
+    provider_amount = models.DecimalField(max_digits=10, decimal_places=2, null=True, blank=True)
+    provider_currency = models.CharField(max_length=3, blank=True, default='')
+
     status = models.CharField(
         max_length=20,
         choices=PAYMENT_STATUS,
@@ -167,3 +216,352 @@ class Payment(models.Model):
 
     class Meta:
         ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['status', 'created_at'], name='payment_status_created_idx'),
+            models.Index(fields=['user', 'created_at', 'id'], name='payment_user_history_idx'),
+        ]
+
+
+# =============================
+# 🔹 COMMANDES (instantané du panier au paiement)
+# =============================
+class Order(models.Model):
+    """
+    Copie figée du panier au moment du checkout : le montant payé, les
+    reçus et la réconciliation se lisent ici, jamais sur le panier vivant.
+    """
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='orders')
+    cart = models.ForeignKey('Cart', on_delete=models.SET_NULL, null=True, blank=True, related_name='orders')
+    total = models.DecimalField(max_digits=12, decimal_places=2)
+    currency = models.CharField(max_length=10, default='MAD')
+    item_count = models.PositiveIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"Commande #{self.pk} - {self.total} {self.currency}"
+
+
+class OrderLine(models.Model):
+    order = models.ForeignKey(Order, on_delete=models.CASCADE, related_name='lines')
+    item = models.ForeignKey(Item, on_delete=models.SET_NULL, null=True, blank=True, related_name='order_lines')
+    seller = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name='sold_lines'
+    )
+    title = models.CharField(max_length=200)
+    item_type = models.CharField(max_length=4, choices=Item.TYPE_CHOICES)
+    unit_price = models.DecimalField(max_digits=10, decimal_places=2)
+    quantity = models.PositiveIntegerField()
+    line_total = models.DecimalField(max_digits=12, decimal_places=2)
+
+    def __str__(self):
+        return f"{self.quantity} x {self.title}"
+
+
+# =============================
+# 🔹 RÉSERVATIONS (blocage court d'une annonce pendant le paiement)
+# =============================
+class Reservation(models.Model):
+    """
+    Blocage d'une annonce à vendre pour une commande. Une réservation ACTIVE
+    dont `expires_at` est passé ne bloque plus rien ; elle est marquée
+    EXPIRED par lots (`manage.py expire_reservations`).
+    """
+    STATUS_CHOICES = [
+        ('ACTIVE', 'Active'),
+        ('CONVERTED', 'Convertie en vente'),
+        ('RELEASED', 'Libérée'),
+        ('EXPIRED', 'Expirée'),
+    ]
+
+    item = models.ForeignKey(Item, on_delete=models.CASCADE, related_name='reservations')
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='reservations')
+    order = models.ForeignKey('Order', on_delete=models.CASCADE, null=True, blank=True, related_name='reservations')
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='ACTIVE')
+    expires_at = models.DateTimeField()
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['item', 'status', 'expires_at'], name='reservation_item_active_idx'),
+            models.Index(fields=['status', 'expires_at'], name='reservation_expiry_idx'),
+        ]
+
+    def __str__(self):
+        return f"Réservation {self.item_id} par {self.user_id} ({self.status})"
+
+
+# =============================
+# 🔹 JOURNAL DES SUPPRESSIONS (flux de changements)
+# =============================
+class DeletionLog(models.Model):
+    """Tombstone d'une annonce ou d'une image supprimée, lu par /api/changes/."""
+    KIND_CHOICES = [
+        ('item', 'Annonce'),
+        ('image', 'Image'),
+    ]
+
+    kind = models.CharField(max_length=5, choices=KIND_CHOICES)
+    object_id = models.BigIntegerField()
+    parent_id = models.BigIntegerField(null=True, blank=True)  # annonce d'une image
+    deleted_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['deleted_at', 'id'], name='deletionlog_changes_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.kind} {self.object_id} supprimé le {self.deleted_at}"
+
+
+# =============================
+# 🔹 ARCHIVES (annonces vendues, retirées ou périmées)
+# =============================
+class ArchivedItem(models.Model):
+    """
+    Annonce sortie de la table `Item` par `manage.py archive_items`.
+    Conserve l'id d'origine : /api/sell-items/{id}/ la retrouve encore.
+    """
+    REASON_CHOICES = [
+        ('unavailable', 'Vendue ou retirée'),
+        ('stale', 'Sans mise à jour depuis longtemps'),
+    ]
+
+    id = models.BigIntegerField(primary_key=True)
+    title = models.CharField(max_length=200)
+    description = models.TextField(blank=True)
+    price = models.DecimalField(max_digits=10, decimal_places=2, null=True, blank=True)
+    item_type = models.CharField(max_length=4, choices=Item.TYPE_CHOICES)
+    owner = models.ForeignKey(User, on_delete=models.CASCADE, related_name="archived_items", null=True, blank=True)
+    city = models.CharField(max_length=100, blank=True)
+    address = models.CharField(max_length=255, blank=True, null=True)
+    contact_phone = models.CharField(max_length=20, blank=True, null=True)
+    image = models.ImageField(upload_to="items/", blank=True, null=True)
+    is_available = models.BooleanField(default=False)
+    created_at = models.DateTimeField()
+    updated_at = models.DateTimeField()
+    archived_at = models.DateTimeField(auto_now_add=True)
+    reason = models.CharField(max_length=12, choices=REASON_CHOICES)
+
+    def __str__(self):
+        return f"{self.title} (archivée)"
+
+
+class ArchivedItemImage(models.Model):
+    id = models.BigIntegerField(primary_key=True)
+    item = models.ForeignKey(ArchivedItem, on_delete=models.CASCADE, related_name='images')
+    image = models.ImageField(upload_to='items/')
+    updated_at = models.DateTimeField()
+
+    def __str__(self):
+        return f"Image archivée de {self.item_id}"
+
+
+# =============================
+# 🔹 FICHIERS MÉDIA DÉDUPLIQUÉS (adressés par contenu)
+# =============================
+class MediaBlob(models.Model):
+    """
+    Un objet stocké une seule fois sous son empreinte SHA-256.
+    `ref_count` compte les champs fichier qui pointent vers lui :
+    à 0, l'objet peut être supprimé par `manage.py gc_media`.
+    """
+    sha256 = models.CharField(max_length=64, unique=True)
+    name = models.CharField(max_length=255, db_index=True)
+    size = models.PositiveBigIntegerField(default=0)
+    ref_count = models.IntegerField(default=0)
+
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['ref_count', 'updated_at'], name='mediablob_gc_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.name} ({self.ref_count} réf.)"
+
+
+# =============================
+# 🔹 UPLOAD FRACTIONNÉ ET REPRENABLE
+# =============================
+class UploadSession(models.Model):
+    PURPOSE_CHOICES = [
+        ('PROFILE', 'Photo de profil'),
+        ('DOCUMENT', 'Justificatif étudiant'),
+        ('ITEM', "Photo d'annonce"),
+    ]
+    STATUS_CHOICES = [
+        ('UPLOADING', 'En cours'),
+        ('COMPLETE', 'Terminé'),
+        ('CONSUMED', 'Utilisé'),
+    ]
+
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    purpose = models.CharField(max_length=10, choices=PURPOSE_CHOICES)
+    filename = models.CharField(max_length=255)
+    total_size = models.PositiveBigIntegerField()
+    chunk_size = models.PositiveIntegerField()
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='UPLOADING')
+
+    # Nom du fichier final (stockage dédupliqué) une fois l'upload terminé
+    stored_name = models.CharField(max_length=255, blank=True)
+
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    @property
+    def total_parts(self):
+        return max(1, -(-self.total_size // self.chunk_size))
+
+    def __str__(self):
+        return f"Upload {self.filename} ({self.status})"
+
+
+# =============================
+# 🔹 FILE DE TÂCHES EN BASE (travail différé)
+# =============================
+class Job(models.Model):
+    STATUS_CHOICES = [
+        ('PENDING', 'En attente'),
+        ('RUNNING', 'En cours'),
+        ('DONE', 'Terminée'),
+        ('FAILED', 'Échouée'),
+    ]
+
+    queue = models.CharField(max_length=50, default='default')
+    name = models.CharField(max_length=100)
+    payload = models.JSONField(default=dict, blank=True)
+
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='PENDING')
+    attempts = models.PositiveIntegerField(default=0)
+    max_attempts = models.PositiveIntegerField(default=5)
+    run_at = models.DateTimeField(default=timezone.now)
+
+    locked_by = models.CharField(max_length=100, blank=True)
+    locked_at = models.DateTimeField(null=True, blank=True)
+    last_error = models.TextField(blank=True)
+
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['queue', 'status', 'run_at'], name='job_claim_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.name} [{self.queue}] - {self.status}"
+
+
+class JobQueue(models.Model):
+    """Une ligne par file : verrouillée pendant la réservation, elle sérialise le contrôle de concurrence."""
+    name = models.CharField(max_length=50, primary_key=True)
+
+    def __str__(self):
+        return self.name
+
+
+# =============================
+# 🔹 CLÉS D'IDEMPOTENCE (rejeu des réponses de paiement)
+# =============================
+class IdempotencyKey(models.Model):
+    STATUS_CHOICES = [
+        ('IN_PROGRESS', 'En cours'),
+        ('DONE', 'Terminée'),
+    ]
+
+    key = models.CharField(max_length=255)
+    scope = models.CharField(max_length=100)  # "<basename>:<action>"
+    owner = models.CharField(max_length=255, blank=True)  # "user:<id>" ou "email:<adresse>"
+    request_hash = models.CharField(max_length=64)
+    status = models.CharField(max_length=12, choices=STATUS_CHOICES, default='IN_PROGRESS')
+
+    response_status = models.PositiveSmallIntegerField(null=True, blank=True)
+    response_body = models.JSONField(null=True, blank=True, encoder=DjangoJSONEncoder)
+
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)  # reprise d'une clé IN_PROGRESS abandonnée
+    expires_at = models.DateTimeField(db_index=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['key', 'scope', 'owner'], name='idempotency_key_owner_uniq'),
+        ]
+
+    def __str__(self):
+        return f"{self.scope} {self.key} ({self.status})"
+
+
+# =============================
+# 🔹 COMPTEURS DE THROTTLING (fenêtres glissantes)
+# =============================
+class ThrottleCounter(models.Model):
+    key = models.CharField(max_length=255)  # "<scope>:<kind>:<ident>"
+    window = models.BigIntegerField()  # index de la fenêtre (temps // durée)
+    count = models.PositiveIntegerField(default=0)
+    expires_at = models.DateTimeField(db_index=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['key', 'window'], name='throttle_key_window_uniq'),
+        ]
+
+    def __str__(self):
+        return f"{self.key} #{self.window} ({self.count})"
+
+
+# =============================
+# 🔹 ANNONCES SIMILAIRES (vecteurs pré-calculés)
+# =============================
+class ItemVector(models.Model):
+    """
+    Vecteur creux d'une annonce ({terme: poids}, norme 1) et ses k plus
+    proches voisines pré-calculées ([[item_id, score], ...]).
+    Construit par `manage.py build_item_vectors`, tenu à jour par la file de tâches.
+    """
+    item = models.OneToOneField(Item, on_delete=models.CASCADE, primary_key=True, related_name='vector')
+    vector = models.JSONField(default=dict)
+    neighbours = models.JSONField(default=list)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"Vecteur de l'annonce {self.item_id}"
+
+
+# =============================
+# 🔹 STATISTIQUES DE PRIX PAR VILLE / TYPE / MOIS
+# =============================
+class PriceStat(models.Model):
+    """
+    Agrégats pré-calculés des prix d'annonces. `city = "*"` regroupe toutes
+    les villes, `period = "all"` toutes les dates ; sinon period = "AAAA-MM".
+    """
+    city = models.CharField(max_length=100)
+    item_type = models.CharField(max_length=4, choices=Item.TYPE_CHOICES)
+    period = models.CharField(max_length=7)
+
+    count = models.PositiveIntegerField(default=0)
+    min_price = models.DecimalField(max_digits=10, decimal_places=2)
+    max_price = models.DecimalField(max_digits=10, decimal_places=2)
+    mean_price = models.DecimalField(max_digits=10, decimal_places=2)
+    p25 = models.DecimalField(max_digits=10, decimal_places=2)
+    median = models.DecimalField(max_digits=10, decimal_places=2)
+    p75 = models.DecimalField(max_digits=10, decimal_places=2)
+    p90 = models.DecimalField(max_digits=10, decimal_places=2)
+
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['city', 'item_type', 'period'], name='pricestat_group_uniq'),
+        ]
+
+    def __str__(self):
+        return f"Prix {self.item_type} {self.city} {self.period} ({self.count})"
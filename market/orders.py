@@ -0,0 +1,77 @@
+from decimal import Decimal
+
+from django.db import transaction
+from django.db.models import DecimalField, ExpressionWrapper, F
+
+from .models import CartItem, Order, OrderLine
+from .reservations import reserve
+
+
+CENTS = Decimal('0.01')
+
+
+class OrderError(Exception):
+    pass
+
+
+def snapshot_cart(user, cart):
+    """
+    Fige le panier en une commande : une seule requête lit les lignes avec
+    leur montant calculé en SQL, puis commande et lignes sont insérées en
+    une transaction (une insertion groupée pour les lignes). Les annonces à
+    vendre y sont réservées ; en cas de conflit (ReservationConflict), rien
+    n'est écrit. Un article sans prix fait refuser le panier entier plutôt
+    que d'être retiré en silence de la commande.
+    """
+    if cart is None:
+        raise OrderError("Panier introuvable.")
+
+    line_total = ExpressionWrapper(
+        F('quantity') * F('item__price'),
+        output_field=DecimalField(max_digits=12, decimal_places=2),
+    )
+    rows = list(
+        CartItem.objects.filter(cart=cart)
+        .order_by('id')
+        .values('item_id', 'item__owner_id', 'item__title', 'item__item_type', 'item__price', 'quantity')
+        .annotate(line_total=line_total)
+    )
+    if not rows:
+        raise OrderError("Panier vide.")
+    unpriced = [row['item__title'] for row in rows if row['item__price'] is None]
+    if unpriced:
+        raise OrderError(f"Article(s) sans prix : {', '.join(unpriced)}.")
+
+    lines = [
+        OrderLine(
+            item_id=row['item_id'],
+            seller_id=row['item__owner_id'],
+            title=row['item__title'],
+            item_type=row['item__item_type'],
+            unit_price=row['item__price'],
+            quantity=row['quantity'],
+            line_total=Decimal(row['line_total']).quantize(CENTS),
+        )
+        for row in rows
+    ]
+    with transaction.atomic():
+        order = Order.objects.create(
+            user=user,
+            cart=cart,
+            total=sum((line.line_total for line in lines), Decimal('0')),
+            item_count=sum(line.quantity for line in lines),
+        )
+        for line in lines:
+            line.order = order
+        OrderLine.objects.bulk_create(lines)
+        reserve(user, [line.item_id for line in lines if line.item_type == 'SELL'], order=order)
+    return order
+
+
+def seller_ids(payments):
+    """Vendeurs concernés par un ensemble de paiements (une requête)."""
+    return (
+        OrderLine.objects.filter(order__payments__in=payments)
+        .values_list('seller_id', flat=True)
+        .distinct()
+    )
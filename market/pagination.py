@@ -0,0 +1,12 @@
+from rest_framework.pagination import CursorPagination
+
+
+class PaymentHistoryPagination(CursorPagination):
+    """
+    Pagination par curseur (keyset) : chaque page reprend après le dernier
+    (created_at, id) vu, via l'index (user, created_at, id), sans OFFSET.
+    """
+    page_size = 20
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+    ordering = ('-created_at', '-id')
@@ -0,0 +1,168 @@
+from collections import defaultdict
+from datetime import datetime, timedelta
+from decimal import Decimal, ROUND_HALF_UP
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from .cache import app_cache
+from .models import Item, PriceStat
+
+
+ALL_CITIES = '*'
+ALL_TIME = 'all'
+CENTS = Decimal('0.01')
+
+STAT_FIELDS = ['count', 'min_price', 'max_price', 'mean_price', 'p25', 'median', 'p75', 'p90']
+
+
+def period_of(created_at):
+    return timezone.localtime(created_at).strftime('%Y-%m') if created_at else None
+
+
+def city_key(city):
+    """Ville telle que rangée dans PriceStat : « Rabat » et « rabat » forment un seul groupe."""
+    return (city or '').strip().lower()
+
+
+def groups_for(city, item_type, created_at):
+    """Les 4 groupes auxquels contribue une annonce."""
+    month = period_of(created_at)
+    city = city_key(city)
+    groups = {(ALL_CITIES, item_type, ALL_TIME)}
+    if month:
+        groups.add((ALL_CITIES, item_type, month))
+    if city:
+        groups.add((city, item_type, ALL_TIME))
+        if month:
+            groups.add((city, item_type, month))
+    return groups
+
+
+def percentile(sorted_prices, pct):
+    """Percentile par interpolation linéaire sur une liste triée."""
+    position = (len(sorted_prices) - 1) * pct
+    lower = int(position)
+    upper = min(lower + 1, len(sorted_prices) - 1)
+    fraction = Decimal(str(position - lower))
+    return sorted_prices[lower] + (sorted_prices[upper] - sorted_prices[lower]) * fraction
+
+
+def summarize(sorted_prices):
+    def q(value):
+        return Decimal(value).quantize(CENTS, rounding=ROUND_HALF_UP)
+
+    return {
+        'count': len(sorted_prices),
+        'min_price': q(sorted_prices[0]),
+        'max_price': q(sorted_prices[-1]),
+        'mean_price': q(sum(sorted_prices) / len(sorted_prices)),
+        'p25': q(percentile(sorted_prices, 0.25)),
+        'median': q(percentile(sorted_prices, 0.5)),
+        'p75': q(percentile(sorted_prices, 0.75)),
+        'p90': q(percentile(sorted_prices, 0.9)),
+    }
+
+
+def _group_queryset(city, item_type, period):
+    items = Item.objects.filter(item_type=item_type, price__isnull=False)
+    if city != ALL_CITIES:
+        items = items.filter(city__iexact=city)
+    if period != ALL_TIME:
+        start = timezone.make_aware(datetime.strptime(period, '%Y-%m'))
+        end = timezone.make_aware(datetime(start.year + start.month // 12, start.month % 12 + 1, 1))
+        items = items.filter(created_at__gte=start, created_at__lt=end)
+    return items
+
+
+# ===================================
+# 🔁 Mise à jour incrémentale (par groupe touché)
+# ===================================
+def recompute(groups):
+    """Une requête indexée (item_type, city, created_at) par groupe, bornée à ce groupe."""
+    for city, item_type, period in groups:
+        prices = list(
+            _group_queryset(city, item_type, period)
+            .order_by('price')
+            .values_list('price', flat=True)
+        )
+        if not prices:
+            PriceStat.objects.filter(city=city, item_type=item_type, period=period).delete()
+            continue
+        PriceStat.objects.update_or_create(
+            city=city, item_type=item_type, period=period,
+            defaults=summarize(prices),
+        )
+
+
+def _global_flag(group):
+    return 'price_stats:global:' + ':'.join(group[1:])
+
+
+def refresh_groups(groups):
+    """
+    Recalcule les groupes touchés par une écriture. Ceux d'une ville sont
+    bornés à cette ville et recalculés tout de suite ; ceux de toutes les
+    villes parcourent tout le type, et ne sont recalculés qu'une fois par
+    PRICE_STATS_GLOBAL_INTERVAL, quel que soit le nombre d'écritures.
+    """
+    from .tasks import refresh_global_price_groups
+
+    recompute([group for group in groups if group[0] != ALL_CITIES])
+    interval = settings.PRICE_STATS_GLOBAL_INTERVAL
+    for group in sorted(group for group in groups if group[0] == ALL_CITIES):
+        # Drapeau plus long que le délai : levé par le job lui-même, avant son calcul
+        if app_cache.shared.add(_global_flag(group), 1, interval * 2):
+            refresh_global_price_groups.enqueue(groups=[list(group)], delay=timedelta(seconds=interval))
+
+
+def refresh_global_groups(groups):
+    for group in groups:
+        app_cache.shared.delete(_global_flag(group))
+    recompute(groups)
+
+
+# ===================================
+# 🧮 Reconstruction complète (batch)
+# ===================================
+def rebuild_all(chunk_size=2000):
+    """Un seul parcours de la table des annonces, puis remplacement des agrégats."""
+    buckets = defaultdict(list)
+    rows = (
+        Item.objects.filter(price__isnull=False)
+        .values_list('city', 'item_type', 'created_at', 'price')
+        .iterator(chunk_size=chunk_size)
+    )
+    for city, item_type, created_at, price in rows:
+        for group in groups_for(city, item_type, created_at):
+            buckets[group].append(price)
+
+    stats = []
+    for (city, item_type, period), prices in buckets.items():
+        prices.sort()
+        stats.append(PriceStat(city=city, item_type=item_type, period=period, **summarize(prices)))
+
+    with transaction.atomic():
+        PriceStat.objects.all().delete()
+        PriceStat.objects.bulk_create(stats, batch_size=500)
+    return len(stats)
+
+
+def read_stats(item_type, city=None, months=12):
+    """Lecture à coût constant : une ligne globale + au plus `months` lignes mensuelles."""
+    rows = PriceStat.objects.filter(item_type=item_type, city=city_key(city) if city else ALL_CITIES)
+
+    def as_dict(stat):
+        # Montants en chaîne, comme `price` dans les serializers d'annonces
+        values = {field: str(getattr(stat, field)) for field in STAT_FIELDS if field != 'count'}
+        return {'period': stat.period, 'count': stat.count, **values}
+
+    overall = rows.filter(period=ALL_TIME).first()
+    monthly = rows.exclude(period=ALL_TIME).order_by('-period')[:months]
+    return {
+        'item_type': item_type,
+        'city': city or None,
+        'overall': as_dict(overall) if overall else None,
+        'monthly': [as_dict(stat) for stat in monthly],
+    }
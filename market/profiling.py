@@ -0,0 +1,335 @@
+"""
+Profilage à la demande d'une requête, réservé au staff.
+
+Déclenché par l'en-tête `X-Profile: cprofile|sample` ou `?_profile=...`
+(`1` vaut PROFILING_DEFAULT_MODE). La requête passe sous cProfile
+(déterministe) ou sous un échantillonneur de pile, et le rapport — arbre
+d'appels, chronologie SQL, chronologie des appels HTTP sortants — est
+écrit dans PROFILING_DIR. L'id du rapport revient dans `X-Profile-Id` ;
+les rapports se consultent sur /api/profiles/.
+
+Désactivé par défaut (PROFILING_ENABLED=1 dans l'environnement pour
+l'activer). Sans drapeau, le middleware ne fait qu'une lecture d'en-tête :
+ni profileur, ni wrapper SQL, ni chronologie HTTP ; sous ASGI, la requête
+reste sur la boucle d'événements.
+"""
+import cProfile
+import io
+import json
+import os
+import pstats
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+from contextlib import ExitStack
+
+from asgiref.sync import async_to_sync, iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+from django.utils import timezone
+
+
+MODES = ('cprofile', 'sample')
+REPORT_ID_CHARS = set('0123456789abcdef-')
+SUMMARY_FIELDS = (
+    'id', 'created_at', 'mode', 'method', 'path', 'user', 'status',
+    'duration_ms', 'sql_count', 'sql_ms', 'http_count', 'http_ms',
+)
+
+
+def requested_mode(request):
+    flag = request.META.get('HTTP_X_PROFILE') or request.GET.get('_profile')
+    if not flag:
+        return None
+    flag = flag.lower()
+    if flag in MODES:
+        return flag
+    return settings.PROFILING_DEFAULT_MODE if flag in ('1', 'true', 'yes') else None
+
+
+def _elapsed_ms(started):
+    return round((time.perf_counter() - started) * 1000, 3)
+
+
+# ===================================
+# 🔹 Chronologie SQL (connection.execute_wrapper)
+# ===================================
+class SQLTimeline:
+    def __init__(self, started, alias):
+        self.started = started
+        self.alias = alias
+        self.entries = []
+
+    def __call__(self, execute, sql, params, many, context):
+        start = _elapsed_ms(self.started)
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.entries.append({
+                'start_ms': start,
+                'duration_ms': round(_elapsed_ms(self.started) - start, 3),
+                'alias': self.alias,
+                'sql': sql,  # placeholders seulement : les paramètres ne sont pas conservés
+                'many': many,
+            })
+
+
+# ===================================
+# 🔹 Chronologie HTTP : urllib3 (requests, stripe, boto3)
+# ===================================
+class HTTPTimeline:
+    """
+    `HTTPConnectionPool.urlopen` est remplacé une fois pour toutes, au premier
+    profil du process, par un wrapper lié à la méthode d'origine : il ne
+    fait qu'une lecture de dictionnaire pour les threads non profilés, et
+    aucun thread ne peut le voir à moitié retiré. Seuls les appels du thread
+    profilé sont enregistrés.
+    """
+
+    _lock = threading.Lock()
+    _timelines = {}  # ident de thread → timeline
+    _installed = False
+
+    def __init__(self, started):
+        self.started = started
+        self.entries = []
+
+    @classmethod
+    def install(cls):
+        with cls._lock:
+            if cls._installed:
+                return
+            from urllib3.connectionpool import HTTPConnectionPool
+
+            original = HTTPConnectionPool.urlopen
+            timelines = cls._timelines
+
+            def urlopen(pool, method, url, *args, **kwargs):
+                timeline = timelines.get(threading.get_ident())
+                if timeline is None:
+                    return original(pool, method, url, *args, **kwargs)
+                start = _elapsed_ms(timeline.started)
+                status = None
+                try:
+                    response = original(pool, method, url, *args, **kwargs)
+                    status = response.status
+                    return response
+                finally:
+                    timeline.entries.append({
+                        'start_ms': start,
+                        'duration_ms': round(_elapsed_ms(timeline.started) - start, 3),
+                        'method': method,
+                        'url': f"{pool.scheme}://{pool.host}:{pool.port}{url.split('?', 1)[0]}",
+                        'status': status,
+                    })
+
+            HTTPConnectionPool.urlopen = urlopen
+            cls._installed = True
+
+    def __enter__(self):
+        self.install()
+        self._timelines[threading.get_ident()] = self
+        return self
+
+    def __exit__(self, *exc):
+        self._timelines.pop(threading.get_ident(), None)
+
+
+# ===================================
+# 🔹 Profileurs : cProfile ou échantillonnage de pile
+# ===================================
+class DeterministicProfiler:
+    def __enter__(self):
+        self.profile = cProfile.Profile()
+        self.profile.enable()
+        return self
+
+    def __exit__(self, *exc):
+        self.profile.disable()
+
+    def report(self):
+        out = io.StringIO()
+        stats = pstats.Stats(self.profile, stream=out)
+        stats.sort_stats('cumulative').print_stats(settings.PROFILING_TOP_FUNCTIONS)
+        stats.print_callees(settings.PROFILING_TOP_FUNCTIONS)
+        return {'text': out.getvalue()}
+
+
+class SamplingProfiler:
+    """
+    Un thread relève la pile du thread profilé toutes les
+    PROFILING_SAMPLE_INTERVAL secondes ; les piles sont agrégées au format
+    « replié » des flamegraphs (`a;b;c <échantillons>`).
+    """
+
+    def __init__(self, interval=None):
+        self.interval = interval or settings.PROFILING_SAMPLE_INTERVAL
+        self.stacks = Counter()
+        self._target = threading.get_ident()
+        self._stop = threading.Event()
+
+    def __enter__(self):
+        self._thread = threading.Thread(target=self._run, name='profiling-sampler', daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self._target)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{code.co_name} ({code.co_filename}:{code.co_firstlineno})")
+                frame = frame.f_back
+            if stack:
+                self.stacks[';'.join(reversed(stack))] += 1
+
+    def report(self):
+        return {
+            'interval_ms': self.interval * 1000,
+            'samples': sum(self.stacks.values()),
+            'folded': [f"{stack} {count}" for stack, count in self.stacks.most_common()],
+        }
+
+
+PROFILERS = {'cprofile': DeterministicProfiler, 'sample': SamplingProfiler}
+
+
+# ===================================
+# 💾 Rapports sur disque
+# ===================================
+def _path(report_id):
+    return os.path.join(settings.PROFILING_DIR, f"{report_id}.json")
+
+
+def save_report(report):
+    os.makedirs(settings.PROFILING_DIR, exist_ok=True)
+    tmp_path = f"{_path(report['id'])}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as fh:
+        json.dump(report, fh)
+    os.replace(tmp_path, _path(report['id']))
+
+    # Rotation : seuls les PROFILING_MAX_REPORTS plus récents sont gardés
+    for stale in recent_report_files()[settings.PROFILING_MAX_REPORTS:]:
+        try:
+            os.remove(stale.path)
+        except FileNotFoundError:
+            pass
+
+
+def recent_report_files():
+    try:
+        entries = [e for e in os.scandir(settings.PROFILING_DIR) if e.name.endswith('.json')]
+    except FileNotFoundError:
+        return []
+    return sorted(entries, key=lambda e: e.name, reverse=True)
+
+
+def list_reports(limit=50):
+    """Résumés des rapports les plus récents (sans arbre ni chronologies)."""
+    summaries = []
+    for entry in recent_report_files()[:limit]:
+        report = load_report(entry.name[:-5])
+        if report:
+            summaries.append({key: report[key] for key in SUMMARY_FIELDS})
+    return summaries
+
+
+def load_report(report_id):
+    if not report_id or set(report_id) - REPORT_ID_CHARS:
+        return None
+    try:
+        with open(_path(report_id), encoding='utf-8') as fh:
+            return json.load(fh)
+    except (FileNotFoundError, ValueError):
+        return None
+
+
+
+# ===================================
+# 🧩 Middleware
+# ===================================
+def _is_staff(request):
+    return request.user.is_staff
+
+
+class ProfilingMiddleware:
+    """
+    À placer après AuthenticationMiddleware (vérification is_staff).
+    Synchrone et asynchrone : sous ASGI, seule une requête profilée passe
+    dans un thread, où la vue s'exécute elle aussi (thread_sensitive) et
+    reste donc visible du profileur et des chronologies.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not settings.PROFILING_ENABLED:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        mode = requested_mode(request)
+        if mode is None or not _is_staff(request):
+            return self.get_response(request)
+        return self.profile(request, mode)
+
+    async def __acall__(self, request):
+        mode = requested_mode(request)
+        if mode is None or not await sync_to_async(_is_staff)(request):
+            return await self.get_response(request)
+        return await sync_to_async(self.profile)(request, mode)
+
+    def _get_response(self, request):
+        if self.async_mode:
+            return async_to_sync(self.get_response)(request)
+        return self.get_response(request)
+
+    def profile(self, request, mode):
+        started = time.perf_counter()
+        created_at = timezone.now()
+        profiler = PROFILERS[mode]()
+        sql = [SQLTimeline(started, alias) for alias in connections]
+        with ExitStack() as stack:
+            for timeline in sql:
+                stack.enter_context(connections[timeline.alias].execute_wrapper(timeline))
+            http = stack.enter_context(HTTPTimeline(started))
+            with profiler:
+                response = self._get_response(request)
+        duration = _elapsed_ms(started)
+
+        queries = sorted((e for timeline in sql for e in timeline.entries), key=lambda e: e['start_ms'])
+        report = {
+            # Horodatage en tête de l'id : l'ordre alphabétique est chronologique
+            'id': f"{created_at:%Y%m%d-%H%M%S-%f}-{uuid.uuid4().hex[:8]}",
+            'created_at': created_at.isoformat(),
+            'mode': mode,
+            'method': request.method,
+            'path': request.get_full_path(),
+            'user': request.user.get_username(),
+            'status': response.status_code,
+            'duration_ms': duration,
+            'sql_count': len(queries),
+            'sql_ms': round(sum(e['duration_ms'] for e in queries), 3),
+            'http_count': len(http.entries),
+            'http_ms': round(sum(e['duration_ms'] for e in http.entries), 3),
+            'profile': profiler.report(),
+            'sql': queries,
+            'http': http.entries,
+        }
+        save_report(report)
+        response['X-Profile-Id'] = report['id']
+        return response
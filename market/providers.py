@@ -0,0 +1,108 @@
+from decimal import Decimal
+
+from django.conf import settings
+
+
+# Les SDK (requests, stripe) sont importés dans les fonctions : ils ne sont
+# chargés que par les workers qui parlent réellement aux fournisseurs.
+
+
+# ===================================
+# 🔐 PayPal
+# ===================================
+def paypal_access_token():
+    import requests
+
+    auth_response = requests.post(
+        f"{settings.PAYPAL_API_BASE}/v1/oauth2/token",
+        auth=(settings.PAYPAL_CLIENT_ID, settings.PAYPAL_SECRET),
+        data={"grant_type": "client_credentials"},
+    )
+    auth_response.raise_for_status()
+    return auth_response.json()["access_token"]
+
+
+def paypal_headers():
+    return {
+        "Content-Type": "application/json",
+        "Authorization": f"Bearer {paypal_access_token()}",
+    }
+
+
+def paypal_create_order(payload):
+    """Réponse brute : le statut et le corps PayPal sont relayés tels quels en cas de refus."""
+    import requests
+
+    return requests.post(f"{settings.PAYPAL_API_BASE}/v2/checkout/orders", json=payload, headers=paypal_headers())
+
+
+def paypal_capture_order(order_id):
+    import requests
+
+    return requests.post(f"{settings.PAYPAL_API_BASE}/v2/checkout/orders/{order_id}/capture", headers=paypal_headers())
+
+
+def paypal_get_order(order_id):
+    import requests
+
+    response = requests.get(
+        f"{settings.PAYPAL_API_BASE}/v2/checkout/orders/{order_id}",
+        headers=paypal_headers(),
+    )
+    response.raise_for_status()
+    return response.json()
+
+
+def paypal_captured_amount(order_data):
+    """(montant, devise) des captures COMPLETED d'une commande PayPal ; devise None si mélangées."""
+    total, currencies = Decimal('0'), set()
+    for unit in order_data.get("purchase_units", []):
+        for capture in unit.get("payments", {}).get("captures", []):
+            if capture.get("status") == "COMPLETED":
+                total += Decimal(capture["amount"]["value"])
+                currencies.add(capture["amount"]["currency_code"])
+    return total, (currencies.pop() if len(currencies) == 1 else None)
+
+
+def paypal_capture_matches(payment, order_data):
+    """La capture couvre exactement le montant demandé (paiements antérieurs à son enregistrement : non vérifiable)."""
+    if payment.provider_amount is None:
+        return True
+    amount, currency = paypal_captured_amount(order_data)
+    return currency == payment.provider_currency and amount == payment.provider_amount
+
+
+# ===================================
+# 💳 Stripe
+# ===================================
+def stripe_create_intent(amount_cents, currency, description):
+    import stripe
+
+    stripe.api_key = settings.STRIPE_SECRET_KEY
+    return stripe.PaymentIntent.create(
+        amount=amount_cents,
+        currency=currency,
+        payment_method_types=["card"],
+        description=description,
+    )
+
+
+def stripe_retrieve_intent(payment_intent_id):
+    import stripe
+
+    stripe.api_key = settings.STRIPE_SECRET_KEY
+    return stripe.PaymentIntent.retrieve(payment_intent_id)
+
+
+def stripe_cancel_intent(payment_intent_id):
+    import stripe
+
+    stripe.api_key = settings.STRIPE_SECRET_KEY
+    return stripe.PaymentIntent.cancel(payment_intent_id)
+
+
+def stripe_intent_matches(payment, intent):
+    """L'encaissement couvre exactement le montant demandé (centimes)."""
+    if payment.provider_amount is None:
+        return True
+    return intent.currency.upper() == payment.provider_currency and intent.amount_received == int(payment.provider_amount * 100)
@@ -0,0 +1,196 @@
+"""
+Budgets de requêtes et plans d'exécution pour les tests.
+
+- `query_budget(n)` : contexte qui échoue si le bloc émet plus de `n`
+  requêtes ou parcourt entièrement une table de l'app `market`.
+- `QueryPlanTestRunner` (settings.TEST_RUNNER) : capture l'EXPLAIN de
+  chaque requête de la suite et écrit un rapport (QUERY_PLAN_REPORT).
+
+Backends pris en charge : SQLite (EXPLAIN QUERY PLAN) et MySQL (EXPLAIN).
+"""
+import os
+import re
+import sys
+import tempfile
+import threading
+from collections import namedtuple
+from contextlib import contextmanager
+
+from django.db import DatabaseError, connections
+from django.test.runner import DiscoverRunner
+
+
+TABLE_PREFIX = 'market_'
+EXPLAINABLE = re.compile(r'^\s*(SELECT|UPDATE|DELETE)\b', re.IGNORECASE)
+TABLE_REFS = re.compile(
+    r'\b(?:FROM|JOIN|UPDATE)\s+[`"]?(\w+)[`"]?(?:\s+(?:AS\s+)?[`"]?([A-Z]\d+)[`"]?)?',
+    re.IGNORECASE,
+)
+SQLITE_SCAN = re.compile(r'^SCAN (\w+)')
+
+Query = namedtuple('Query', 'sql params plan scans test')
+
+_state = threading.local()
+
+
+# ===================================
+# 🔎 EXPLAIN et détection des parcours complets
+# ===================================
+def table_aliases(sql):
+    """{alias ou nom: table} pour les tables citées par la requête."""
+    aliases = {}
+    for table, alias in TABLE_REFS.findall(sql):
+        aliases[table] = table
+        if alias:
+            aliases[alias] = table
+    return aliases
+
+
+def explain(connection, sql, params):
+    """
+    Plan de la requête, sans passer par les wrappers ni le journal des
+    requêtes de Django (assertNumQueries n'en voit rien).
+    """
+    _state.explaining = True
+    try:
+        cursor = connection.create_cursor()
+        try:
+            if connection.vendor == 'sqlite':
+                cursor.execute('EXPLAIN QUERY PLAN ' + sql, params)
+                return [row[-1] for row in cursor.fetchall()]
+            if connection.vendor == 'mysql':
+                cursor.execute('EXPLAIN ' + sql, params)
+                columns = [col[0] for col in cursor.description]
+                return [dict(zip(columns, row)) for row in cursor.fetchall()]
+            return []
+        finally:
+            cursor.close()
+    except DatabaseError as e:
+        return [f"EXPLAIN impossible : {e}"]
+    finally:
+        _state.explaining = False
+
+
+def full_scans(vendor, sql, plan):
+    """
+    Tables `market_*` lues en entier. SQLite : ligne « SCAN <table> ».
+    MySQL : type ALL sans index candidat (possible_keys vide) — sur les
+    petites tables de test, MySQL choisit parfois ALL malgré un index ;
+    seule l'absence d'index utilisable est donc signalée.
+    """
+    aliases = table_aliases(sql)
+    scanned = set()
+    for line in plan:
+        if vendor == 'sqlite' and isinstance(line, str):
+            match = SQLITE_SCAN.match(line)
+            name = match and match.group(1)
+        elif vendor == 'mysql' and isinstance(line, dict):
+            name = line.get('table') if line.get('type') == 'ALL' and not line.get('possible_keys') else None
+        else:
+            name = None
+        table = aliases.get(name, name) if name else None
+        if table and table.startswith(TABLE_PREFIX):
+            scanned.add(table)
+    return scanned
+
+
+# ===================================
+# 🧾 Enregistrement des requêtes (connection.execute_wrapper)
+# ===================================
+class QueryRecorder:
+    def __init__(self, connection):
+        self.connection = connection
+        self.queries = []
+        self.test = None
+
+    def __call__(self, execute, sql, params, many, context):
+        if not many and not getattr(_state, 'explaining', False):
+            plan, scans = None, set()
+            if EXPLAINABLE.match(sql) and TABLE_PREFIX in sql:
+                plan = explain(self.connection, sql, params)
+                scans = full_scans(self.connection.vendor, sql, plan)
+            self.queries.append(Query(sql, params, plan, scans, self.test))
+        return execute(sql, params, many, context)
+
+    def scans(self, allow=()):
+        return [(query, query.scans - set(allow)) for query in self.queries if query.scans - set(allow)]
+
+    def report(self, queries=None):
+        lines = []
+        for i, query in enumerate(self.queries if queries is None else queries, 1):
+            lines.append(f"{i}. {query.sql}")
+            for step in query.plan or []:
+                lines.append(f"     {step}")
+            if query.scans:
+                lines.append(f"     ⚠️ parcours complet : {', '.join(sorted(query.scans))}")
+        return "\n".join(lines)
+
+
+@contextmanager
+def query_budget(max_queries, allow_scans=(), using='default'):
+    """
+    Échoue si le bloc dépasse `max_queries` requêtes ou parcourt entièrement
+    une table `market_*` absente de `allow_scans`.
+    """
+    connection = connections[using]
+    recorder = QueryRecorder(connection)
+    with connection.execute_wrapper(recorder):
+        yield recorder
+
+    problems = []
+    if len(recorder.queries) > max_queries:
+        problems.append(f"{len(recorder.queries)} requêtes pour un budget de {max_queries}.")
+    for query, tables in recorder.scans(allow_scans):
+        problems.append(f"Parcours complet de {', '.join(sorted(tables))} : {query.sql}")
+    if problems:
+        raise AssertionError("\n".join(problems) + "\n\n" + recorder.report())
+
+
+# ===================================
+# 🏃 Runner : plans de toute la suite
+# ===================================
+class QueryPlanTestRunner(DiscoverRunner):
+    """
+    Lance les tests en capturant le plan de chaque requête sur les tables
+    `market_*`, puis écrit le rapport dans QUERY_PLAN_REPORT (par défaut
+    <tmp>/sh-query-plans.txt) et résume les parcours complets.
+    """
+
+    recorder = None
+
+    def get_resultclass(self):
+        base = super().get_resultclass() or self.test_runner.resultclass
+        runner = self
+
+        class RecordingResult(base):
+            def startTest(self, test):
+                if runner.recorder:
+                    runner.recorder.test = test.id()
+                super().startTest(test)
+
+        return RecordingResult
+
+    def run_suite(self, suite, **kwargs):
+        connection = connections['default']
+        self.recorder = QueryRecorder(connection)
+        with connection.execute_wrapper(self.recorder):
+            result = super().run_suite(suite, **kwargs)
+        self.write_report()
+        return result
+
+    def write_report(self):
+        path = os.environ.get('QUERY_PLAN_REPORT') or os.path.join(tempfile.gettempdir(), 'sh-query-plans.txt')
+        distinct = {}
+        for query in self.recorder.queries:
+            if query.plan is not None:
+                distinct.setdefault(query.sql, query)
+        with open(path, 'w', encoding='utf-8') as report:
+            report.write(self.recorder.report(list(distinct.values())) + "\n")
+
+        scans = [query for query in distinct.values() if query.scans]
+        sys.stderr.write(
+            f"\n{len(distinct)} requête(s) distincte(s) expliquée(s), "
+            f"{len(scans)} avec parcours complet — rapport : {path}\n"
+        )
+        for query in scans:
+            sys.stderr.write(f"  ⚠️ {', '.join(sorted(query.scans))} ({query.test}) : {query.sql[:200]}\n")
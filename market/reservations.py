@@ -0,0 +1,138 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from .models import Item, OrderLine, Reservation
+from .signals import items_bulk_updated
+
+
+class ReservationConflict(Exception):
+    def __init__(self, item_ids):
+        self.item_ids = sorted(item_ids)
+        super().__init__("Article(s) indisponible(s) ou en cours de réservation.")
+
+
+def active(now=None):
+    return Reservation.objects.filter(status='ACTIVE', expires_at__gt=now or timezone.now())
+
+
+def held_by_others(item_ids, user):
+    """Lecture sans verrou, pour refuser tôt un ajout au panier."""
+    return set(active().filter(item_id__in=item_ids).exclude(user=user).values_list('item_id', flat=True))
+
+
+# ===================================
+# 🔒 Blocage au checkout
+# ===================================
+def reserve(user, item_ids, order=None, ttl=None):
+    """
+    Bloque les annonces `item_ids` pour `user` pendant `ttl` secondes, ou lève
+    ReservationConflict. Les lignes Item sont verrouillées avec SKIP LOCKED :
+    une annonce déjà verrouillée par un checkout concurrent est signalée en
+    conflit immédiatement, sans attendre la fin de l'autre transaction.
+    À appeler dans la transaction qui crée la commande.
+    """
+    ids = set(item_ids)
+    if not ids:
+        return None
+    now = timezone.now()
+    with transaction.atomic():
+        locked = set(
+            Item.objects.select_for_update(skip_locked=True)
+            .filter(id__in=ids, is_available=True)
+            .values_list('id', flat=True)
+        )
+        held = set(
+            active(now).filter(item_id__in=locked).exclude(user=user).values_list('item_id', flat=True)
+        )
+        conflicts = (ids - locked) | held
+        if conflicts:
+            raise ReservationConflict(conflicts)
+
+        # Anciens blocages de ces annonces (checkout relancé, ou périmés) : remplacés
+        Reservation.objects.filter(item_id__in=ids, status='ACTIVE').update(status='RELEASED', updated_at=now)
+        expires_at = now + timedelta(seconds=ttl or settings.RESERVATION_TTL)
+        Reservation.objects.bulk_create([
+            Reservation(item_id=item_id, user=user, order=order, expires_at=expires_at)
+            for item_id in sorted(ids)
+        ])
+    return expires_at
+
+
+# ===================================
+# ✅ Fin du paiement
+# ===================================
+def complete_orders(order_ids):
+    """
+    Paiement complété : dans une transaction, les blocages des commandes
+    passent CONVERTED et les annonces vendues passent indisponibles.
+    Chaque annonce doit être encore disponible et bloquée pour ces commandes
+    (blocage ACTIVE, non échu) : sinon ReservationConflict et rien n'est
+    écrit, pour qu'une capture tardive ne vende pas deux fois une annonce.
+    Renvoie les ids des annonces retirées de la vente.
+    """
+    order_ids = [order_id for order_id in order_ids if order_id]
+    if not order_ids:
+        return []
+    now = timezone.now()
+    with transaction.atomic():
+        item_ids = sorted(set(
+            OrderLine.objects.filter(order_id__in=order_ids, item_type='SELL', item__isnull=False)
+            .values_list('item_id', flat=True)
+        ))
+        # Verrou bloquant ici : la vente doit passer, même derrière un checkout en cours
+        sold = set(
+            Item.objects.select_for_update()
+            .filter(id__in=item_ids, is_available=True)
+            .values_list('id', flat=True)
+        )
+        held = set(active(now).filter(order_id__in=order_ids, item_id__in=item_ids).values_list('item_id', flat=True))
+        refused = set(item_ids) - (sold & held)
+        if refused:
+            raise ReservationConflict(refused)
+
+        Reservation.objects.filter(order_id__in=order_ids, status='ACTIVE').update(status='CONVERTED', updated_at=now)
+        if sold:
+            Item.objects.filter(id__in=sold).update(is_available=False, updated_at=now)
+            items_bulk_updated.send(sender=Item, ids=sorted(sold))
+    return sorted(sold)
+
+
+def holds_live(order_id):
+    """Lecture sans verrou, avant de capturer : les annonces de la commande lui sont-elles encore bloquées ?"""
+    item_ids = set(
+        OrderLine.objects.filter(order_id=order_id, item_type='SELL', item__isnull=False)
+        .values_list('item_id', flat=True)
+    )
+    live = active().filter(order_id=order_id, item_id__in=item_ids, item__is_available=True)
+    return live.values('item_id').distinct().count() == len(item_ids)
+
+
+def release_orders(order_ids):
+    """Paiement échoué ou annulé : les annonces redeviennent réservables."""
+    order_ids = [order_id for order_id in order_ids if order_id]
+    if not order_ids:
+        return 0
+    return Reservation.objects.filter(order_id__in=order_ids, status='ACTIVE').update(
+        status='RELEASED', updated_at=timezone.now()
+    )
+
+
+# ===================================
+# ⏱️ Expiration par lots
+# ===================================
+def expire_holds(batch_size=None):
+    """Marque EXPIRED les blocages échus, par lots ; renvoie le nombre traité."""
+    batch_size = batch_size or settings.RESERVATION_EXPIRE_BATCH
+    total = 0
+    while True:
+        now = timezone.now()
+        ids = list(
+            Reservation.objects.filter(status='ACTIVE', expires_at__lte=now)
+            .values_list('pk', flat=True)[:batch_size]
+        )
+        if not ids:
+            return total
+        total += Reservation.objects.filter(pk__in=ids, status='ACTIVE').update(status='EXPIRED', updated_at=now)
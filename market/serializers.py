@@ -1,6 +1,10 @@
 from rest_framework import serializers
 from django.contrib.auth import authenticate
-from .models import User,Item,ItemImage,Cart,CartItem,Payment
+from django.db import transaction
+from .models import User,Item,ItemImage,Cart,CartItem,Payment,UploadSession,Order,OrderLine,ArchivedItem,ArchivedItemImage
+from .currency import convert_rows
+from .media import store_file
+from . import uploads
 
 
 class UserListSerializer(serializers.ModelSerializer):
@@ -15,6 +19,9 @@ class RegisterSerializer(serializers.ModelSerializer):
     password = serializers.CharField(write_only=True)
     profile_picture = serializers.ImageField(required=False, allow_null=True)
     student_document = serializers.FileField(required=False, allow_null=True)  # 🆕 ajouté
+    # 🔹 Alternative : id d'un fichier déjà envoyé via /uploads/
+    profile_picture_upload_id = serializers.UUIDField(required=False, write_only=True)
+    student_document_upload_id = serializers.UUIDField(required=False, write_only=True)
 
     class Meta:
         model = User
@@ -27,11 +34,42 @@ class RegisterSerializer(serializers.ModelSerializer):
             'phone',
             'profile_picture',
             'student_document',  # 🆕 ajouté
+            'profile_picture_upload_id',
+            'student_document_upload_id',
         ]
 
+    def _validate_upload(self, value, purpose):
+        if value and not UploadSession.objects.filter(id=value, purpose=purpose, status='COMPLETE').exists():
+            raise serializers.ValidationError("Upload introuvable ou non terminé.")
+        return value
+
+    def validate_profile_picture_upload_id(self, value):
+        return self._validate_upload(value, 'PROFILE')
+
+    def validate_student_document_upload_id(self, value):
+        return self._validate_upload(value, 'DOCUMENT')
+
+    def _stored_files(self, validated_data):
+        """{champ: nom stocké} des fichiers reçus, envoyés directement ou via /uploads/."""
+        files = {}
+        # 🔹 Stockage adressé par contenu : pas de nouvel upload si le fichier existe déjà
+        for field, prefix in (('profile_picture', 'profiles/'), ('student_document', 'documents/')):
+            file = validated_data.pop(field, None)
+            if file:
+                files[field] = store_file(file, prefix)
+        for field, purpose in (('profile_picture', 'PROFILE'), ('student_document', 'DOCUMENT')):
+            upload_id = validated_data.pop(f'{field}_upload_id', None)
+            if upload_id:
+                try:
+                    files[field] = uploads.consume(upload_id, purpose)
+                except uploads.UploadError as exc:
+                    raise serializers.ValidationError(str(exc))
+        return files
+
+    @transaction.atomic
     def create(self, validated_data):
-        profile_picture = validated_data.pop('profile_picture', None)
-        student_document = validated_data.pop('student_document', None)  # 🆕 ajouté
+        # Uploads consommés et compte créés ensemble : un échec ne brûle pas l'upload
+        files = self._stored_files(validated_data)
 
         # Générer automatiquement un username unique basé sur l'email
         email = validated_data.get('email')
@@ -49,17 +87,23 @@ class RegisterSerializer(serializers.ModelSerializer):
             last_name=validated_data.get('last_name', ''),
             email=email,
             city=validated_data.get('city', ''),
-            phone=validated_data.get('phone', '')
+            phone=validated_data.get('phone', ''),
+            **files,
         )
 
-        if profile_picture:
-            user.profile_picture = profile_picture
-        if student_document:
-            user.student_document = student_document  # 🆕 ajouté
-        user.save()
-
         return user
 
+    def update(self, instance, validated_data):
+        # L'ancien fichier remplacé est rendu par signals.release_replaced_user_files
+        files = self._stored_files(validated_data)
+        password = validated_data.pop('password', None)
+        for attr, value in {**validated_data, **files}.items():
+            setattr(instance, attr, value)
+        if password:
+            instance.set_password(password)
+        instance.save()
+        return instance
+
 class LoginSerializer(serializers.Serializer):
     email = serializers.EmailField()
     password = serializers.CharField(write_only=True)
@@ -117,11 +161,26 @@ class ItemImageSerializer(serializers.ModelSerializer):
         model = ItemImage
         fields = ['id', 'image']  
 
-class RentItemSerializer(serializers.ModelSerializer):
+# 💱 Prix convertis (?currency=) : taux résolu une fois par requête par la vue
+class ConvertedPriceListSerializer(serializers.ListSerializer):
+    def to_representation(self, data):
+        return convert_rows(super().to_representation(data), self.context.get('currency'))
+
+
+class ConvertedPriceMixin:
+    def to_representation(self, instance):
+        row = super().to_representation(instance)
+        if self.parent is None:  # dans une liste, la conversion se fait en une passe
+            convert_rows([row], self.context.get('currency'))
+        return row
+
+
+class RentItemSerializer(ConvertedPriceMixin, serializers.ModelSerializer):
     images = ItemImageSerializer(many=True, read_only=True)
 
     class Meta:
         model = Item
+        list_serializer_class = ConvertedPriceListSerializer
         fields = [
             'id', 'title', 'description', 'price', 'city',
             'address', 'contact_phone', 'item_type',
@@ -138,6 +197,7 @@ class RentItemSerializer(serializers.ModelSerializer):
 
     class Meta:
         model = Item
+        list_serializer_class = ConvertedPriceListSerializer
         fields = [
             'id', 'title', 'description', 'price', 'city',
             'address', 'contact_phone', 'item_type',
@@ -150,11 +210,12 @@ class RentItemSerializer(serializers.ModelSerializer):
         validated_data['item_type'] = 'RENT'
         return super().create(validated_data)
 
-class SellItemSerializer(serializers.ModelSerializer):
+class SellItemSerializer(ConvertedPriceMixin, serializers.ModelSerializer):
     images = ItemImageSerializer(many=True, read_only=True)
 
     class Meta:
         model = Item
+        list_serializer_class = ConvertedPriceListSerializer
         fields = [
             'id', 'title', 'description', 'price', 'city',
             'address', 'contact_phone', 'item_type',
@@ -171,6 +232,7 @@ class SellItemSerializer(serializers.ModelSerializer):
 
     class Meta:
         model = Item
+        list_serializer_class = ConvertedPriceListSerializer
         fields = [
             'id', 'title', 'description', 'price', 'city',
             'address', 'contact_phone', 'item_type',
@@ -219,7 +281,8 @@ class CartSerializer(serializers.ModelSerializer):
 
 class PaymentSerializer(serializers.ModelSerializer):
     user_email = serializers.EmailField(source='user.email', read_only=True)
-    cart_id = serializers.IntegerField(source='cart.id', read_only=True)
+    cart_id = serializers.IntegerField(read_only=True)  # lu sur la colonne, sans jointure
+    order_id = serializers.IntegerField(read_only=True)
 
     class Meta:
         model = Payment
@@ -230,6 +293,7 @@ class PaymentSerializer(serializers.ModelSerializer):
             'user_email',
             'cart',
             'cart_id',
+            'order_id',
             'amount',
             'currency',
             'status',
@@ -245,4 +309,56 @@ class PaymentSerializer(serializers.ModelSerializer):
         Crée une instance Payment lors de la création d'une commande PayPal.
         """
         payment = Payment.objects.create(**validated_data)
-        return payment
\ No newline at end of file
+        return payment
+
+
+class ArchivedItemImageSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = ArchivedItemImage
+        fields = ['id', 'image']
+
+
+class ArchivedItemSerializer(ConvertedPriceMixin, serializers.ModelSerializer):
+    images = ArchivedItemImageSerializer(many=True, read_only=True)
+    archived = serializers.BooleanField(default=True, read_only=True)
+
+    class Meta:
+        model = ArchivedItem
+        list_serializer_class = ConvertedPriceListSerializer
+        fields = [
+            'id', 'title', 'description', 'price', 'city',
+            'address', 'contact_phone', 'item_type',
+            'is_available', 'created_at', 'updated_at', 'images',
+            'archived', 'archived_at', 'reason',
+        ]
+        read_only_fields = fields
+
+
+class OrderLineSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = OrderLine
+        fields = ['id', 'item_id', 'seller_id', 'title', 'item_type', 'unit_price', 'quantity', 'line_total']
+
+
+class OrderSerializer(serializers.ModelSerializer):
+    lines = OrderLineSerializer(many=True, read_only=True)
+
+    class Meta:
+        model = Order
+        fields = ['id', 'user', 'total', 'currency', 'item_count', 'lines', 'created_at']
+        read_only_fields = fields
+
+
+class UploadSessionSerializer(serializers.ModelSerializer):
+    total_parts = serializers.IntegerField(read_only=True)
+    received_parts = serializers.SerializerMethodField()
+
+    class Meta:
+        model = UploadSession
+        fields = [
+            'id', 'purpose', 'filename', 'total_size', 'chunk_size',
+            'total_parts', 'status', 'received_parts',
+        ]
+
+    def get_received_parts(self, obj):
+        return uploads.received_parts(obj) if obj.status == 'UPLOADING' else []
@@ -0,0 +1,312 @@
+from functools import partial
+
+from django.db import transaction
+from django.db.models.signals import post_delete, post_init, post_save
+from django.dispatch import Signal, receiver
+
+from . import dashboard
+from .cache import app_cache
+from .media import release_name, release_names
+from .price_stats import groups_for
+from .models import ArchivedItemImage, Cart, CartItem, DeletionLog, Item, ItemImage, OrderLine, Payment, User
+
+
+# Envoyé par les mises à jour en masse (queryset.update) qui ne déclenchent
+# pas post_save : sender=Item, ids=[...]
+items_bulk_updated = Signal()
+
+# Envoyé par les suppressions en masse sans signal par ligne (archive) :
+# sender=Item, rows=[{champs de l'annonce}], images=[{'id', 'item_id', 'image'}]
+items_bulk_deleted = Signal()
+
+
+# ===================================
+# 🔹 Références des fichiers dédupliqués
+# ===================================
+@receiver(post_delete, sender=ItemImage)
+@receiver(post_delete, sender=ArchivedItemImage)
+def release_item_image(sender, instance, **kwargs):
+    release_name(instance.image.name)
+
+
+@receiver(items_bulk_deleted)
+def release_images_after_bulk_delete(sender, rows, images, **kwargs):
+    release_names([image['image'] for image in images])
+
+
+USER_FILE_FIELDS = ('profile_picture', 'student_document')
+
+
+def _user_file_names(instance):
+    # Lecture de __dict__ : pas de requête pour un champ différé (.only())
+    values = (instance.__dict__.get(field) for field in USER_FILE_FIELDS)
+    return tuple(getattr(value, 'name', value) or None for value in values)
+
+
+@receiver(post_init, sender=User)
+def remember_user_files(sender, instance, **kwargs):
+    instance._file_names = _user_file_names(instance)
+
+
+@receiver(post_save, sender=User)
+def release_replaced_user_files(sender, instance, update_fields=None, **kwargs):
+    names = list(instance._file_names)
+    for i, (field, new) in enumerate(zip(USER_FILE_FIELDS, _user_file_names(instance))):
+        if update_fields is not None and field not in update_fields:
+            continue
+        old, names[i] = names[i], new
+        if old and old != new:
+            transaction.on_commit(lambda name=old: release_name(name))
+    instance._file_names = tuple(names)
+
+
+@receiver(post_delete, sender=User)
+def release_user_files(sender, instance, **kwargs):
+    release_name(instance.profile_picture.name)
+    release_name(instance.student_document.name)
+
+
+# ===================================
+# 🔹 Flux de changements : tombstones des suppressions
+# ===================================
+@receiver(post_delete, sender=Item)
+def log_item_deletion(sender, instance, **kwargs):
+    DeletionLog.objects.create(kind='item', object_id=instance.pk)
+
+
+@receiver(post_delete, sender=ItemImage)
+def log_image_deletion(sender, instance, **kwargs):
+    DeletionLog.objects.create(kind='image', object_id=instance.pk, parent_id=instance.item_id)
+
+
+@receiver(items_bulk_deleted)
+def log_bulk_deletion(sender, rows, images, **kwargs):
+    DeletionLog.objects.bulk_create(
+        [DeletionLog(kind='image', object_id=image['id'], parent_id=image['item_id']) for image in images]
+        + [DeletionLog(kind='item', object_id=row['id']) for row in rows]
+    )
+
+
+# ===================================
+# 🔹 Invalidation du cache par namespace
+# ===================================
+CACHE_NAMESPACES = {
+    Item: 'items',
+    ItemImage: 'items',
+    User: 'users',
+    Cart: 'carts',
+    CartItem: 'carts',
+}
+
+
+def invalidate_cache_namespace(sender, **kwargs):
+    # Après le commit : invalider avant laisserait une lecture concurrente remettre l'ancien état en cache
+    transaction.on_commit(partial(app_cache.invalidate, CACHE_NAMESPACES[sender]))
+
+
+# Un receveur par modèle : sans `sender`, chaque sauvegarde du projet passerait
+# par ici et Django renoncerait à la suppression rapide (fast delete) partout
+for _model in CACHE_NAMESPACES:
+    post_save.connect(invalidate_cache_namespace, sender=_model, dispatch_uid=f'cache-ns-save-{_model.__name__}')
+    post_delete.connect(invalidate_cache_namespace, sender=_model, dispatch_uid=f'cache-ns-delete-{_model.__name__}')
+
+
+@receiver(items_bulk_updated)
+def invalidate_items_after_bulk_update(sender, ids, **kwargs):
+    transaction.on_commit(partial(app_cache.invalidate, 'items'))
+
+
+@receiver(items_bulk_deleted)
+def invalidate_after_bulk_delete(sender, rows, images, **kwargs):
+    # Les lignes de panier des annonces partent avec elles
+    for namespace in ('items', 'carts'):
+        transaction.on_commit(partial(app_cache.invalidate, namespace))
+
+
+# ===================================
+# 🔹 Annonces similaires : recalcul différé de l'annonce modifiée
+# ===================================
+@receiver(post_save, sender=Item)
+@receiver(post_delete, sender=Item)
+def refresh_similar_items(sender, instance, **kwargs):
+    from .tasks import refresh_similar_item
+
+    item_id = instance.pk
+    transaction.on_commit(lambda: refresh_similar_item.enqueue(item_id=item_id))
+
+
+@receiver(items_bulk_updated)
+def refresh_similar_after_bulk_update(sender, ids, **kwargs):
+    from .tasks import refresh_similar_items
+
+    # Un seul job pour tout le lot
+    transaction.on_commit(lambda: refresh_similar_items.enqueue(ids=list(ids)))
+
+
+@receiver(items_bulk_deleted)
+def refresh_similar_after_bulk_delete(sender, rows, images, **kwargs):
+    from .tasks import refresh_similar_items
+
+    ids = [row['id'] for row in rows]
+    transaction.on_commit(lambda: refresh_similar_items.enqueue(ids=ids))
+
+
+# ===================================
+# 🔹 Statistiques de prix : recalcul des groupes touchés
+# ===================================
+PRICE_FIELDS = ('city', 'item_type', 'created_at', 'price')
+
+
+def _price_values(instance):
+    # Lu dans __dict__ : un champ différé (.only()/.defer()) coûterait une requête par annonce
+    values = instance.__dict__
+    return tuple(values[field] for field in PRICE_FIELDS) if all(field in values for field in PRICE_FIELDS) else None
+
+
+def _price_groups(instance, snapshot):
+    if snapshot is None:
+        return set()
+    city, item_type, created_at, price = snapshot
+    return groups_for(city, item_type, created_at) if instance.pk and price is not None else set()
+
+
+def _enqueue_price_groups(groups):
+    from .tasks import refresh_price_groups
+
+    if groups:
+        payload = [list(group) for group in sorted(groups)]
+        transaction.on_commit(lambda: refresh_price_groups.enqueue(groups=payload))
+
+
+@receiver(post_init, sender=Item)
+def remember_price_snapshot(sender, instance, **kwargs):
+    # Valeurs d'origine, pour recalculer aussi l'ancien groupe si la ville change
+    instance._price_snapshot = _price_values(instance)
+
+
+@receiver(post_save, sender=Item)
+def refresh_price_stats_on_save(sender, instance, **kwargs):
+    from .tasks import refresh_price_stats_for_items
+
+    current = _price_values(instance)
+    _enqueue_price_groups(_price_groups(instance, instance._price_snapshot) | _price_groups(instance, current))
+    if current is None:
+        # Annonce chargée partiellement : le job relit ses valeurs en base
+        item_id = instance.pk
+        transaction.on_commit(lambda: refresh_price_stats_for_items.enqueue(ids=[item_id]))
+    instance._price_snapshot = current
+
+
+@receiver(post_delete, sender=Item)
+def refresh_price_stats_on_delete(sender, instance, **kwargs):
+    _enqueue_price_groups(_price_groups(instance, instance._price_snapshot))
+
+
+@receiver(items_bulk_updated)
+def refresh_price_stats_after_bulk_update(sender, ids, **kwargs):
+    from .tasks import refresh_price_stats_for_items
+
+    transaction.on_commit(lambda: refresh_price_stats_for_items.enqueue(ids=list(ids)))
+
+
+@receiver(items_bulk_deleted)
+def refresh_price_stats_after_bulk_delete(sender, rows, images, **kwargs):
+    groups = set()
+    for row in rows:
+        if row['price'] is not None:
+            groups |= groups_for(row['city'], row['item_type'], row['created_at'])
+    _enqueue_price_groups(groups)
+
+
+# ===================================
+# 🔹 Tableau de bord vendeur : invalidation par vendeur concerné
+# ===================================
+@receiver(post_save, sender=Item)
+@receiver(post_delete, sender=Item)
+def invalidate_owner_dashboard(sender, instance, **kwargs):
+    dashboard.invalidate([instance.owner_id])
+
+
+@receiver(items_bulk_updated)
+def invalidate_dashboards_after_bulk_update(sender, ids, **kwargs):
+    dashboard.invalidate(Item.objects.filter(id__in=ids).values_list('owner_id', flat=True).distinct())
+
+
+@receiver(items_bulk_deleted)
+def invalidate_dashboards_after_bulk_delete(sender, rows, images, **kwargs):
+    dashboard.invalidate(row['owner_id'] for row in rows)
+
+
+@receiver(post_save, sender=CartItem)
+@receiver(post_delete, sender=CartItem)
+def invalidate_dashboard_on_cart_change(sender, instance, **kwargs):
+    dashboard.invalidate(Item.objects.filter(id=instance.item_id).values_list('owner_id', flat=True))
+
+
+@receiver(post_save, sender=Payment)
+@receiver(post_delete, sender=Payment)
+def invalidate_dashboards_on_payment(sender, instance, **kwargs):
+    # Seuls les paiements complétés comptent dans le chiffre d'affaires
+    if instance.order_id and instance.status == 'COMPLETED':
+        sellers = OrderLine.objects.filter(order_id=instance.order_id).values_list('seller_id', flat=True)
+        dashboard.invalidate(sellers.distinct())
+
+
+# ===================================
+# 🔹 Événements SSE (/api/events/items/) des connexions de ce process
+# ===================================
+@receiver(post_save, sender=Item)
+def publish_item_event(sender, instance, created, **kwargs):
+    from .events import EVENT_FIELDS, broadcaster
+
+    if len(broadcaster):
+        row = {field: getattr(instance, field) for field in EVENT_FIELDS}
+        transaction.on_commit(lambda: broadcaster.publish_rows([row], created))
+
+
+@receiver(items_bulk_updated)
+def publish_bulk_item_events(sender, ids, **kwargs):
+    from .events import EVENT_FIELDS, broadcaster
+
+    if len(broadcaster):
+        transaction.on_commit(
+            lambda: broadcaster.publish_rows(Item.objects.filter(id__in=ids).values(*EVENT_FIELDS), False)
+        )
+
+
+# ===================================
+# 🔹 Autocomplétion : index en mémoire de ce process
+# ===================================
+@receiver(post_save, sender=Item)
+def update_autocomplete(sender, instance, **kwargs):
+    from .autocomplete import ROW_FIELDS, index
+
+    if index.ready:
+        row = {field: getattr(instance, field) for field in ROW_FIELDS}
+        transaction.on_commit(lambda: index.apply([row]))
+
+
+@receiver(post_delete, sender=Item)
+def remove_from_autocomplete(sender, instance, **kwargs):
+    from .autocomplete import index
+
+    if index.ready:
+        item_id = instance.pk
+        transaction.on_commit(lambda: index.remove([item_id]))
+
+
+@receiver(items_bulk_updated)
+def update_autocomplete_after_bulk_update(sender, ids, **kwargs):
+    from .autocomplete import ROW_FIELDS, index
+
+    if index.ready:
+        transaction.on_commit(lambda: index.apply(Item.objects.filter(id__in=ids).values(*ROW_FIELDS)))
+
+
+@receiver(items_bulk_deleted)
+def remove_from_autocomplete_after_bulk_delete(sender, rows, images, **kwargs):
+    from .autocomplete import index
+
+    if index.ready:
+        ids = [row['id'] for row in rows]
+        transaction.on_commit(lambda: index.remove(ids))
@@ -0,0 +1,233 @@
+import heapq
+import math
+import re
+import unicodedata
+from collections import Counter, defaultdict
+
+from django.conf import settings
+from django.db import transaction
+
+from .cache import app_cache
+from .models import Item, ItemVector
+
+
+# Poids relatifs des familles de termes
+FIELD_WEIGHTS = {
+    'title': 1.0,
+    'description': 0.4,
+    'city': 0.8,
+    'band': 0.6,
+}
+
+STOPWORDS = {
+    'a', 'au', 'aux', 'avec', 'ce', 'ces', 'dans', 'de', 'des', 'du', 'en', 'et', 'la', 'le',
+    'les', 'un', 'une', 'pour', 'par', 'sur', 'tres', 'plus', 'est', 'the', 'and', 'for', 'with',
+}
+
+ITEM_FIELDS = ('id', 'title', 'description', 'city', 'price', 'item_type')
+
+
+# ===================================
+# 🔹 Vectorisation
+# ===================================
+def tokenize(text):
+    text = unicodedata.normalize('NFKD', text or '').encode('ascii', 'ignore').decode().lower()
+    return [t for t in re.findall(r'[a-z0-9]+', text) if len(t) > 1 and t not in STOPWORDS]
+
+
+def price_band(price):
+    """Tranche de prix logarithmique (×2) : 100 et 180 MAD sont voisins, 100 et 1000 non."""
+    if not price or price <= 0:
+        return None
+    return int(math.log2(float(price)))
+
+
+def item_vector(row):
+    """Vecteur normé d'une annonce à partir d'un dict (ITEM_FIELDS)."""
+    weights = Counter()
+    for field in ('title', 'description'):
+        for term, count in Counter(tokenize(row[field])).items():
+            weights[f"{field[0]}:{term}"] += FIELD_WEIGHTS[field] * (1 + math.log(count))
+    if row['city']:
+        weights[f"city:{' '.join(tokenize(row['city']))}"] += FIELD_WEIGHTS['city']
+    band = price_band(row['price'])
+    if band is not None:
+        weights[f"band:{band}"] += FIELD_WEIGHTS['band']
+
+    norm = math.sqrt(sum(w * w for w in weights.values())) or 1.0
+    return {term: round(w / norm, 6) for term, w in weights.items()}
+
+
+def dot(a, b):
+    if len(a) > len(b):
+        a, b = b, a
+    return sum(w * b.get(term, 0.0) for term, w in a.items())
+
+
+def _comparable(item_type):
+    return Item.objects.filter(is_available=True, item_type=item_type)
+
+
+# ===================================
+# 🧮 Construction complète (batch)
+# ===================================
+def build_all(k=None, batch_size=500):
+    """
+    Recalcule vecteurs et voisins de toutes les annonces disponibles.
+    Les scores sont calculés par lots via un index inversé (produit creux
+    lot × corpus) : seules les paires partageant au moins un terme sont visitées.
+    Renvoie le nombre d'annonces indexées.
+    """
+    k = k or settings.SIMILAR_ITEMS_K
+    total = 0
+    for item_type, _ in Item.TYPE_CHOICES:
+        rows = list(_comparable(item_type).values(*ITEM_FIELDS))
+        vectors = {row['id']: item_vector(row) for row in rows}
+
+        postings = defaultdict(list)
+        for item_id, vector in vectors.items():
+            for term, weight in vector.items():
+                postings[term].append((item_id, weight))
+
+        ids = list(vectors)
+        for start in range(0, len(ids), batch_size):
+            batch = []
+            for item_id in ids[start:start + batch_size]:
+                scores = defaultdict(float)
+                for term, weight in vectors[item_id].items():
+                    for other_id, other_weight in postings[term]:
+                        if other_id != item_id:
+                            scores[other_id] += weight * other_weight
+                top = heapq.nlargest(k, scores.items(), key=lambda pair: (pair[1], -pair[0]))
+                batch.append(ItemVector(
+                    item_id=item_id,
+                    vector=vectors[item_id],
+                    neighbours=[[other_id, round(score, 4)] for other_id, score in top],
+                ))
+            ItemVector.objects.bulk_create(
+                batch,
+                update_conflicts=True,
+                unique_fields=['item'],
+                update_fields=['vector', 'neighbours', 'updated_at'],
+            )
+        total += len(ids)
+
+    ItemVector.objects.exclude(item__is_available=True).delete()
+    return total
+
+
+# ===================================
+# 🔁 Mise à jour incrémentale d'une annonce
+# ===================================
+def _insert_neighbour(neighbours, item_id, score, k):
+    """Retire puis réinsère `item_id` dans une liste triée de voisins bornée à k."""
+    kept = [pair for pair in neighbours if pair[0] != item_id]
+    if score > 0:
+        kept.append([item_id, round(score, 4)])
+    kept.sort(key=lambda pair: (-pair[1], pair[0]))
+    return kept[:k]
+
+
+def _candidate_ids(item_id, item_type, old_neighbours, limit):
+    """
+    Annonces à comparer : les voisines actuelles de l'annonce (celles qui la
+    listent le plus probablement) et les `limit` plus récentes du même type.
+    """
+    recent = ItemVector.objects.exclude(item_id=item_id)
+    if item_type:
+        recent = recent.filter(item__item_type=item_type)
+    ids = set(recent.order_by('-item_id').values_list('item_id', flat=True)[:limit])
+    return ids | {pair[0] for pair in old_neighbours}
+
+
+class RefreshBusy(RuntimeError):
+    """Un recalcul de la même annonce est en cours : le job sera rejoué."""
+
+
+def _lock_key(item_id):
+    return f"similar:refresh:{item_id}"
+
+
+def _relist(neighbours, item_id, score, k):
+    """Nouvelle liste si l'annonce y entre, s'y déplace ou en sort ; None sinon."""
+    listed = any(pair[0] == item_id for pair in neighbours)
+    qualifies = score > 0 and (len(neighbours) < k or score > neighbours[-1][1])
+    return _insert_neighbour(neighbours, item_id, score, k) if listed or qualifies else None
+
+
+def refresh_item(item_id, k=None, candidates=None):
+    """
+    Met à jour le vecteur d'une annonce, sa liste de voisins, et sa place dans
+    la liste des autres annonces (ajout, déplacement ou retrait).
+
+    Coût borné : seules SIMILAR_REFRESH_CANDIDATES annonces récentes et les
+    voisines actuelles sont comparées ; les plus anciennes sont rattrapées
+    par le prochain `build_item_vectors`, comme les places libérées dans une
+    liste pleine. Les candidates sont lues sans verrou ; seules les listes à
+    réécrire (et celle de l'annonce) sont verrouillées, en une requête par id
+    croissant, puis relues : pas d'interblocage ni de voisins écrasés. Un
+    verrou de cache sérialise les recalculs d'une même annonce (RefreshBusy :
+    le job est rejoué) ; l'annonce elle-même n'est jamais verrouillée, le
+    checkout n'attend pas.
+    """
+    k = k or settings.SIMILAR_ITEMS_K
+    candidates = candidates or settings.SIMILAR_REFRESH_CANDIDATES
+    if not app_cache.shared.add(_lock_key(item_id), 1, settings.SIMILAR_REFRESH_LOCK_TIMEOUT):
+        raise RefreshBusy(f"Recalcul de l'annonce {item_id} déjà en cours")
+    try:
+        _refresh_item(item_id, k, candidates)
+    finally:
+        app_cache.shared.delete(_lock_key(item_id))
+
+
+def _refresh_item(item_id, k, candidates):
+    row = Item.objects.filter(id=item_id, is_available=True).values(*ITEM_FIELDS).first()
+    vector = item_vector(row) if row else None
+    item_type = row['item_type'] if row else None
+    old_neighbours = ItemVector.objects.filter(item_id=item_id).values_list('neighbours', flat=True).first() or []
+
+    others = ItemVector.objects.filter(
+        item_id__in=_candidate_ids(item_id, item_type, old_neighbours, candidates)
+    ).values_list('item_id', 'vector', 'neighbours')
+
+    scores = {}
+    to_update = set()
+    for other_id, other_vector, neighbours in others.iterator(chunk_size=1000):
+        score = dot(vector, other_vector) if vector else 0.0
+        if score > 0:
+            scores[other_id] = score
+        if _relist(neighbours, item_id, score, k) is not None:
+            to_update.add(other_id)
+
+    with transaction.atomic():
+        # Verrous pris en une fois, par id croissant ; les listes relues sous verrou
+        locked = ItemVector.objects.select_for_update().filter(
+            item_id__in=to_update | {item_id}
+        ).only('item_id', 'neighbours').order_by('item_id')
+        changed = []
+        for other in locked:
+            if other.item_id == item_id:
+                continue
+            neighbours = _relist(other.neighbours, item_id, scores.get(other.item_id, 0.0), k)
+            if neighbours is not None:
+                other.neighbours = neighbours
+                changed.append(other)
+        if changed:
+            ItemVector.objects.bulk_update(changed, ['neighbours'], batch_size=1000)
+        if vector is None:
+            ItemVector.objects.filter(item_id=item_id).delete()
+            return
+        top = heapq.nlargest(k, scores.items(), key=lambda pair: (pair[1], -pair[0]))
+        ItemVector.objects.update_or_create(
+            item_id=item_id,
+            defaults={
+                'vector': vector,
+                'neighbours': [[other_id, round(score, 4)] for other_id, score in top],
+            },
+        )
+
+
+def similar_ids(item_id, limit):
+    """Une seule lecture : ids des annonces voisines pré-calculées, None si l'annonce n'a pas de vecteur."""
+    neighbours = ItemVector.objects.filter(item_id=item_id).values_list('neighbours', flat=True).first()
+    return None if neighbours is None else [pair[0] for pair in neighbours[:limit]]
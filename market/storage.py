@@ -0,0 +1,321 @@
+"""
+Stockage des médias (settings.STORAGES["default"]).
+
+- `PooledS3Storage` : S3 via django-storages, avec un client boto3 partagé
+  par process (pool de connexions HTTP réutilisé par tous les threads),
+  des uploads multipart parallèles et un cache disque local des originaux
+  relus (images d'annonces, photos de profil).
+- `LocalMediaStorage` : équivalent sur le système de fichiers pour les
+  tests, avec le même cache et les mêmes compteurs.
+
+Les noms stockés sont dérivés du contenu (media.store_file) et jamais
+écrasés : une entrée du cache ne peut donc pas devenir périmée.
+"""
+import hashlib
+import os
+import shutil
+import threading
+from collections import Counter, OrderedDict
+
+from boto3.s3.transfer import TransferConfig
+from botocore.config import Config
+from botocore.exceptions import ClientError
+from django.conf import settings
+from django.core.files import File
+from django.core.files.storage import FileSystemStorage
+from s3transfer.constants import ALLOWED_DOWNLOAD_ARGS
+from storages.backends.s3 import S3Storage
+from storages.utils import clean_name
+
+
+def _conf():
+    return getattr(settings, 'MEDIA_STORAGE', {})
+
+
+# ===================================
+# 🔹 Cache de lecture : LRU borné sur disque local
+# ===================================
+class DiskReadCache:
+    """
+    Un fichier par objet, nommé par le SHA-1 de son nom de stockage. Les
+    écritures passent par un fichier temporaire renommé atomiquement : les
+    workers d'une même machine peuvent partager le répertoire. Chaque
+    process tient son propre LRU ; un fichier évincé par un voisin est
+    simplement retéléchargé.
+    """
+
+    def __init__(self, directory, max_bytes, max_entry_bytes):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.max_entry_bytes = max_entry_bytes
+        self._entries = OrderedDict()  # clé → taille
+        self._size = 0
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+        self._load()
+
+    def _load(self):
+        # Reprend les fichiers d'un démarrage précédent, du moins au plus récemment lu
+        found = []
+        for entry in os.scandir(self.directory):
+            if entry.is_file() and '.' not in entry.name:
+                stat = entry.stat()
+                found.append((stat.st_atime, entry.name, stat.st_size))
+        for _, key, size in sorted(found):
+            self._entries[key] = size
+            self._size += size
+        self._evict()
+
+    def _key(self, name):
+        return hashlib.sha1(name.encode()).hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.directory, key)
+
+    def get(self, name):
+        """Fichier ouvert en lecture, ou None."""
+        key = self._key(name)
+        with self._lock:
+            if key not in self._entries:
+                return None
+            self._entries.move_to_end(key)
+        try:
+            return open(self._path(key), 'rb')
+        except FileNotFoundError:
+            self._forget(key)
+            return None
+
+    def fill(self, name, write):
+        """
+        Remplit l'entrée avec `write(fichier)` et renvoie le fichier ouvert
+        en lecture. Un objet plus gros que max_entry_bytes est servi sans
+        être conservé.
+        """
+        key = self._key(name)
+        tmp_path = f"{self._path(key)}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            with open(tmp_path, 'wb') as fh:
+                write(fh)
+                size = fh.tell()
+            result = open(tmp_path, 'rb')
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        if size > self.max_entry_bytes:
+            os.remove(tmp_path)  # le descripteur ouvert reste lisible
+            return result
+        os.replace(tmp_path, self._path(key))
+        with self._lock:
+            self._size += size - self._entries.pop(key, 0)
+            self._entries[key] = size
+        self._evict()
+        return result
+
+    def discard(self, name):
+        key = self._key(name)
+        self._forget(key)
+        try:
+            os.remove(self._path(key))
+        except FileNotFoundError:
+            pass
+
+    def _forget(self, key):
+        with self._lock:
+            self._size -= self._entries.pop(key, 0)
+
+    def _evict(self):
+        while True:
+            with self._lock:
+                if self._size <= self.max_bytes or not self._entries:
+                    return
+                key, size = self._entries.popitem(last=False)
+                self._size -= size
+            try:
+                os.remove(self._path(key))
+            except FileNotFoundError:
+                pass
+
+    def __len__(self):
+        return len(self._entries)
+
+    @property
+    def size(self):
+        return self._size
+
+
+# ===================================
+# 🔹 Comportement commun : cache de lecture et compteurs
+# ===================================
+class CachedReadsMixin:
+    """
+    Les ouvertures binaires en lecture des préfixes READ_CACHE_PREFIXES
+    passent par le cache disque ; le reste est délégué au backend.
+    """
+
+    COUNTERS = ('hits', 'misses', 'passthrough_reads', 'uploads', 'bytes_uploaded', 'bytes_downloaded')
+
+    def _setup_read_cache(self):
+        conf = _conf()
+        self.counters = Counter()
+        self._counters_lock = threading.Lock()
+        self.read_cache_prefixes = tuple(conf.get('READ_CACHE_PREFIXES', ()))
+        self.read_cache = None
+        if conf.get('READ_CACHE_MAX_BYTES'):
+            self.read_cache = DiskReadCache(
+                conf['READ_CACHE_DIR'],
+                conf['READ_CACHE_MAX_BYTES'],
+                conf.get('READ_CACHE_MAX_ENTRY_BYTES', conf['READ_CACHE_MAX_BYTES']),
+            )
+
+    def count(self, **deltas):
+        with self._counters_lock:
+            self.counters.update(deltas)
+
+    def _fetch(self, name, fh):
+        """Copie l'objet `name` dans `fh` ; FileNotFoundError s'il n'existe pas."""
+        raise NotImplementedError
+
+    def _cacheable(self, name, mode):
+        return (
+            self.read_cache is not None
+            and mode in ('rb', 'br')
+            and name.startswith(self.read_cache_prefixes)
+        )
+
+    def _open(self, name, mode='rb'):
+        name = clean_name(name)
+        if not self._cacheable(name, mode):
+            self.count(passthrough_reads=1)
+            return super()._open(name, mode)
+
+        cached = self.read_cache.get(name)
+        if cached is not None:
+            self.count(hits=1)
+            return File(cached, name)
+
+        file = self.read_cache.fill(name, lambda fh: self._fetch(name, fh))
+        self.count(misses=1, bytes_downloaded=os.fstat(file.fileno()).st_size)
+        return File(file, name)
+
+    def _save(self, name, content):
+        name = super()._save(name, content)
+        self.count(uploads=1, bytes_uploaded=content.size or 0)
+        return name
+
+    def delete(self, name):
+        super().delete(name)
+        if self.read_cache is not None:
+            self.read_cache.discard(clean_name(name))
+
+    def stats(self):
+        lookups = self.counters['hits'] + self.counters['misses']
+        return {
+            **{key: self.counters[key] for key in self.COUNTERS},
+            'cache_entries': len(self.read_cache) if self.read_cache else 0,
+            'cache_bytes': self.read_cache.size if self.read_cache else 0,
+            'hit_rate': round(self.counters['hits'] / lookups, 4) if lookups else None,
+        }
+
+
+# ===================================
+# ☁️ S3 : client partagé par process, multipart parallèle
+# ===================================
+class PooledS3Storage(CachedReadsMixin, S3Storage):
+    """
+    S3Storage crée une session et un client boto3 par thread (threading.local),
+    chacun avec son propre pool de connexions. Ici un seul client par
+    configuration et par process — les clients botocore sont thread-safe —
+    et chaque thread n'a qu'une ressource légère posée dessus.
+    """
+
+    _shared = {}
+    _shared_lock = threading.Lock()
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self._setup_read_cache()
+
+    def get_default_settings(self):
+        conf = _conf()
+        defaults = super().get_default_settings()
+        if defaults['client_config'] is None:
+            defaults['client_config'] = Config(
+                s3={'addressing_style': defaults['addressing_style']},
+                signature_version=defaults['signature_version'],
+                proxies=defaults['proxies'],
+                max_pool_connections=conf.get('MAX_POOL_CONNECTIONS', 10),
+                retries={'max_attempts': conf.get('MAX_ATTEMPTS', 5), 'mode': 'standard'},
+                tcp_keepalive=True,
+            )
+        if defaults['transfer_config'] is None:
+            defaults['transfer_config'] = TransferConfig(
+                multipart_threshold=conf.get('MULTIPART_THRESHOLD', 8 * 1024 * 1024),
+                multipart_chunksize=conf.get('MULTIPART_CHUNKSIZE', 8 * 1024 * 1024),
+                max_concurrency=conf.get('MAX_CONCURRENCY', 10),
+                use_threads=True,
+            )
+        return defaults
+
+    def _shared_key(self):
+        return (
+            self.access_key, self.secret_key, self.security_token, self.session_profile,
+            self.region_name, self.endpoint_url, self.use_ssl, self.verify,
+            repr(sorted(self.client_config._user_provided_options.items())),
+        )
+
+    def _shared_resource(self):
+        key = self._shared_key()
+        resource = self._shared.get(key)
+        if resource is None:
+            with self._shared_lock:
+                resource = self._shared.get(key)
+                if resource is None:
+                    resource = self._create_session().resource(
+                        's3',
+                        region_name=self.region_name,
+                        use_ssl=self.use_ssl,
+                        endpoint_url=self.endpoint_url,
+                        config=self.client_config,
+                        verify=self.verify,
+                    )
+                    self._shared[key] = resource
+        return resource
+
+    @property
+    def connection(self):
+        connection = getattr(self._connections, 'connection', None)
+        if connection is None:
+            # Les ressources boto3 ne sont pas thread-safe, le client si
+            shared = self._shared_resource()
+            connection = type(shared)(client=shared.meta.client)
+            self._connections.connection = connection
+        return connection
+
+    def _fetch(self, name, fh):
+        key = self._normalize_name(name)
+        params = {
+            k: v for k, v in self.get_object_parameters(name).items()
+            if k in ALLOWED_DOWNLOAD_ARGS
+        }
+        try:
+            self.bucket.Object(key).download_fileobj(fh, ExtraArgs=params, Config=self.transfer_config)
+        except ClientError as err:
+            if err.response['ResponseMetadata']['HTTPStatusCode'] == 404:
+                raise FileNotFoundError(f"File does not exist: {name}")
+            raise
+
+
+# ===================================
+# 🧪 Équivalent système de fichiers (tests)
+# ===================================
+class LocalMediaStorage(CachedReadsMixin, FileSystemStorage):
+    """FileSystemStorage dont `location` joue le rôle du bucket."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._setup_read_cache()
+
+    def _fetch(self, name, fh):
+        with open(self.path(name), 'rb') as source:
+            shutil.copyfileobj(source, fh)
@@ -0,0 +1,204 @@
+import logging
+from datetime import timedelta
+
+from django.db import transaction
+from django.utils import timezone
+
+from .jobs import task
+from .media import collect_garbage
+from .models import Item, Payment
+from . import archive, cleanup, currency, dashboard, price_stats, providers, reservations, similar
+from .orders import seller_ids
+from .reservations import ReservationConflict
+
+
+logger = logging.getLogger(__name__)
+
+
+# ===================================
+# 🗑️ Médias
+# ===================================
+@task('media.collect_garbage', queue='media', max_attempts=3)
+def collect_media_garbage(grace_hours=24, batch_size=100):
+    while len(collect_garbage(timedelta(hours=grace_hours), batch_size)) == batch_size:
+        pass
+
+
+# ===================================
+# 💳 Paiements (appels fournisseurs hors requête)
+# ===================================
+def settle_payments(payments, new_status, **fields):
+    """
+    Passe les paiements encore PENDING à `new_status` et règle leurs blocages
+    (vente conclue ou annonces libérées), dans une transaction. Rejouable :
+    un paiement déjà réglé n'est pas retouché. Une vente refusée par
+    complete_orders (annonce vendue entre-temps, blocage expiré) passe
+    FAILED : l'argent encaissé est à rembourser, l'erreur est journalisée.
+    Renvoie le statut final.
+    """
+    with transaction.atomic():
+        pending = list(payments.select_for_update().filter(status='PENDING').values_list('pk', 'order_id'))
+        if not pending:
+            return None
+        order_ids = [order_id for _, order_id in pending]
+        if new_status == 'COMPLETED':
+            try:
+                reservations.complete_orders(order_ids)
+            except ReservationConflict as e:
+                logger.error(
+                    "Paiement(s) %s encaissé(s) pour des annonces plus réservées %s : remboursement à faire",
+                    [pk for pk, _ in pending], e.item_ids,
+                )
+                new_status, fields = 'FAILED', {}
+        if new_status != 'COMPLETED':
+            reservations.release_orders(order_ids)
+        Payment.objects.filter(pk__in=[pk for pk, _ in pending]).update(status=new_status, updated_at=timezone.now(), **fields)
+    dashboard.invalidate(seller_ids(payments))
+    return new_status
+
+
+# Statuts où le client peut encore payer : un paiement abandonné (`stale`) y est annulé chez Stripe
+STRIPE_OPEN_STATUSES = ('requires_payment_method', 'requires_confirmation', 'requires_action')
+# Commandes PayPal jamais capturées : seule notre capture encaisse, l'abandon est sans risque
+PAYPAL_OPEN_STATUSES = ('CREATED', 'SAVED', 'APPROVED', 'PAYER_ACTION_REQUIRED')
+
+
+def abandon_payments(payments):
+    """
+    Abandonne des paiements PENDING sans perdre d'argent encaissé : chaque
+    fournisseur est interrogé (`stale=True`) et tranche, vente conclue si le
+    client a payé, annulation sinon. Un paiement sans référence fournisseur
+    n'a rien pu encaisser : il est annulé tout de suite. Renvoie le nombre
+    de paiements traités.
+    """
+    rows = list(payments.filter(status='PENDING').values_list('pk', 'stripe_payment_intent_id', 'paypal_order_id'))
+    intents = {intent_id for _, intent_id, _ in rows if intent_id}
+    orders = {order_id for _, intent_id, order_id in rows if order_id and not intent_id}
+    orphans = [pk for pk, intent_id, order_id in rows if not (intent_id or order_id)]
+    with transaction.atomic():
+        for intent_id in intents:
+            verify_stripe_payment.enqueue(payment_intent_id=intent_id, stale=True)
+        for order_id in orders:
+            sync_paypal_order.enqueue(order_id=order_id, stale=True)
+    if orphans:
+        settle_payments(Payment.objects.filter(pk__in=orphans), 'CANCELLED')
+    return len(rows)
+
+
+@task('payments.verify_stripe_payment', queue='payments')
+def verify_stripe_payment(payment_intent_id, stale=False):
+    """
+    Seule source de vérité d'un paiement Stripe : la confirmation du client
+    ne fait que mettre ce job en file, la vente n'est conclue qu'ici.
+    `stale` (nettoyage des paiements abandonnés) : un PaymentIntent encore
+    ouvert est annulé chez Stripe avant d'annuler le paiement.
+    """
+    intent = providers.stripe_retrieve_intent(payment_intent_id)
+    if stale and intent.status in STRIPE_OPEN_STATUSES:
+        # Échoue si le client a payé entre-temps : le job rejoué relira l'intent
+        intent = providers.stripe_cancel_intent(payment_intent_id)
+    payments = Payment.objects.filter(stripe_payment_intent_id=payment_intent_id)
+    if intent.status == 'succeeded' and not all(providers.stripe_intent_matches(p, intent) for p in payments):
+        # Montant encaissé ≠ montant demandé : pas de vente, remboursement à traiter à la main
+        logger.error("PaymentIntent %s : montant encaissé %s %s inattendu", payment_intent_id, intent.amount_received, intent.currency)
+        new_status = 'FAILED'
+    elif intent.status == 'succeeded':
+        new_status = 'COMPLETED'
+    elif intent.status == 'canceled':
+        new_status = 'CANCELLED'
+    elif intent.status == 'requires_payment_method':
+        new_status = 'FAILED'
+    else:
+        raise RuntimeError(f"PaymentIntent {payment_intent_id} encore en statut {intent.status}")
+    return settle_payments(payments, new_status)
+
+
+@task('payments.sync_paypal_order', queue='payments')
+def sync_paypal_order(order_id, stale=False):
+    """
+    Aligne un paiement PayPal en attente sur l'état de la commande chez
+    PayPal ; `stale` : une commande jamais capturée est abandonnée.
+    """
+    data = providers.paypal_get_order(order_id)
+    payer = data.get("payer", {})
+    payments = Payment.objects.filter(paypal_order_id=order_id)
+    if data.get("status") == "COMPLETED" and not all(providers.paypal_capture_matches(p, data) for p in payments):
+        # Montant capturé ≠ montant demandé : pas de vente, remboursement à traiter à la main
+        logger.error("Commande PayPal %s : montant capturé %s inattendu", order_id, providers.paypal_captured_amount(data))
+        return settle_payments(payments, "FAILED")
+    if data.get("status") == "COMPLETED":
+        return settle_payments(
+            payments, "COMPLETED",
+            payer_email=payer.get("email_address"), payer_id=payer.get("payer_id"),
+        )
+    if data.get("status") == "VOIDED" or (stale and data.get("status") in PAYPAL_OPEN_STATUSES):
+        return settle_payments(payments, "CANCELLED")
+    return None
+
+
+# ===================================
+# 🔎 Annonces similaires
+# ===================================
+@task('similar.refresh_item', max_attempts=3)
+def refresh_similar_item(item_id):
+    similar.refresh_item(item_id)
+
+
+@task('similar.refresh_items', max_attempts=3)
+def refresh_similar_items(ids):
+    for item_id in ids:
+        similar.refresh_item(item_id)
+
+
+# ===================================
+# 📊 Statistiques de prix
+# ===================================
+@task('price_stats.refresh_groups', max_attempts=3)
+def refresh_price_groups(groups):
+    price_stats.refresh_groups([tuple(group) for group in groups])
+
+
+@task('price_stats.refresh_items', max_attempts=3)
+def refresh_price_stats_for_items(ids):
+    groups = set()
+    for city, item_type, created_at in Item.objects.filter(id__in=ids).values_list('city', 'item_type', 'created_at'):
+        groups |= price_stats.groups_for(city, item_type, created_at)
+    price_stats.refresh_groups(groups)
+
+
+@task('price_stats.refresh_global', max_attempts=3)
+def refresh_global_price_groups(groups):
+    price_stats.refresh_global_groups([tuple(group) for group in groups])
+
+
+# ===================================
+# ⏱️ Réservations
+# ===================================
+@task('reservations.expire', max_attempts=3)
+def expire_reservations(batch_size=None):
+    reservations.expire_holds(batch_size)
+
+
+# ===================================
+# 🗄️ Archivage des annonces
+# ===================================
+@task('items.archive', max_attempts=3)
+def archive_items(batch_size=None, max_batches=None, pause=0.5):
+    archive.archive(batch_size, max_batches, pause)
+
+
+# ===================================
+# 🧹 Nettoyage des lignes expirées
+# ===================================
+@task('maintenance.cleanup', max_attempts=3)
+def cleanup_expired_rows(targets=None):
+    cleanup.run(targets)
+
+
+# ===================================
+# 💱 Taux de change (prix affichés en devises, conversion des paiements)
+# ===================================
+@task('currency.refresh_rates', max_attempts=3)
+def refresh_exchange_rates():
+    currency.refresh_rates()
+
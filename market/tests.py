@@ -1,3 +1,1392 @@
-from django.test import TestCase
+import asyncio
+import os
+import shutil
+import tempfile
+import threading
+import time
+from datetime import timedelta
+from decimal import Decimal
+from io import StringIO
+from types import SimpleNamespace
+from unittest import mock, skipUnless
 
-# Create your tests here.
+import requests
+import stripe
+from asgiref.sync import async_to_sync
+from django.conf import settings
+from django.contrib.sessions.models import Session
+from django.core.exceptions import ImproperlyConfigured, MiddlewareNotUsed
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import connection
+from django.db.models.signals import post_delete, post_save
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.utils import timezone
+from rest_framework import viewsets
+from rest_framework.response import Response
+from rest_framework.test import APIRequestFactory
+
+from sh import openapi
+
+from . import archive, autocomplete, currency, dashboard, jobs, price_stats, similar, tasks, throttling, uploads
+from .cache import LocalLRU, TwoLevelCache, app_cache
+from .changes import CursorError, CursorExpired, encode_cursor, read_changes
+from .idempotency import idempotent
+from .media import collect_garbage, release_name, store_file
+from .models import ArchivedItem, Cart, CartItem, DeletionLog, IdempotencyKey, Item, ItemImage, Job, MediaBlob, Order, Payment, PriceStat, Reservation, UploadSession, User
+from .cleanup import PAYMENT_TARGET, run as run_cleanup
+from .events import Broadcaster, broadcaster, event_for, stream as events_stream
+from .orders import OrderError, snapshot_cart
+from .query_budget import query_budget
+from .reservations import ReservationConflict, complete_orders, expire_holds, release_orders
+from .profiling import HTTPTimeline, ProfilingMiddleware
+from .storage import LocalMediaStorage
+from .throttling import IPTokenBucketThrottle
+
+
+def use_rates(test, **rates):
+    """Table de taux « relue par le job » (aucune sans argument), effacée après le test."""
+    app_cache.delete(currency.RATES_NAMESPACE, "table")  # cache de test persistant entre deux lancements
+    test.addCleanup(app_cache.delete, currency.RATES_NAMESPACE, "table")
+    if rates:
+        app_cache.set(currency.RATES_NAMESPACE, "table", {"rates": rates, "fetched_at": time.time()}, ttl=600)
+
+
+def make_buyer(n, *items):
+    user = User.objects.create(username=f"buyer{n}", email=f"buyer{n}@example.com")
+    cart = Cart.objects.create(user=user)
+    for item in items:
+        CartItem.objects.create(cart=cart, item=item)
+    return user, cart
+
+
+# ===================================
+# 🔒 Réservations au checkout
+# ===================================
+class ReservationTests(TestCase):
+    def setUp(self):
+        self.seller = User.objects.create(username="seller", email="seller@example.com")
+        self.item = Item.objects.create(title="Bureau", item_type="SELL", price=300, owner=self.seller)
+
+    def test_second_checkout_conflicts(self):
+        alice, alice_cart = make_buyer(1, self.item)
+        bob, bob_cart = make_buyer(2, self.item)
+
+        snapshot_cart(alice, alice_cart)
+        with self.assertRaises(ReservationConflict) as ctx:
+            snapshot_cart(bob, bob_cart)
+
+        self.assertEqual(ctx.exception.item_ids, [self.item.id])
+        self.assertFalse(Order.objects.filter(user=bob).exists())
+
+    def test_completion_marks_item_sold(self):
+        alice, alice_cart = make_buyer(1, self.item)
+        order = snapshot_cart(alice, alice_cart)
+
+        self.assertEqual(complete_orders([order.id]), [self.item.id])
+
+        self.item.refresh_from_db()
+        self.assertFalse(self.item.is_available)
+        self.assertEqual(Reservation.objects.get(order=order).status, 'CONVERTED')
+
+    def test_expired_hold_can_be_taken_over(self):
+        alice, alice_cart = make_buyer(1, self.item)
+        bob, bob_cart = make_buyer(2, self.item)
+        snapshot_cart(alice, alice_cart)
+        Reservation.objects.update(expires_at=timezone.now() - timedelta(seconds=1))
+
+        self.assertEqual(expire_holds(), 1)
+        snapshot_cart(bob, bob_cart)
+        self.assertEqual(Reservation.objects.get(status='ACTIVE').user, bob)
+
+    def test_release_frees_item(self):
+        alice, alice_cart = make_buyer(1, self.item)
+        bob, bob_cart = make_buyer(2, self.item)
+        order = snapshot_cart(alice, alice_cart)
+
+        release_orders([order.id])
+        snapshot_cart(bob, bob_cart)
+
+    def test_rent_items_are_not_reserved(self):
+        rental = Item.objects.create(title="Frigo", item_type="RENT", price=80, owner=self.seller)
+        alice, alice_cart = make_buyer(1, rental)
+
+        snapshot_cart(alice, alice_cart)
+        self.assertFalse(Reservation.objects.exists())
+
+
+@skipUnless(connection.features.has_select_for_update_skip_locked, "SELECT … FOR UPDATE SKIP LOCKED requis")
+class ParallelCheckoutTests(TransactionTestCase):
+    """Checkouts simultanés dans des threads (une connexion chacun)."""
+
+    BUYERS = 12
+
+    def run_checkouts(self, buyers):
+        barrier = threading.Barrier(len(buyers))
+        results = []
+
+        def checkout(user, cart):
+            try:
+                barrier.wait()
+                started = time.perf_counter()
+                try:
+                    snapshot_cart(user, cart)
+                    outcome = 'ok'
+                except ReservationConflict:
+                    outcome = 'conflict'
+                results.append((outcome, time.perf_counter() - started))
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=checkout, args=buyer) for buyer in buyers]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return results
+
+    def test_single_item_sold_once(self):
+        item = Item.objects.create(title="Chaise", item_type="SELL", price=50)
+        buyers = [make_buyer(n, item) for n in range(self.BUYERS)]
+
+        results = self.run_checkouts(buyers)
+
+        outcomes = [outcome for outcome, _ in results]
+        self.assertEqual(outcomes.count('ok'), 1)
+        self.assertEqual(outcomes.count('conflict'), self.BUYERS - 1)
+        self.assertEqual(Reservation.objects.filter(status='ACTIVE').count(), 1)
+        self.assertEqual(Order.objects.count(), 1)
+        # SKIP LOCKED : les perdants échouent aussitôt au lieu d'attendre le verrou
+        self.assertLess(max(duration for _, duration in results), 5)
+
+    def test_distinct_items_do_not_serialize(self):
+        buyers = [
+            make_buyer(n, Item.objects.create(title=f"Lampe {n}", item_type="SELL", price=20))
+            for n in range(self.BUYERS)
+        ]
+
+        results = self.run_checkouts(buyers)
+
+        self.assertEqual([outcome for outcome, _ in results], ['ok'] * self.BUYERS)
+        self.assertEqual(Reservation.objects.filter(status='ACTIVE').count(), self.BUYERS)
+        self.assertLess(max(duration for _, duration in results), 5)
+
+
+# ===================================
+# 💳 Checkout : appels fournisseurs
+# ===================================
+class CheckoutProviderTests(TestCase):
+    def setUp(self):
+        use_rates(self, USD="0.1")
+        self.seller = User.objects.create(username="seller", email="seller@example.com")
+        self.item = Item.objects.create(title="Bureau", item_type="SELL", price=300, owner=self.seller)
+        self.buyer, self.cart = make_buyer(1, self.item)
+
+    def post(self, action, **data):
+        return self.client.post(f"/api/payments/{action}/", data, content_type="application/json")
+
+    def test_unpriced_item_rejects_cart(self):
+        CartItem.objects.create(cart=self.cart, item=Item.objects.create(title="Lampe", item_type="SELL", owner=self.seller))
+        with self.assertRaisesMessage(OrderError, "Lampe"):
+            snapshot_cart(self.buyer, self.cart)
+        self.assertFalse(Order.objects.exists())
+
+    @mock.patch("market.providers.paypal_access_token", return_value="token")
+    def test_paypal_failure_releases_holds(self, _token):
+        with mock.patch("requests.post", side_effect=requests.ConnectionError), self.assertLogs("market.views", "ERROR"):
+            response = self.post("create-order", email=self.buyer.email)
+        self.assertEqual(response.status_code, 502)
+        self.assertEqual(Reservation.objects.get().status, "RELEASED")
+
+    def test_stripe_failure_releases_holds(self):
+        with mock.patch("stripe.PaymentIntent.create", side_effect=stripe.APIConnectionError("down")), \
+                self.assertLogs("market.views", "ERROR"):
+            response = self.post("create-payment-stripe", email=self.buyer.email)
+        self.assertEqual(response.status_code, 502)
+        self.assertEqual(Reservation.objects.get().status, "RELEASED")
+        self.assertFalse(Payment.objects.exists())
+
+    @mock.patch("market.providers.paypal_access_token", return_value="token")
+    def test_capture_must_match_requested_amount(self, _token):
+        order = snapshot_cart(self.buyer, self.cart)
+        payment = Payment.objects.create(
+            user=self.buyer, cart=self.cart, order=order, paypal_order_id="PP-1", payment_method="paypal",
+            amount=order.total, currency="MAD", provider_amount="30.00", provider_currency="USD",
+        )
+        captured = {"purchase_units": [{"payments": {"captures": [
+            {"status": "COMPLETED", "amount": {"currency_code": "USD", "value": "1.00"}},
+        ]}}]}
+        reply = mock.Mock(status_code=201, json=mock.Mock(return_value=captured))
+        with mock.patch("requests.post", return_value=reply), self.assertLogs("market.views", "ERROR"):
+            response = self.post("capture-order", order_id="PP-1")
+
+        self.assertEqual(response.status_code, 409)
+        payment.refresh_from_db()
+        self.assertEqual(payment.status, "FAILED")
+        self.assertEqual(Reservation.objects.get().status, "RELEASED")
+        self.assertTrue(Item.objects.get(pk=self.item.pk).is_available)
+
+
+# ===================================
+# 💱 Conversion des prix
+# ===================================
+class CurrencyTests(TestCase):
+    def test_convert_rounds_half_up_to_the_cent(self):
+        self.assertEqual(currency.convert("10", Decimal("0.1")), Decimal("1.00"))
+        self.assertEqual(currency.convert("0.05", Decimal("0.1")), Decimal("0.01"))  # 0.005 → 0.01
+        self.assertEqual(currency.convert("123.45", Decimal("0.0923")), Decimal("11.39"))  # 11.394435
+        rows = currency.convert_rows([{"price": "99.95"}, {"price": None}], ("EUR", Decimal("0.092")))
+        self.assertEqual(rows, [
+            {"price": "99.95", "converted_price": "9.20", "converted_currency": "EUR"},  # 9.1954
+            {"price": None, "converted_price": None, "converted_currency": "EUR"},
+        ])
+
+    def test_listing_prices_use_fetched_rates(self):
+        use_rates(self, USD="0.25")
+        Item.objects.create(title="Lampe", item_type="SELL", price="19.99")
+        row = self.client.get("/api/sell-items/", {"currency": "usd"}).json()[0]
+        self.assertEqual((row["converted_price"], row["converted_currency"]), ("5.00", "USD"))  # 4.9975
+
+    def test_checkout_refuses_fallback_rates(self):
+        use_rates(self)
+        _, cart = make_buyer(1, Item.objects.create(title="Lampe", item_type="SELL", price="5.70"))
+        body = {"email": "buyer1@example.com"}
+        with mock.patch("stripe.PaymentIntent.create") as create, self.assertLogs("market.currency", "ERROR"):
+            response = self.client.post("/api/payments/create-payment-stripe/", body, content_type="application/json")
+        self.assertEqual(response.status_code, 503)
+        create.assert_not_called()
+        self.assertEqual(Reservation.objects.get().status, "RELEASED")
+
+        use_rates(self, USD="0.1")
+        intent = SimpleNamespace(id="pi_1", client_secret="secret")
+        with mock.patch("stripe.PaymentIntent.create", return_value=intent) as create:
+            response = self.client.post("/api/payments/create-payment-stripe/", body, content_type="application/json")
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(create.call_args.kwargs["amount"], 57)  # 0.57 USD, pas 56 (float)
+        self.assertEqual(Payment.objects.get().provider_amount, Decimal("0.57"))
+
+
+class PaymentSettlementTests(TestCase):
+    """Règlements tardifs ou rejoués, entrelacés avec d'autres checkouts (déterministe, SQLite compris)."""
+
+    def setUp(self):
+        self.seller = User.objects.create(username="seller", email="seller@example.com")
+        self.item = Item.objects.create(title="Bureau", item_type="SELL", price=300, owner=self.seller)
+        self.alice, alice_cart = make_buyer(1, self.item)
+        self.order = snapshot_cart(self.alice, alice_cart)
+
+    def payment(self, user, order, **ids):
+        return Payment.objects.create(
+            user=user, order=order, amount=order.total, currency="MAD",
+            provider_amount="30.00", provider_currency="USD", **ids,
+        )
+
+    def expire(self):
+        Reservation.objects.update(expires_at=timezone.now() - timedelta(seconds=1))
+
+    def test_expired_hold_is_not_completed(self):
+        self.expire()
+        with self.assertRaises(ReservationConflict):
+            complete_orders([self.order.id])
+        self.assertTrue(Item.objects.get(pk=self.item.pk).is_available)
+
+    def test_late_capture_cannot_double_sell(self):
+        late = self.payment(self.alice, self.order, payment_method="paypal", paypal_order_id="PP-1")
+        self.expire()
+        expire_holds()
+        bob, bob_cart = make_buyer(2, self.item)
+        bob_order = snapshot_cart(bob, bob_cart)
+        self.assertEqual(tasks.settle_payments(Payment.objects.filter(pk=self.payment(bob, bob_order, payment_method="paypal").pk), "COMPLETED"), "COMPLETED")
+
+        with self.assertLogs("market.tasks", "ERROR"):
+            self.assertEqual(tasks.settle_payments(Payment.objects.filter(pk=late.pk), "COMPLETED"), "FAILED")
+        self.assertEqual(Reservation.objects.get(status="CONVERTED").order, bob_order)
+        self.assertEqual(Payment.objects.filter(status="COMPLETED").get().user, bob)
+
+    @mock.patch("market.providers.paypal_access_token", return_value="token")
+    def test_capture_is_refused_once_hold_expired(self, _token):
+        payment = self.payment(self.alice, self.order, payment_method="paypal", paypal_order_id="PP-1")
+        self.expire()
+        with mock.patch("requests.post") as post:
+            response = self.client.post("/api/payments/capture-order/", {"order_id": "PP-1"}, content_type="application/json")
+
+        self.assertEqual(response.status_code, 409)
+        post.assert_not_called()
+        payment.refresh_from_db()
+        self.assertEqual(payment.status, "CANCELLED")
+
+    def test_stripe_sale_waits_for_verification(self):
+        payment = self.payment(self.alice, self.order, payment_method="stripe", stripe_payment_intent_id="pi_1")
+        response = self.client.post(
+            "/api/payments/confirm-stripe-payment/", {"payment_intent_id": "pi_1"}, content_type="application/json",
+        )
+
+        self.assertEqual(response.status_code, 202)
+        payment.refresh_from_db()
+        self.assertEqual(payment.status, "PENDING")
+        self.assertEqual(Reservation.objects.get().status, "ACTIVE")
+        self.assertTrue(Job.objects.filter(name="payments.verify_stripe_payment").exists())
+
+        intent = SimpleNamespace(status="succeeded", amount_received=3000, currency="usd")
+        with mock.patch("market.providers.stripe_retrieve_intent", return_value=intent):
+            self.assertEqual(tasks.verify_stripe_payment("pi_1"), "COMPLETED")
+            self.assertIsNone(tasks.verify_stripe_payment("pi_1"))  # job rejoué : rien à refaire
+        self.assertFalse(Item.objects.get(pk=self.item.pk).is_available)
+        self.assertEqual(Reservation.objects.get().status, "CONVERTED")
+
+
+# ===================================
+# 📏 Budgets de requêtes par endpoint
+# ===================================
+class QueryBudgetTests(TestCase):
+    """
+    Nombre de requêtes maximal par endpoint, indépendant du volume de
+    données (N+1 interdits), et aucun parcours complet de table `market_*`.
+    """
+    LISTINGS = 6
+
+    ENDPOINT_BUDGETS = {
+        "sell-items list": ("/api/sell-items/", {}, 2),
+        "rent-items list": ("/api/rent-items/", {}, 2),
+        "sell-items list in USD": ("/api/sell-items/", {"currency": "USD"}, 2),
+        "sell-item detail": ("/api/sell-items/{item}/", {}, 2),
+        "similar items": ("/api/sell-items/{item}/similar/", {}, 2),
+        "cart": ("/api/cart/", {"email": "buyer@example.com"}, 4),
+        "payment receipt": ("/api/payments/{payment}/receipt/", {}, 2),
+        "change feed": ("/api/changes/", {}, 3),
+    }
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.seller = User.objects.create(username="seller", email="seller@example.com")
+        cls.buyer = User.objects.create(username="buyer", email="buyer@example.com")
+        cart = Cart.objects.create(user=cls.buyer)
+        items = []
+        for n in range(cls.LISTINGS):
+            for item_type in ("SELL", "RENT"):
+                item = Item.objects.create(title=f"Meuble {n}", item_type=item_type, price=10 + n, owner=cls.seller)
+                for m in range(2):
+                    ItemImage.objects.create(item=item, image=f"items/{item_type}-{n}-{m}.jpg")
+                items.append(item)
+        for item in items[:4]:
+            CartItem.objects.create(cart=cart, item=item)
+        order = snapshot_cart(cls.buyer, cart)
+        cls.payment = Payment.objects.create(
+            user=cls.buyer, cart=cart, order=order, payment_method="stripe",
+            amount=order.total, currency="MAD", status="COMPLETED",
+        )
+        cls.item = items[0]
+
+    def test_endpoint_budgets(self):
+        for name, (path, params, budget) in self.ENDPOINT_BUDGETS.items():
+            url = path.format(item=self.item.id, payment=self.payment.id)
+            with self.subTest(endpoint=name):
+                with query_budget(budget):
+                    response = self.client.get(url, params)
+                self.assertEqual(response.status_code, 200, response.content[:200])
+
+
+    def test_payment_history_budget(self):
+        self.client.force_login(self.buyer)
+        # session + utilisateur, puis page et totaux
+        with query_budget(4):
+            response = self.client.get("/api/payments/history/")
+        self.assertEqual(response.status_code, 200, response.content[:200])
+
+    def test_seller_dashboard_budget(self):
+        self.client.force_login(self.seller)
+        # session + utilisateur, puis les 4 requêtes du calcul
+        with query_budget(6):
+            response = self.client.get("/api/users/dashboard/")
+        self.assertEqual(response.status_code, 200, response.content[:200])
+
+    def test_bulk_update_is_constant(self):
+        ids = list(Item.objects.filter(owner=self.seller, item_type="SELL").values_list("id", flat=True))
+        self.client.force_login(self.seller)
+        counts = []
+        for batch in (ids[:1], ids):
+            body = {"ids": batch, "patch": {"price": "12.50"}}
+            # session + utilisateur, puis contrôle de propriété et UPDATE
+            with query_budget(8) as recorder:
+                response = self.client.post("/api/sell-items/bulk-update/", body, content_type="application/json")
+            self.assertEqual(response.status_code, 200, response.content[:200])
+            counts.append(len(recorder.queries))
+        self.assertEqual(counts[0], counts[1])
+
+
+# ===================================
+# 📜 Historique des paiements
+# ===================================
+class PaymentHistoryTests(TestCase):
+    def setUp(self):
+        self.buyer, cart = make_buyer(1)
+        other, other_cart = make_buyer(2)
+        for user, user_cart, amount, currency, status in [
+            (self.buyer, cart, 100, "MAD", "COMPLETED"),
+            (self.buyer, cart, 50, "MAD", "COMPLETED"),
+            (self.buyer, cart, 20, "USD", "COMPLETED"),
+            (self.buyer, cart, 70, "MAD", "PENDING"),
+            (other, other_cart, 999, "MAD", "COMPLETED"),
+        ]:
+            Payment.objects.create(
+                user=user, cart=user_cart, payment_method="stripe", amount=amount, currency=currency, status=status,
+            )
+
+    def test_requires_login_and_ignores_email(self):
+        response = self.client.get("/api/payments/history/", {"email": "buyer1@example.com"})
+        self.assertEqual(response.status_code, 403)
+
+    def test_lists_own_payments_with_totals_per_currency(self):
+        self.client.force_login(self.buyer)
+
+        data = self.client.get("/api/payments/history/").json()
+
+        self.assertEqual(len(data["results"]), 4)
+        totals = data["totals"]
+        self.assertEqual(totals["MAD"]["by_status"]["COMPLETED"], {"count": 2, "total": "150.00"})
+        self.assertEqual(totals["MAD"]["by_method"]["stripe"], {"count": 3, "total": "220.00"})
+        self.assertEqual(totals["USD"]["by_status"], {"COMPLETED": {"count": 1, "total": "20.00"}})
+
+
+# ===================================
+# 📊 Tableau de bord vendeur
+# ===================================
+class SellerDashboardTests(TestCase):
+    def setUp(self):
+        self.seller = User.objects.create(username="seller", email="seller@example.com")
+        app_cache.invalidate(dashboard.namespace(self.seller.pk))  # cache de test persistant entre deux lancements
+        self.desk = Item.objects.create(title="Bureau", item_type="SELL", price=300, owner=self.seller)
+        Item.objects.create(title="Vélo", item_type="RENT", price=50, owner=self.seller, is_available=False)
+        self.buyer, self.cart = make_buyer(1, self.desk)
+
+    def get(self):
+        return self.client.get("/api/users/dashboard/").json()
+
+    def test_requires_login_and_ignores_email(self):
+        response = self.client.get("/api/users/dashboard/", {"email": "seller@example.com"})
+        self.assertEqual(response.status_code, 403)
+
+    def test_figures_follow_sales(self):
+        self.client.force_login(self.seller)
+        data = self.get()
+        self.assertEqual(data["counts"]["SELL"], {"available": 1, "unavailable": 0})
+        self.assertEqual(data["counts"]["RENT"], {"available": 0, "unavailable": 1})
+        desk = next(row for row in data["listings"] if row["id"] == self.desk.pk)
+        self.assertEqual((desk["price"], desk["in_carts"], desk["quantity_in_carts"]), ("300.00", 1, 1))
+        self.assertEqual(data["revenue"], {"total": "0.00", "units": 0, "orders": 0})
+
+        order = snapshot_cart(self.buyer, self.cart)
+        payment = Payment.objects.create(user=self.buyer, order=order, payment_method="stripe", amount=order.total)
+        with self.captureOnCommitCallbacks(execute=True):
+            tasks.settle_payments(Payment.objects.filter(pk=payment.pk), "COMPLETED")
+
+        data = self.get()
+        self.assertEqual(data["revenue"], {"total": "300.00", "units": 1, "orders": 1})
+        self.assertEqual(data["counts"]["SELL"], {"available": 0, "unavailable": 1})
+
+
+# ===================================
+# ✏️ Modification groupée des annonces
+# ===================================
+class BulkUpdateTests(TestCase):
+    def setUp(self):
+        self.seller = User.objects.create(username="seller", email="seller@example.com")
+        self.rival = User.objects.create(username="rival", email="rival@example.com")
+        self.lamp = Item.objects.create(title="Lampe", item_type="SELL", price=20, owner=self.seller)
+        self.desk = Item.objects.create(title="Bureau", item_type="SELL", price=300, owner=self.seller)
+        self.other = Item.objects.create(title="Chaise", item_type="SELL", price=40, owner=self.rival)
+
+    def post(self, body):
+        return self.client.post("/api/sell-items/bulk-update/", body, content_type="application/json")
+
+    def test_per_item_values_are_applied(self):
+        self.client.force_login(self.seller)
+        response = self.post({"items": [
+            {"id": self.lamp.pk, "price": "25.00"},
+            {"id": self.desk.pk, "price": "280.00", "is_available": False},
+        ]})
+
+        self.assertEqual(response.json(), {"updated": 2, "ids": [self.lamp.pk, self.desk.pk]})
+        rows = dict(Item.objects.values_list("id", "price"))
+        self.assertEqual((rows[self.lamp.pk], rows[self.desk.pk]), (Decimal("25.00"), Decimal("280.00")))
+        self.assertEqual(list(Item.objects.filter(is_available=False)), [self.desk])
+
+    def test_other_sellers_items_are_rejected(self):
+        body = {"ids": [self.lamp.pk, self.other.pk], "patch": {"price": "1.00"}, "owner_email": "rival@example.com"}
+        self.assertEqual(self.post(body).status_code, 403)  # anonyme : owner_email n'authentifie rien
+
+        self.client.force_login(self.seller)
+        response = self.post(body)
+
+        self.assertEqual(response.status_code, 403)
+        self.assertEqual(response.json()["item_ids"], [self.other.pk])
+        self.assertFalse(Item.objects.filter(price=Decimal("1.00")).exists())
+
+
+# ===================================
+# 🛠️ Administration
+# ===================================
+class PaymentAdminTests(TestCase):
+    def test_cancel_pending_asks_the_provider(self):
+        admin_user = User.objects.create_superuser(username="admin", email="admin@example.com", password="x")
+        buyer, cart = make_buyer(1, Item.objects.create(title="Lit", item_type="SELL", price=90))
+        order = snapshot_cart(buyer, cart)
+        stripe_payment = Payment.objects.create(
+            user=buyer, order=order, payment_method="stripe", amount=90, stripe_payment_intent_id="pi_1",
+        )
+        orphan = Payment.objects.create(user=buyer, payment_method="paypal", amount=90)
+        self.client.force_login(admin_user)
+
+        response = self.client.post("/admin/market/payment/", {
+            "action": "cancel_pending", "_selected_action": [stripe_payment.pk, orphan.pk],
+        })
+
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(Payment.objects.get(pk=stripe_payment.pk).status, "PENDING")  # Stripe tranchera
+        self.assertEqual(
+            Job.objects.get(name="payments.verify_stripe_payment").payload, {"payment_intent_id": "pi_1", "stale": True},
+        )
+        self.assertEqual(Payment.objects.get(pk=orphan.pk).status, "CANCELLED")
+
+
+# ===================================
+# 🚦 Throttling
+# ===================================
+@override_settings(TOKEN_BUCKETS={"login": {"ip": {"capacity": 3, "rate": "3/min"}}})
+class ThrottleTests(TestCase):
+    view = SimpleNamespace(action="login", throttle_scopes={"login": "login"})
+
+    def allowed(self, at):
+        throttle = IPTokenBucketThrottle()
+        with mock.patch.object(throttling.time, "time", return_value=at):
+            return throttle.allow_request(APIRequestFactory().post("/login/"), self.view), throttle.wait()
+
+    def test_burst_is_capped_at_capacity(self):
+        start = 6000.0  # début d'une fenêtre de 60 s
+        results = [self.allowed(start + n)[0] for n in range(5)]
+
+        self.assertEqual(results, [True, True, True, False, False])
+        self.assertEqual(self.allowed(start + 10)[1], 50)
+
+    def test_tokens_refill_at_rate(self):
+        start = 6000.0
+        for n in range(3):
+            self.allowed(start + n)
+
+        self.assertFalse(self.allowed(start + 61)[0])  # fenêtre précédente encore pleine
+        self.assertTrue(self.allowed(start + 81)[0])  # un tiers écoulé : une place
+        self.assertFalse(self.allowed(start + 82)[0])
+        self.assertEqual([self.allowed(start + 121)[0] for _ in range(3)], [True, True, False])
+
+
+# ===================================
+# 🔁 Clés d'idempotence
+# ===================================
+class EchoViewSet(viewsets.ViewSet):
+    calls = 0
+
+    @idempotent
+    def create(self, request):
+        EchoViewSet.calls += 1
+        return Response({"call": EchoViewSet.calls}, status=201)
+
+
+class IdempotencyTests(TestCase):
+    def setUp(self):
+        EchoViewSet.calls = 0
+        self.view = EchoViewSet.as_view({"post": "create"}, basename="echo")
+        self.factory = APIRequestFactory()
+
+    def post(self, key="k1", **body):
+        request = self.factory.post("/echo/", body or {"email": "a@example.com"}, format="json", HTTP_IDEMPOTENCY_KEY=key)
+        return self.view(request)
+
+    def test_same_key_replays_response(self):
+        first, second = self.post(), self.post()
+
+        self.assertEqual(second.data, first.data)
+        self.assertEqual(second["Idempotent-Replayed"], "true")
+        self.assertEqual(EchoViewSet.calls, 1)
+
+    def test_in_progress_key_conflicts_then_is_taken_over_when_stale(self):
+        self.post()
+        IdempotencyKey.objects.update(status="IN_PROGRESS")
+
+        self.assertEqual(self.post().status_code, 409)
+
+        IdempotencyKey.objects.update(updated_at=timezone.now() - timedelta(hours=1))
+        self.assertEqual(self.post().data, {"call": 2})
+
+    def test_keys_are_scoped_to_the_caller(self):
+        self.post(email="a@example.com")
+        response = self.post(email="b@example.com")
+
+        self.assertEqual(response.data, {"call": 2})
+        self.assertEqual(self.post(email="a@example.com", other=1).status_code, 422)
+
+
+# ===================================
+# ⚡ Cache à deux niveaux
+# ===================================
+LOCMEM = {"app-tests": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache", "LOCATION": "app-tests"}}
+
+
+@override_settings(CACHES={**settings.CACHES, **LOCMEM})
+class TwoLevelCacheTests(SimpleTestCase):
+    def setUp(self):
+        self.cache = TwoLevelCache(alias="app-tests", max_entries=2)
+        self.addCleanup(self.cache.shared.clear)
+
+    def test_local_lru_evicts_and_expires(self):
+        lru = LocalLRU(2)
+        lru.set("a", 1, 60)
+        lru.set("b", 2, 60)
+        lru.get("a")
+        lru.set("c", 3, 60)
+        self.assertEqual((lru.get("a"), lru.get("b")), ((True, 1), (False, None)))
+
+        lru.set("d", 4, -1)
+        self.assertEqual(lru.get("d"), (False, None))
+
+    def test_invalidate_bumps_version(self):
+        self.cache.set("items", "list", [1])
+        old_key = self.cache.make_key("items", "list")
+        self.cache.invalidate("items")
+
+        self.assertNotEqual(self.cache.make_key("items", "list"), old_key)
+        self.assertIsNone(self.cache.get("items", "list"))
+        self.assertEqual(self.cache.shared.get(old_key), [1])  # orpheline, expirera seule
+
+    def test_namespace_versions_are_bounded(self):
+        self.cache._versions = LocalLRU(3)
+        for n in range(10):
+            self.cache.invalidate(f"dashboard:{n}")
+        self.assertEqual(len(self.cache._versions), 3)
+        self.assertEqual(self.cache._version("dashboard:0"), 2)  # relue dans le cache partagé
+
+    def test_get_or_set_computes_once(self):
+        calls = []
+
+        def producer():
+            calls.append(1)
+            time.sleep(0.1)
+            return "value"
+
+        results = []
+        threads = [
+            threading.Thread(target=lambda: results.append(self.cache.get_or_set("items", "slow", producer)))
+            for _ in range(8)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(results, ["value"] * 8)
+
+
+class CacheInvalidationSignalTests(TestCase):
+    def test_invalidates_after_commit(self):
+        owner = User.objects.create(username="seller", email="seller@example.com")
+        with mock.patch.object(app_cache, "invalidate") as invalidate:
+            with self.captureOnCommitCallbacks(execute=True):
+                Item.objects.create(title="Vélo", price=100, owner=owner, item_type="SELL")
+                invalidate.assert_not_called()
+        self.assertIn(mock.call("items"), invalidate.call_args_list)
+
+    def test_unrelated_models_keep_fast_delete(self):
+        self.assertFalse(post_delete.has_listeners(Session))
+        self.assertFalse(post_save.has_listeners(Session))
+
+
+# ===================================
+# 📜 Schéma OpenAPI pré-généré
+# ===================================
+class PrebuiltSchemaTests(TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.root, ignore_errors=True)
+        patcher = mock.patch.object(openapi, "_prebuilt", None)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_serves_built_file(self):
+        path = f"{self.root}/openapi.json"
+        with override_settings(OPENAPI_SCHEMA_PATH=path):
+            call_command("build_openapi_schema", stdout=StringIO())
+            response = self.client.get("/swagger/?format=openapi")
+        self.assertEqual(response.status_code, 200)
+        with open(path, "rb") as fh:
+            self.assertEqual(response.content, fh.read())
+
+    def test_missing_file_is_an_error_in_production(self):
+        with override_settings(OPENAPI_SCHEMA_PATH=f"{self.root}/missing.json", DEBUG=False, OPENAPI_LIVE_FALLBACK=False):
+            with self.assertRaises(ImproperlyConfigured):
+                self.client.get("/swagger/?format=openapi")
+
+
+# ===================================
+# 🔎 Annonces similaires
+# ===================================
+class SimilarItemsTests(TestCase):
+    def setUp(self):
+        self.seller = User.objects.create(username="seller", email="seller@example.com")
+
+    def listing(self, title, **fields):
+        return Item.objects.create(title=title, item_type="SELL", price=100, owner=self.seller, city="Rabat", **fields)
+
+    def neighbours(self, item):
+        return similar.similar_ids(item.pk, 10)
+
+    def test_refresh_places_item_in_neighbour_lists(self):
+        sofa, table = self.listing("Canapé cuir"), self.listing("Table basse")
+        similar.build_all()
+        other_sofa = self.listing("Canapé d'angle cuir")
+        similar.refresh_item(other_sofa.pk)
+
+        self.assertEqual(self.neighbours(other_sofa)[0], sofa.pk)
+        self.assertEqual(self.neighbours(sofa)[0], other_sofa.pk)
+
+        Item.objects.filter(pk=other_sofa.pk).update(is_available=False)
+        similar.refresh_item(other_sofa.pk)
+        self.assertIsNone(self.neighbours(other_sofa))
+        self.assertNotIn(other_sofa.pk, self.neighbours(sofa) + self.neighbours(table))
+
+    def test_refresh_compares_a_bounded_candidate_set(self):
+        old = self.listing("Canapé cuir")
+        for n in range(3):
+            self.listing(f"Lampe {n}")
+        similar.build_all()
+        new = self.listing("Canapé cuir noir")
+        similar.refresh_item(new.pk, candidates=2)
+
+        self.assertNotIn(old.pk, self.neighbours(new))  # rattrapée au prochain build_all
+        similar.build_all()
+        self.assertIn(old.pk, self.neighbours(new))
+
+    def test_concurrent_refresh_of_same_item_is_retried(self):
+        item = self.listing("Canapé cuir")
+        app_cache.shared.add(similar._lock_key(item.pk), 1, 60)
+        self.addCleanup(app_cache.shared.delete, similar._lock_key(item.pk))
+
+        with self.assertRaises(similar.RefreshBusy):
+            similar.refresh_item(item.pk)
+        app_cache.shared.delete(similar._lock_key(item.pk))
+        similar.refresh_item(item.pk)
+        self.assertEqual(self.neighbours(item), [])
+
+    def test_unknown_item_is_404(self):
+        item = self.listing("Canapé cuir")
+        self.assertEqual(self.client.get(f"/api/sell-items/{item.pk}/similar/").json(), [])
+        self.assertEqual(self.client.get(f"/api/sell-items/{item.pk + 1}/similar/").status_code, 404)
+        self.assertEqual(self.client.get(f"/api/rent-items/{item.pk}/similar/").status_code, 404)
+
+
+# ===================================
+# 📊 Statistiques de prix
+# ===================================
+class PriceStatsTests(TestCase):
+    def setUp(self):
+        self.seller = User.objects.create(username="seller", email="seller@example.com")
+        for period in (price_stats.ALL_TIME, price_stats.period_of(timezone.now())):
+            app_cache.shared.delete(price_stats._global_flag((price_stats.ALL_CITIES, "SELL", period)))
+
+    def listing(self, city, price):
+        return Item.objects.create(title="Chaise", item_type="SELL", price=price, owner=self.seller, city=city)
+
+    def test_city_groups_are_normalised(self):
+        items = [self.listing("Rabat", 100), self.listing("rabat", 300)]
+        groups = set().union(*(price_stats.groups_for(i.city, i.item_type, i.created_at) for i in items))
+        price_stats.refresh_groups(groups)
+
+        stats = price_stats.read_stats("SELL", "RABAT")
+        self.assertEqual((stats["overall"]["count"], stats["overall"]["median"]), (2, "200.00"))
+        self.assertEqual(PriceStat.objects.filter(city="rabat").count(), 2)  # tous temps + mois
+
+    def test_global_groups_are_recomputed_once_per_interval(self):
+        item = self.listing("Rabat", 100)
+        groups = price_stats.groups_for(item.city, item.item_type, item.created_at)
+        price_stats.refresh_groups(groups)
+        price_stats.refresh_groups(groups)
+
+        self.assertFalse(PriceStat.objects.filter(city=price_stats.ALL_CITIES).exists())
+        jobs_queued = Job.objects.filter(name="price_stats.refresh_global")
+        self.assertEqual(jobs_queued.count(), 2)  # un par groupe toutes villes, pas par écriture
+        self.assertTrue(all(job.run_at > timezone.now() for job in jobs_queued))
+
+        for job in jobs_queued:
+            tasks.refresh_global_price_groups(**job.payload)
+        jobs_queued.delete()
+        self.assertEqual(price_stats.read_stats("SELL")["overall"]["count"], 1)
+        price_stats.refresh_groups(groups)  # drapeaux levés : la fenêtre suivante est planifiée
+        self.assertEqual(jobs_queued.count(), 2)
+
+    def test_deferred_fields_are_not_loaded(self):
+        for n in range(3):
+            self.listing("Rabat", 100 + n)
+        with self.assertNumQueries(1):
+            items = list(Item.objects.only("id", "title"))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            items[0].title = "Tabouret"
+            items[0].save()
+        self.assertTrue(Job.objects.filter(name="price_stats.refresh_items", payload={"ids": [items[0].pk]}).exists())
+
+
+# ===================================
+# 🔁 Flux de changements
+# ===================================
+@override_settings(CHANGE_FEED_LAG=0)
+class ChangeFeedTests(TestCase):
+    def setUp(self):
+        self.seller = User.objects.create(username="seller", email="seller@example.com")
+
+    def test_pages_follow_timestamp_then_id(self):
+        same = timezone.now() - timedelta(minutes=5)
+        items = [Item.objects.create(title=f"Chaise {n}", item_type="SELL", price=10, owner=self.seller) for n in range(5)]
+        Item.objects.filter(pk__in=[i.pk for i in items[:3]]).update(updated_at=same)
+        Item.objects.filter(pk__in=[i.pk for i in items[3:]]).update(updated_at=same - timedelta(minutes=1))
+
+        seen, cursor = [], None
+        while True:
+            page = read_changes(cursor, limit=2)
+            seen += [row["id"] for row in page["items"]]
+            cursor = page["cursor"]
+            if not page["has_more"]:
+                break
+
+        expected = [i.pk for i in items[3:]] + [i.pk for i in items[:3]]
+        self.assertEqual(seen, expected)
+        self.assertEqual(read_changes(cursor)["items"], [])
+
+    def test_deletions_are_published_as_tombstones(self):
+        item = Item.objects.create(title="Chaise", item_type="SELL", price=10, owner=self.seller)
+        cursor = read_changes()["cursor"]
+        item_id = item.pk
+        item.delete()
+
+        page = read_changes(cursor)
+        self.assertEqual([(row["kind"], row["object_id"]) for row in page["deleted"]], [("item", item_id)])
+
+    @override_settings(CHANGE_FEED_LAG=60)
+    def test_recent_rows_wait_for_next_call(self):
+        Item.objects.create(title="Chaise", item_type="SELL", price=10, owner=self.seller)
+        self.assertEqual(read_changes()["items"], [])
+
+    def test_old_or_garbled_cursors_are_rejected(self):
+        old = timezone.now() - timedelta(days=settings.CHANGE_FEED_RETENTION_DAYS + 1)
+        with self.assertRaises(CursorExpired):
+            read_changes(encode_cursor({"items": (old, 0), "images": (old, 0), "deleted": (old, 0)}))
+        with self.assertRaises(CursorError):
+            read_changes("pas-un-curseur")
+        self.assertEqual(self.client.get("/api/changes/", {"cursor": "pas-un-curseur"}).status_code, 400)
+
+
+# ===================================
+# 📡 Événements d'annonces (SSE)
+# ===================================
+def listing_event(item_id, city, item_type, updated_at=None):
+    now = timezone.now()
+    row = {
+        "id": item_id, "title": "Lampe", "price": Decimal("20.00"), "item_type": item_type, "city": city,
+        "is_available": True, "owner_id": None, "created_at": now, "updated_at": updated_at or now,
+    }
+    return event_for(row, created=True)
+
+
+def drain(subscriber):
+    ids = []
+    while not subscriber.queue.empty():
+        ids.append(subscriber.queue.get_nowait()["item"]["id"])
+    return ids
+
+
+@override_settings(SSE_POLL_INTERVAL=3600)  # pas de relecture en base pendant le test
+class ItemEventsTests(TestCase):
+    def test_publish_filters_and_dedups(self):
+        seen_at = timezone.now()
+
+        async def scenario():
+            hub = Broadcaster()
+            rabat_sales = hub.subscribe(city="Rabat", item_type="SELL")
+            everything = hub.subscribe()
+            hub.publish(listing_event(1, "rabat", "SELL", seen_at))
+            hub.publish(listing_event(1, "rabat", "SELL", seen_at))  # signal puis relecture : un seul envoi
+            hub.publish(listing_event(2, "Casablanca", "SELL"))
+            hub.publish(listing_event(3, "Rabat", "RENT"))
+            await asyncio.sleep(0)  # remises faites via call_soon_threadsafe
+            return drain(rabat_sales), drain(everything)
+
+        self.assertEqual(asyncio.run(scenario()), ([1], [1, 2, 3]))
+
+    @override_settings(SSE_QUEUE_SIZE=1)
+    def test_slow_subscriber_is_disconnected(self):
+        async def scenario():
+            subscriber = broadcaster.subscribe()
+            broadcaster.publish(listing_event(10, "Rabat", "SELL"))
+            broadcaster.publish(listing_event(11, "Rabat", "SELL"))
+            await asyncio.sleep(0)
+            chunks = [chunk async for chunk in events_stream(subscriber)]
+            return subscriber.overflowed, chunks, subscriber in broadcaster._subscribers
+
+        overflowed, chunks, still_subscribed = asyncio.run(scenario())
+        self.assertTrue(overflowed)
+        self.assertEqual(chunks, [f"retry: {settings.SSE_HEARTBEAT * 1000}\n\n"])  # flux fermé
+        self.assertFalse(still_subscribed)
+
+    def test_wsgi_request_gets_501(self):
+        response = self.client.get("/api/events/items/")
+        self.assertEqual(response.status_code, 501)
+
+
+# ===================================
+# 🗄️ Archivage des annonces
+# ===================================
+class ArchiveTests(TestCase):
+    def setUp(self):
+        self.seller = User.objects.create(username="seller", email="seller@example.com")
+        self.items = []
+        for n in range(3):
+            item = Item.objects.create(title=f"Armoire {n}", item_type="SELL", price=100, owner=self.seller, city="Fès")
+            ItemImage.objects.create(item=item, image=f"items/{n}.jpg")
+            MediaBlob.objects.create(name=f"items/{n}.jpg", sha256=f"{n}" * 64, size=1, ref_count=1)
+            self.items.append(item)
+        make_buyer(1, self.items[0])
+        Item.objects.update(is_available=False, updated_at=timezone.now() - timedelta(days=settings.ARCHIVE_UNAVAILABLE_AFTER_DAYS + 1))
+
+    def test_batch_is_moved_with_one_signal(self):
+        per_row = mock.Mock()
+        post_delete.connect(per_row, sender=Item, dispatch_uid="archive-test")
+        self.addCleanup(post_delete.disconnect, sender=Item, dispatch_uid="archive-test")
+
+        with self.captureOnCommitCallbacks(execute=True):
+            ids = archive.archive_batch()
+
+        per_row.assert_not_called()
+        self.assertEqual(sorted(ids), sorted(i.pk for i in self.items))
+        self.assertFalse(Item.objects.exists())
+        self.assertFalse(CartItem.objects.exists())
+        self.assertEqual(ArchivedItem.objects.count(), 3)
+        self.assertEqual(DeletionLog.objects.filter(kind="item").count(), 3)
+        self.assertEqual(DeletionLog.objects.filter(kind="image").count(), 3)
+        self.assertEqual(set(MediaBlob.objects.values_list("ref_count", flat=True)), {1})  # l'archive a pris le relais
+        self.assertEqual(Job.objects.filter(name="similar.refresh_items").count(), 1)
+
+    def test_archived_listing_keeps_currency(self):
+        item_id = self.items[0].pk
+        archive.archive_batch()
+        response = self.client.get(f"/api/sell-items/{item_id}/", {"currency": "USD"})
+
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.data["archived"])
+        self.assertEqual(response.data["converted_currency"], "USD")
+
+
+# ===================================
+# 💾 Stockage des médias : cache de lecture
+# ===================================
+class MediaStorageTests(SimpleTestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.root, ignore_errors=True)
+        conf = {
+            "READ_CACHE_DIR": f"{self.root}/cache",
+            "READ_CACHE_MAX_BYTES": 2500,
+            "READ_CACHE_MAX_ENTRY_BYTES": 1500,
+            "READ_CACHE_PREFIXES": ("items/",),
+        }
+        with override_settings(MEDIA_STORAGE=conf):
+            self.storage = LocalMediaStorage(location=f"{self.root}/bucket")
+
+    def read(self, name):
+        with self.storage.open(name) as f:
+            return f.read()
+
+    def test_rereads_hit_cache(self):
+        name = self.storage.save("items/a.jpg", ContentFile(b"a" * 1000))
+        self.read(name)
+        self.assertEqual(self.read(name), b"a" * 1000)
+
+        stats = self.storage.stats()
+        self.assertEqual((stats["hits"], stats["misses"]), (1, 1))
+        self.assertEqual(stats["bytes_uploaded"], 1000)
+        self.assertEqual(stats["bytes_downloaded"], 1000)
+
+    def test_cache_is_bounded(self):
+        names = [self.storage.save(f"items/{n}.jpg", ContentFile(b"x" * 1000)) for n in range(3)]
+        big = self.storage.save("items/big.jpg", ContentFile(b"y" * 2000))
+        for name in names + [big]:
+            self.read(name)
+
+        self.assertLessEqual(self.storage.stats()["cache_bytes"], 2500)
+        self.read(names[0])  # évincé (LRU)
+        self.assertEqual(self.storage.stats()["hits"], 0)
+
+    def test_other_prefixes_bypass_cache(self):
+        name = self.storage.save("documents/cv.pdf", ContentFile(b"%PDF"))
+        self.assertEqual(self.read(name), b"%PDF")
+        self.assertEqual(self.storage.stats()["passthrough_reads"], 1)
+
+
+# ===================================
+# 💾 Médias dédupliqués : références et ramasse-miettes
+# ===================================
+def use_temp_media(test):
+    root = tempfile.mkdtemp()
+    test.addCleanup(shutil.rmtree, root, ignore_errors=True)
+    # Pas d'override de STORAGES : sous Django 4.2, DEFAULT_FILE_STORAGE compte
+    # alors comme modifié et les OPTIONS (location) sont perdues
+    patcher = mock.patch.object(default_storage, "_wrapped", LocalMediaStorage(location=root))
+    patcher.start()
+    test.addCleanup(patcher.stop)
+    override = override_settings(CHUNKED_UPLOAD_DIR=f"{root}/parts")
+    override.enable()
+    test.addCleanup(override.disable)
+    return root
+
+
+class MediaReferenceTests(TestCase):
+    def setUp(self):
+        self.root = use_temp_media(self)
+
+    def test_same_content_is_stored_once(self):
+        first = store_file(ContentFile(b"photo", name="a.jpg"), "items/")
+        second = store_file(ContentFile(b"photo", name="b.jpg"), "items/")
+
+        self.assertEqual(first, second)
+        self.assertTrue(os.path.exists(os.path.join(self.root, first)))  # jamais dans le dépôt
+        self.assertEqual(MediaBlob.objects.get(name=first).ref_count, 2)
+
+    def test_replaced_profile_picture_is_released(self):
+        old = store_file(ContentFile(b"old", name="old.jpg"), "profiles/")
+        user = User.objects.create(username="u", email="u@example.com", profile_picture=old)
+        user = User.objects.get(pk=user.pk)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            user.profile_picture = store_file(ContentFile(b"new", name="new.jpg"), "profiles/")
+            user.save()
+
+        self.assertEqual(MediaBlob.objects.get(name=old).ref_count, 0)
+
+    def test_gc_spares_rereferenced_blobs(self):
+        name = store_file(ContentFile(b"gone", name="g.jpg"), "items/")
+        kept = store_file(ContentFile(b"kept", name="k.jpg"), "items/")
+        release_name(name)
+        release_name(kept)
+        MediaBlob.objects.update(updated_at=timezone.now() - timedelta(days=2))
+        store_file(ContentFile(b"kept", name="k.jpg"), "items/")
+
+        removed = collect_garbage(timedelta(days=1))
+
+        self.assertEqual([n for n, _ in removed], [name])
+        self.assertFalse(default_storage.exists(name))
+        self.assertTrue(default_storage.exists(kept))
+        self.assertEqual(list(MediaBlob.objects.values_list("name", flat=True)), [kept])
+
+
+# ===================================
+# 👤 Modification des comptes
+# ===================================
+class AccountUpdateTests(TestCase):
+    def setUp(self):
+        self.owner = User.objects.create_user(username="owner", email="owner@example.com", password="old-pass")
+        self.other = User.objects.create_user(username="other", email="other@example.com", password="other-pass")
+
+    def patch(self, user, body):
+        return self.client.patch(f"/api/users/{user.pk}/", body, content_type="application/json")
+
+    def test_only_owner_changes_password(self):
+        self.assertEqual(self.patch(self.owner, {"password": "hijack"}).status_code, 403)
+        self.client.force_login(self.other)
+        self.assertEqual(self.patch(self.owner, {"password": "hijack"}).status_code, 404)
+        self.assertEqual(self.client.delete(f"/api/users/{self.owner.pk}/").status_code, 404)
+        self.owner.refresh_from_db()
+        self.assertTrue(self.owner.check_password("old-pass"))
+
+        self.client.force_login(self.owner)
+        self.assertEqual(self.patch(self.owner, {"password": "new-pass"}).status_code, 200)
+        self.owner.refresh_from_db()
+        self.assertTrue(self.owner.check_password("new-pass"))
+
+
+# ===================================
+# 📤 Upload fractionné
+# ===================================
+class UploadTests(TestCase):
+    def setUp(self):
+        use_temp_media(self)
+
+    def completed_upload(self, content=b"photo"):
+        session = uploads.initiate("ITEM", "p.jpg", len(content))
+        uploads.write_part(session, 0, SimpleUploadedFile("chunk", content))
+        return uploads.complete(session)
+
+    def test_listing_with_unusable_upload_is_rejected(self):
+        used = self.completed_upload()
+        uploads.consume(used.id, "ITEM")
+        body = {"title": "Lampe", "price": "20", "item_type": "SELL", "image_upload_ids": [str(used.id)]}
+
+        response = self.client.post("/api/sell-items/", body, content_type="application/json")
+
+        self.assertEqual(response.status_code, 400)
+        self.assertIn("image_upload_ids", response.json())
+        self.assertFalse(Item.objects.exists())
+
+    def test_listing_consumes_uploads(self):
+        upload = self.completed_upload()
+        body = {"title": "Lampe", "price": "20", "item_type": "SELL", "image_upload_ids": [str(upload.id)]}
+
+        response = self.client.post("/api/sell-items/", body, content_type="application/json")
+
+        self.assertEqual(response.status_code, 201, response.content[:200])
+        self.assertEqual(Item.objects.get().images.get().image.name, upload.stored_name)
+
+    def test_repeated_completion_keeps_one_reference(self):
+        session = self.completed_upload()
+        uploads.complete(session)
+
+        self.assertEqual(MediaBlob.objects.get(name=session.stored_name).ref_count, 1)
+
+    def test_unused_completed_upload_expires(self):
+        session = self.completed_upload()
+        UploadSession.objects.update(updated_at=timezone.now() - timedelta(days=3))
+
+        run_cleanup(targets=["uploads"], pause=0)
+
+        self.assertFalse(UploadSession.objects.exists())
+        self.assertEqual(MediaBlob.objects.get(name=session.stored_name).ref_count, 0)
+
+
+# ===================================
+# ⚙️ File de tâches en base
+# ===================================
+@jobs.task('tests.flaky', queue='tests', max_attempts=2)
+def flaky_task(fail=True):
+    if fail:
+        raise RuntimeError("échec volontaire")
+
+
+@override_settings(JOB_QUEUES={"tests": {"concurrency": 2}}, JOB_RETRY_BACKOFF=10, JOB_RETRY_BACKOFF_MAX=60)
+class JobQueueTests(TestCase):
+    def test_claim_respects_queue_concurrency(self):
+        for _ in range(3):
+            flaky_task.enqueue(fail=False)
+
+        first = jobs.claim("tests", "w1", 5)
+        self.assertEqual(len(first), 2)
+        self.assertEqual(jobs.claim("tests", "w2", 5), [])
+
+        self.assertTrue(jobs.run(first[0], "w1"))
+        self.assertEqual([job.locked_by for job in jobs.claim("tests", "w2", 5)], ["w2"])
+
+    def test_failure_is_retried_with_backoff_then_failed(self):
+        job = flaky_task.enqueue()
+
+        with self.assertLogs("market.jobs", "WARNING"):
+            self.assertFalse(jobs.run(jobs.claim("tests", "w1", 1)[0], "w1"))
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), ("PENDING", 1))
+        self.assertGreater(job.run_at, timezone.now() + timedelta(seconds=7))
+        self.assertEqual(jobs.claim("tests", "w1", 1), [])  # pas avant run_at
+
+        Job.objects.update(run_at=timezone.now())
+        with self.assertLogs("market.jobs", "WARNING"):
+            self.assertFalse(jobs.run(jobs.claim("tests", "w1", 1)[0], "w1"))
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), ("FAILED", 2))
+        self.assertIn("échec volontaire", job.last_error)
+
+    def test_abandoned_job_is_reclaimed(self):
+        flaky_task.enqueue(fail=False)
+        jobs.claim("tests", "dead", 1)
+        Job.objects.update(locked_at=timezone.now() - timedelta(hours=1))
+
+        job = jobs.claim("tests", "w1", 1)[0]
+
+        self.assertEqual((job.locked_by, job.attempts), ("w1", 2))
+        self.assertTrue(jobs.run(job, "w1"))
+
+
+# ===================================
+# 🔬 Profilage à la demande
+# ===================================
+class ProfilingTests(TestCase):
+    def setUp(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory, ignore_errors=True)
+        override = override_settings(PROFILING_DIR=directory, PROFILING_ENABLED=True)
+        override.enable()
+        self.addCleanup(override.disable)
+        self.staff = User.objects.create(username="staff", email="staff@example.com", is_staff=True)
+
+    def test_staff_request_is_profiled(self):
+        self.client.force_login(self.staff)
+        for mode in ("cprofile", "sample"):
+            response = self.client.get("/api/sell-items/", HTTP_X_PROFILE=mode)
+            report = self.client.get(f"/api/profiles/{response['X-Profile-Id']}/").json()
+            self.assertEqual(report["mode"], mode)
+            self.assertEqual(report["sql_count"], len(report["sql"]))
+            self.assertTrue(report["sql"])
+        self.assertEqual(len(self.client.get("/api/profiles/").json()), 2)
+
+    def test_flag_ignored_for_other_users(self):
+        response = self.client.get("/api/sell-items/?_profile=1")
+        self.assertNotIn("X-Profile-Id", response)
+        self.assertEqual(self.client.get("/api/profiles/").status_code, 403)
+
+    def test_asgi_request_is_profiled(self):
+        self.client.force_login(self.staff)
+        session = self.client.cookies[settings.SESSION_COOKIE_NAME].value
+        self.async_client.cookies[settings.SESSION_COOKIE_NAME] = session
+
+        async def scenario():
+            plain = await self.async_client.get("/api/sell-items/")
+            profiled = await self.async_client.get("/api/sell-items/", headers={"X-Profile": "cprofile"})
+            return plain, profiled
+
+        plain, profiled = async_to_sync(scenario)()
+        self.assertNotIn("X-Profile-Id", plain)
+        report = self.client.get(f"/api/profiles/{profiled['X-Profile-Id']}/").json()
+        self.assertTrue(report["sql"])  # la vue a tourné dans le thread profilé
+
+    def test_http_wrapper_stays_installed(self):
+        from urllib3.connectionpool import HTTPConnectionPool
+
+        with HTTPTimeline(time.perf_counter()):
+            wrapper = HTTPConnectionPool.urlopen
+        with HTTPTimeline(time.perf_counter()):
+            pass
+        self.assertIs(HTTPConnectionPool.urlopen, wrapper)
+        self.assertEqual(HTTPTimeline._timelines, {})
+
+    @override_settings(PROFILING_ENABLED=False)
+    def test_disabled_middleware_leaves_chain(self):
+        with self.assertRaises(MiddlewareNotUsed):
+            ProfilingMiddleware(lambda request: None)
+
+
+# ===================================
+# 🧹 Nettoyage par lots
+# ===================================
+class CleanupTests(TestCase):
+    def test_purges_in_batches_and_spares_live_rows(self):
+        now = timezone.now()
+        for n in range(5):
+            Session.objects.create(session_key=f"old{n}", session_data="", expire_date=now - timedelta(days=1))
+        Session.objects.create(session_key="live", session_data="", expire_date=now + timedelta(days=1))
+        buyer, cart = make_buyer(1, Item.objects.create(title="Lit", item_type="SELL", price=90))
+        empty = Cart.objects.create(user=User.objects.create(username="empty", email="empty@example.com"))
+        Cart.objects.filter(pk__in=[cart.pk, empty.pk]).update(created_at=now - timedelta(days=30))
+        stale = Payment.objects.create(user=buyer, cart=cart, payment_method="stripe", amount=90)
+        Payment.objects.filter(pk=stale.pk).update(created_at=now - timedelta(days=3))
+
+        report = run_cleanup(batch_size=2, pause=0)
+
+        self.assertEqual(report["sessions"]["rows"], {"sessions.Session": 5})
+        self.assertEqual(list(Session.objects.values_list("session_key", flat=True)), ["live"])
+        self.assertEqual(list(Cart.objects.all()), [cart])
+        self.assertEqual(Payment.objects.get(pk=stale.pk).status, "CANCELLED")  # aucune référence fournisseur
+
+    def test_abandoned_carts_follow_cart_activity(self):
+        old = timezone.now() - timedelta(days=settings.CLEANUP["ABANDONED_CART_DAYS"] + 1)
+        item = Item.objects.create(title="Lampe", item_type="SELL", price=20)
+        active, active_cart = make_buyer(1, item)
+        _, idle_cart = make_buyer(2, item)
+        User.objects.update(date_joined=old, last_login=None)  # connexion par e-mail : last_login jamais renseigné
+        Cart.objects.update(created_at=old, updated_at=old)
+        self.client.post("/api/cart/add/", {"email": active.email, "item_id": item.id}, content_type="application/json")
+
+        run_cleanup(["abandoned_carts"], pause=0)
+
+        self.assertEqual(list(Cart.objects.all()), [active_cart])
+        self.assertFalse(Cart.objects.filter(pk=idle_cart.pk).exists())
+
+    @mock.patch("market.providers.paypal_access_token", return_value="token")
+    def test_stale_payments_are_checked_with_provider(self, _token):
+        seller = User.objects.create(username="seller", email="seller@example.com")
+        item = Item.objects.create(title="Tapis", item_type="SELL", price=300, owner=seller)
+        buyer, cart = make_buyer(1, item)
+        order = snapshot_cart(buyer, cart)
+        Payment.objects.create(user=buyer, order=order, payment_method="stripe", amount=300, stripe_payment_intent_id="pi_1")
+        Payment.objects.create(user=buyer, order=order, payment_method="paypal", amount=300, paypal_order_id="PP-1")
+        Payment.objects.update(created_at=timezone.now() - timedelta(days=3))
+
+        run_cleanup([PAYMENT_TARGET], pause=0)
+
+        self.assertEqual(Payment.objects.filter(status="PENDING").count(), 2)  # rien tranché sans le fournisseur
+        jobs_ = {job.name: job.payload for job in Job.objects.all()}
+        self.assertEqual(jobs_["payments.verify_stripe_payment"], {"payment_intent_id": "pi_1", "stale": True})
+        self.assertEqual(jobs_["payments.sync_paypal_order"], {"order_id": "PP-1", "stale": True})
+
+        opened = SimpleNamespace(status="requires_confirmation")
+        with mock.patch("market.providers.stripe_retrieve_intent", return_value=opened), \
+                mock.patch("market.providers.stripe_cancel_intent", return_value=SimpleNamespace(status="canceled")) as cancel:
+            self.assertEqual(tasks.verify_stripe_payment("pi_1", stale=True), "CANCELLED")
+        cancel.assert_called_once_with("pi_1")
+        with mock.patch("market.providers.paypal_get_order", return_value={"status": "APPROVED"}):
+            self.assertIsNone(tasks.sync_paypal_order("PP-1"))
+            self.assertEqual(tasks.sync_paypal_order("PP-1", stale=True), "CANCELLED")
+        self.assertEqual(set(Payment.objects.values_list("status", flat=True)), {"CANCELLED"})
+        self.assertTrue(Item.objects.get(pk=item.pk).is_available)
+
+        with mock.patch("requests.post") as post:
+            response = self.client.post("/api/payments/capture-order/", {"order_id": "PP-1"}, content_type="application/json")
+        self.assertEqual(response.status_code, 409)
+        post.assert_not_called()
+
+
+class AutocompleteTests(TestCase):
+    def test_ranks_by_popularity_and_follows_item_signals(self):
+        for title, city in [("Vélo de course", "Rabat"), ("Vélo enfant", "Rabat"), ("Velux", "Casablanca")]:
+            Item.objects.create(title=title, item_type="SELL", price=100, city=city)
+        index = autocomplete.Autocomplete()
+
+        with mock.patch.object(autocomplete, "index", index):
+            result = index.suggest("ve", 5)
+            self.assertEqual(result["titles"], [{"text": "vélo", "count": 2}, {"text": "velux", "count": 1}])
+            self.assertEqual(index.suggest("ra", 5)["cities"], [{"text": "Rabat", "count": 2}])
+
+            with self.captureOnCommitCallbacks(execute=True):
+                sold = Item.objects.get(title="Velux")
+                sold.is_available = False
+                sold.save()
+                Item.objects.create(title="Vespa", item_type="SELL", price=900, city="Rabat")
+            with self.captureOnCommitCallbacks(execute=True):
+                Item.objects.filter(title="Vélo enfant").delete()
+
+        self.assertEqual(index.titles.top("ve", 5), [{"text": "vélo", "count": 1}, {"text": "vespa", "count": 1}])
+        self.assertEqual(index.cities.top("rab", 5), [{"text": "Rabat", "count": 2}])
+
+
+    def test_dead_terms_give_way_and_are_compacted(self):
+        terms = autocomplete.PrefixIndex(max_terms=2)
+        self.assertTrue(terms.add("lampe", "lampe") and terms.add("lit", "lit"))
+        self.assertFalse(terms.add("table", "table"))  # vocabulaire plein
+        terms.discard("lampe")
+        self.assertTrue(terms.add("tapis", "tapis"))  # le terme mort ne compte plus
+        self.assertEqual((terms.keys, len(terms), terms.dropped), (["lampe", "lit", "tapis"], 2, 1))
+
+        self.assertTrue(terms.needs_compaction())
+        compacted = terms.compacted()
+        self.assertEqual((compacted.keys, compacted.dropped), (["lit", "tapis"], 1))
+        self.assertEqual(compacted.top("l", 5), [{"text": "lit", "count": 1}])
+
+    @override_settings(AUTOCOMPLETE_MAX_TERMS=1, AUTOCOMPLETE_MAX_ITEMS=2, AUTOCOMPLETE_SYNC_INTERVAL=0, CHANGE_FEED_LAG=0)
+    def test_sync_compacts_and_tracked_items_are_bounded(self):
+        chair = Item.objects.create(title="Chaise", item_type="SELL", price=10)
+        Item.objects.create(title="Chaise", item_type="SELL", price=10)
+        Item.objects.create(title="Chaise", item_type="SELL", price=10)
+        index = autocomplete.Autocomplete()
+        index.build()
+        self.assertEqual((index.stats()["items"], index.stats()["dropped_items"]), (2, 1))
+
+        index.remove(list(index._items))
+        self.assertEqual(index.titles.keys, ["chaise"])  # mort, gardé jusqu'au rattrapage
+        index.apply([{"id": chair.id, "title": "Commode", "city": "", "is_available": True}])
+        index.sync()
+
+        self.assertEqual(index.titles.keys, ["commode"])
+        self.assertEqual(index._items, {chair.id: (("commode",), None)})
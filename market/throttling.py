@@ -0,0 +1,121 @@
+import math
+import time
+
+from datetime import datetime, timezone
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import F
+from rest_framework.throttling import BaseThrottle
+
+from .models import ThrottleCounter
+
+
+PERIODS = {'s': 1, 'sec': 1, 'm': 60, 'min': 60, 'h': 3600, 'hour': 3600, 'd': 86400, 'day': 86400}
+
+
+def parse_rate(rate):
+    """"10/min" → 10 / 60 jetons par seconde."""
+    count, period = rate.split('/')
+    return int(count) / PERIODS[period]
+
+
+class TokenBucketThrottle(BaseThrottle):
+    """
+    `capacity` requêtes en rafale, puis `rate` requêtes par période, pour
+    tous les workers. Le scope est choisi par action via `throttle_scopes`
+    sur le ViewSet, par ex. :
+
+        throttle_scopes = {"login": "login", "register": "register"}
+
+    et configuré dans settings.TOKEN_BUCKETS[scope][kind].
+    Les actions absentes de `throttle_scopes` ne sont pas limitées.
+
+    Le seau est compté en fenêtre glissante : fenêtres de capacity / rate
+    secondes (le temps de recharger un seau vide), la fenêtre précédente
+    pesant au prorata du temps qui lui reste. Le comptage est une mise à
+    jour conditionnelle en base (ThrottleCounter) : atomique même avec le
+    cache base de données, dont incr() n'est qu'un get puis set. Une
+    rafale concurrente ne peut pas dépasser `capacity`.
+    """
+    kind = None
+
+    def get_ident_value(self, request):
+        raise NotImplementedError
+
+    def get_config(self, view):
+        scope = getattr(view, 'throttle_scopes', {}).get(getattr(view, 'action', None))
+        if not scope:
+            return None, None
+        return scope, settings.TOKEN_BUCKETS.get(scope, {}).get(self.kind)
+
+    def allow_request(self, request, view):
+        self.wait_seconds = None
+        scope, config = self.get_config(view)
+        if not config:
+            return True
+        ident = self.get_ident_value(request)
+        if not ident:
+            return True
+
+        capacity = config['capacity']
+        rate = parse_rate(config['rate'])
+        length = capacity / rate
+        key = f"throttle:{scope}:{self.kind}:{ident}"[:255]
+        now = time.time()
+        window, elapsed = divmod(now, length)
+        window = int(window)
+
+        counts = dict(
+            ThrottleCounter.objects.filter(key=key, window__in=[window - 1, window]).values_list('window', 'count')
+        )
+        carried = math.ceil(counts.get(window - 1, 0) * (1 - elapsed / length))
+        limit = capacity - carried
+        if limit > 0 and self._consume(key, window, limit, now + 2 * length):
+            return True
+
+        # Attente : que la part de la fenêtre précédente libère une place,
+        # ou la fenêtre suivante si la courante est pleine
+        current, previous = counts.get(window, 0), counts.get(window - 1, 0)
+        if current < capacity and previous:
+            ready_at = length * (1 - (capacity - current - 1) / previous)
+            self.wait_seconds = max(ready_at - elapsed, 1 / rate)
+        else:
+            self.wait_seconds = length - elapsed
+        return False
+
+    def _consume(self, key, window, limit, expires):
+        """Prend une place si la fenêtre en compte moins de `limit` (UPDATE conditionnel)."""
+        counter = ThrottleCounter.objects.filter(key=key, window=window, count__lt=limit)
+        if counter.update(count=F('count') + 1):
+            return True
+        try:
+            with transaction.atomic():
+                ThrottleCounter.objects.create(
+                    key=key, window=window, count=1,
+                    expires_at=datetime.fromtimestamp(expires, tz=timezone.utc),
+                )
+            return True
+        except IntegrityError:
+            # Fenêtre créée entre-temps (ou déjà pleine) : nouvelle tentative conditionnelle
+            return bool(counter.update(count=F('count') + 1))
+
+    def wait(self):
+        return self.wait_seconds
+
+
+class IPTokenBucketThrottle(TokenBucketThrottle):
+    kind = 'ip'
+
+    def get_ident_value(self, request):
+        return self.get_ident(request)
+
+
+class EmailTokenBucketThrottle(TokenBucketThrottle):
+    kind = 'email'
+
+    def get_ident_value(self, request):
+        email = request.data.get('email') if hasattr(request.data, 'get') else None
+        if not email:
+            email = request.query_params.get('email')
+        return email.strip().lower() if email else None
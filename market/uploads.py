@@ -0,0 +1,137 @@
+import os
+import shutil
+import tempfile
+
+from django.conf import settings
+from django.core.files import File
+from django.db import transaction
+
+from .media import store_file
+from .models import UploadSession
+
+
+UPLOAD_PREFIXES = {
+    'PROFILE': 'profiles/',
+    'DOCUMENT': 'documents/',
+    'ITEM': 'items/',
+}
+
+
+class UploadError(Exception):
+    """Erreur côté client sur un upload fractionné (réponse 400)."""
+
+
+def _session_dir(session):
+    return os.path.join(settings.CHUNKED_UPLOAD_DIR, str(session.id))
+
+
+def _part_path(session, index):
+    return os.path.join(_session_dir(session), f"{index:05d}.part")
+
+
+def _expected_part_size(session, index):
+    if index < session.total_parts - 1:
+        return session.chunk_size
+    return session.total_size - session.chunk_size * (session.total_parts - 1)
+
+
+# ===================================
+# 🔹 Étapes : initier, envoyer, terminer
+# ===================================
+def initiate(purpose, filename, total_size, chunk_size=None):
+    if purpose not in UPLOAD_PREFIXES:
+        raise UploadError("Type d'upload inconnu.")
+    if total_size <= 0 or total_size > settings.CHUNKED_UPLOAD_MAX_SIZE:
+        raise UploadError("Taille de fichier invalide.")
+
+    chunk_size = chunk_size or settings.CHUNKED_UPLOAD_CHUNK_SIZE
+    chunk_size = min(chunk_size, settings.CHUNKED_UPLOAD_CHUNK_SIZE)
+    session = UploadSession.objects.create(
+        purpose=purpose,
+        filename=os.path.basename(filename)[:255],
+        total_size=total_size,
+        chunk_size=chunk_size,
+    )
+    os.makedirs(_session_dir(session), exist_ok=True)
+    return session
+
+
+def received_parts(session):
+    """Index des morceaux déjà reçus, pour que le client reprenne là où il s'est arrêté."""
+    try:
+        names = os.listdir(_session_dir(session))
+    except FileNotFoundError:
+        return []
+    return sorted(int(name[:-5]) for name in names if name.endswith('.part'))
+
+
+def write_part(session, index, chunk):
+    """
+    Écrit un morceau sur disque en streaming (`chunk.chunks()`), puis le
+    renomme atomiquement : un morceau interrompu n'est jamais compté comme reçu.
+    Renvoyer un morceau déjà reçu l'écrase (idempotent).
+    """
+    if session.status != 'UPLOADING':
+        raise UploadError("Cet upload est déjà terminé.")
+    if not 0 <= index < session.total_parts:
+        raise UploadError("Index de morceau invalide.")
+    if chunk.size != _expected_part_size(session, index):
+        raise UploadError("Taille de morceau invalide.")
+
+    os.makedirs(_session_dir(session), exist_ok=True)
+    final_path = _part_path(session, index)
+    tmp_path = f"{final_path}.tmp"
+    with open(tmp_path, 'wb') as fh:
+        for data in chunk.chunks():
+            fh.write(data)
+    os.replace(tmp_path, final_path)
+
+
+def complete(session):
+    """
+    Assemble les morceaux dans l'ordre puis stocke le fichier final (dédupliqué).
+    La session est verrouillée : deux appels concurrents n'ajoutent qu'une
+    référence MediaBlob, le second renvoie la session terminée.
+    """
+    with transaction.atomic():
+        session = UploadSession.objects.select_for_update().get(pk=session.pk)
+        if session.status != 'UPLOADING':
+            return session
+
+        missing = set(range(session.total_parts)) - set(received_parts(session))
+        if missing:
+            raise UploadError(f"Morceaux manquants : {sorted(missing)}")
+
+        with tempfile.TemporaryFile(dir=settings.CHUNKED_UPLOAD_DIR) as assembled:
+            for index in range(session.total_parts):
+                with open(_part_path(session, index), 'rb') as part:
+                    shutil.copyfileobj(part, assembled)
+            assembled.seek(0)
+            name = store_file(File(assembled, name=session.filename), UPLOAD_PREFIXES[session.purpose])
+
+        session.stored_name = name
+        session.status = 'COMPLETE'
+        session.save(update_fields=['stored_name', 'status', 'updated_at'])
+    discard_parts(session)
+    return session
+
+
+def discard_parts(session):
+    shutil.rmtree(_session_dir(session), ignore_errors=True)
+
+
+# ===================================
+# 🔗 Rattachement à un champ fichier
+# ===================================
+def consume(upload_id, purpose):
+    """
+    Renvoie le nom du fichier d'un upload terminé et le marque comme utilisé.
+    La référence MediaBlob de l'upload est transférée au champ qui le reçoit.
+    """
+    session = UploadSession.objects.filter(id=upload_id, purpose=purpose, status='COMPLETE').first()
+    if not session:
+        raise UploadError("Upload introuvable ou non terminé.")
+    claimed = UploadSession.objects.filter(id=session.id, status='COMPLETE').update(status='CONSUMED')
+    if not claimed:
+        raise UploadError("Upload déjà utilisé.")
+    return session.stored_name
@@ -1,15 +1,46 @@
 from rest_framework import viewsets, status
 from rest_framework.decorators import action
+from rest_framework.exceptions import ParseError, ValidationError
 from rest_framework.response import Response
-from rest_framework.permissions import AllowAny, IsAuthenticated
+from rest_framework.permissions import AllowAny, IsAdminUser, IsAuthenticated
 from django.contrib.auth import authenticate, login, logout
-from .models import User,Item,ItemImage,Cart,CartItem,Payment
-from .serializers import RegisterSerializer, LoginSerializer,UserListSerializer,ItemSerializer,SellItemSerializer,ItemImageSerializer,CartSerializer,CartItemSerializer,RentItemSerializer,PaymentSerializer
+from .models import User,Item,ItemImage,Cart,CartItem,Payment,UploadSession,ArchivedItem
+from .media import store_file
+from .autocomplete import index as autocomplete_index
+from .bulk_updates import BULK_FIELDS, BulkUpdateError, NotOwned, update_items
+from .changes import CursorError, CursorExpired, read_changes
+from .currency import RatesUnavailable, UnsupportedCurrency, conversion_for, convert, payment_rate
+from .dashboard import get_dashboard
+from .idempotency import idempotent
+from .orders import OrderError, snapshot_cart
+from .pagination import PaymentHistoryPagination
+from .reservations import ReservationConflict
+from .events import broadcaster, stream as events_stream
+from .price_stats import read_stats as read_price_stats
+from .profiling import list_reports, load_report
+from .similar import similar_ids
+from .throttling import IPTokenBucketThrottle, EmailTokenBucketThrottle
+from . import providers, reservations, tasks
+from . import uploads
+from .uploads import UploadError
+from .serializers import RegisterSerializer, LoginSerializer,UserListSerializer,ItemSerializer,SellItemSerializer,ItemImageSerializer,CartSerializer,CartItemSerializer,RentItemSerializer,PaymentSerializer,UploadSessionSerializer,ArchivedItemSerializer,OrderSerializer
+from django.core.handlers.asgi import ASGIRequest
+from django.http import Http404, HttpResponse, JsonResponse, StreamingHttpResponse
+from django.shortcuts import get_object_or_404
+from django.db import transaction
+from django.db.models import Count, Prefetch, Sum
 from django.views.decorators.csrf import ensure_csrf_cookie
-from rest_framework.decorators import api_view
+from rest_framework.decorators import api_view, permission_classes
 from django.utils.decorators import method_decorator
 from django.views.decorators.csrf import csrf_exempt
-import stripe
+import logging
+import uuid
+from datetime import timedelta
+from decimal import Decimal
+from django.conf import settings
+
+
+logger = logging.getLogger(__name__)
 
 
 
@@ -27,6 +58,24 @@ class UserViewSet(viewsets.ModelViewSet):
     queryset = User.objects.all()
     serializer_class = RegisterSerializer  # par défaut
     permission_classes = [AllowAny]
+    throttle_classes = [IPTokenBucketThrottle, EmailTokenBucketThrottle]
+    throttle_scopes = {"login": "login", "register": "register"}
+    OWNER_ACTIONS = ('update', 'partial_update', 'destroy')
+
+    def get_permissions(self):
+        # 🔒 Modifier un compte (mot de passe compris) : son propriétaire ou le staff
+        if self.action in self.OWNER_ACTIONS:
+            return [IsAuthenticated()]
+        return super().get_permissions()
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        if getattr(self, 'swagger_fake_view', False):  # génération du schéma OpenAPI
+            return queryset
+        if self.action in self.OWNER_ACTIONS and not self.request.user.is_staff:
+            return queryset.filter(pk=self.request.user.pk)
+        return queryset
+
     def get_serializer_class(self):
         """
         🔹 Utiliser un serializer différent selon l’action
@@ -107,14 +156,316 @@ class UserViewSet(viewsets.ModelViewSet):
             "profile_picture": request.build_absolute_uri(user.profile_picture.url) if user.profile_picture else None,
         })
 
+    # 📊 DASHBOARD VENDEUR
+    @action(detail=False, methods=['get'], permission_classes=[IsAuthenticated])
+    def dashboard(self, request):
+        """
+        Annonces du vendeur connecté : compteurs par type et disponibilité,
+        paniers par annonce et chiffre d'affaires des paiements complétés.
+        Calculé par requêtes groupées et mis en cache par vendeur.
+        """
+        return Response(get_dashboard(request.user))
+
 
 @api_view(['GET'])
 @ensure_csrf_cookie
 def get_csrf_token(request):
     return Response({"detail": "CSRF cookie set"})
 
-class RentItemViewSet(viewsets.ModelViewSet):
-    queryset = Item.objects.filter(item_type='RENT')
+
+@api_view(['GET'])
+def changes(request):
+    """
+    Synchronisation incrémentale : annonces et images créées ou modifiées et
+    suppressions depuis ?cursor= (absent au premier appel). Rappeler avec le
+    `cursor` renvoyé tant que `has_more` est vrai.
+    """
+    try:
+        limit = min(int(request.query_params.get("limit", settings.CHANGE_FEED_PAGE_SIZE)), settings.CHANGE_FEED_PAGE_SIZE)
+    except ValueError:
+        limit = settings.CHANGE_FEED_PAGE_SIZE
+    try:
+        data = read_changes(request.query_params.get("cursor"), max(limit, 1))
+    except CursorError as e:
+        return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+    except CursorExpired as e:
+        return Response({"error": str(e), "reset": True}, status=status.HTTP_410_GONE)
+
+    storage = ItemImage._meta.get_field('image').storage
+    for row in data['items']:
+        row['price'] = str(row['price']) if row['price'] is not None else None
+    for row in data['images']:
+        row['image'] = request.build_absolute_uri(storage.url(row['image'])) if row['image'] else None
+    return Response(data)
+
+# 🔬 Rapports de profilage à la demande (staff, voir market/profiling.py)
+@api_view(['GET'])
+@permission_classes([IsAdminUser])
+def profiles(request):
+    try:
+        limit = min(int(request.query_params.get("limit", 50)), settings.PROFILING_MAX_REPORTS)
+    except ValueError:
+        limit = 50
+    return Response(list_reports(max(limit, 1)))
+
+
+@api_view(['GET'])
+@permission_classes([IsAdminUser])
+def profile_report(request, report_id):
+    """Rapport complet ; ?as=folded : piles repliées (flamegraph.pl, speedscope), ?as=text : sortie pstats."""
+    report = load_report(report_id)
+    if not report:
+        return Response({"error": "Rapport introuvable."}, status=status.HTTP_404_NOT_FOUND)
+    view_as = request.query_params.get("as")
+    if view_as == "folded" and "folded" in report["profile"]:
+        return HttpResponse("\n".join(report["profile"]["folded"]) + "\n", content_type="text/plain; charset=utf-8")
+    if view_as == "text" and "text" in report["profile"]:
+        return HttpResponse(report["profile"]["text"], content_type="text/plain; charset=utf-8")
+    return Response(report)
+
+
+# 🔎 Autocomplétion (index en mémoire du worker, voir market/autocomplete.py)
+AUTOCOMPLETE_MAX_LIMIT = 20
+
+
+@api_view(['GET'])
+@permission_classes([AllowAny])
+def autocomplete(request):
+    """Mots de titres (complétion du dernier mot) et villes commençant par ?q=, les plus fréquents d'abord."""
+    query = request.query_params.get("q", "")[:100]
+    try:
+        limit = min(int(request.query_params.get("limit", settings.AUTOCOMPLETE_LIMIT)), AUTOCOMPLETE_MAX_LIMIT)
+    except ValueError:
+        limit = settings.AUTOCOMPLETE_LIMIT
+    return Response({"query": query, **autocomplete_index.suggest(query, max(limit, 1))})
+
+
+async def item_events(request):
+    """
+    Flux SSE des annonces créées, modifiées ou vendues (?city=, ?type=SELL|RENT).
+    Vue asynchrone : à servir par sh.asgi (GUNICORN_WORKER_MODEL=asgi), où
+    une connexion inactive ne mobilise ni thread ni requête SQL.
+    """
+    if not isinstance(request, ASGIRequest):
+        return JsonResponse({"error": "Flux disponible uniquement via le serveur ASGI."}, status=501)
+    item_type = (request.GET.get("type") or "").upper() or None
+    if item_type and item_type not in dict(Item.TYPE_CHOICES):
+        return JsonResponse({"error": "type doit valoir SELL ou RENT."}, status=400)
+    city = (request.GET.get("city") or "").strip() or None
+
+    subscriber = broadcaster.subscribe(city=city, item_type=item_type)
+    response = StreamingHttpResponse(events_stream(subscriber), content_type="text/event-stream")
+    response["Cache-Control"] = "no-cache"
+    response["X-Accel-Buffering"] = "no"  # pas de mise en tampon par un proxy nginx
+    return response
+
+
+def uploaded_image_ids(data):
+    """Ids d'uploads ITEM à rattacher, tous vérifiés avant la création de l'annonce (sinon 400)."""
+    raw = data.getlist('image_upload_ids') if hasattr(data, 'getlist') else data.get('image_upload_ids') or []
+    if isinstance(raw, str):
+        raw = [raw]
+    try:
+        upload_ids = [uuid.UUID(str(value)) for value in raw]
+    except ValueError:
+        raise ValidationError({"image_upload_ids": ["Identifiant d'upload invalide."]})
+    ready = set(
+        UploadSession.objects.filter(id__in=upload_ids, purpose='ITEM', status='COMPLETE').values_list('id', flat=True)
+    )
+    invalid = [str(upload_id) for upload_id in upload_ids if upload_id not in ready]
+    if invalid or len(set(upload_ids)) != len(upload_ids):
+        raise ValidationError({"image_upload_ids": [f"Uploads introuvables, non terminés ou déjà utilisés : {', '.join(invalid) or 'doublons'}."]})
+    return upload_ids
+
+
+def attach_uploaded_images(item, upload_ids):
+    # Dans la transaction de création : un upload pris entre-temps annule tout
+    for upload_id in upload_ids:
+        try:
+            name = uploads.consume(upload_id, 'ITEM')
+        except UploadError as exc:
+            raise ValidationError({"image_upload_ids": [str(exc)]})
+        ItemImage.objects.create(item=item, image=name)
+
+
+class UploadViewSet(viewsets.GenericViewSet):
+    """
+    Upload fractionné et reprenable (documents étudiants, photos) :
+    - POST /uploads/ → initier (filename, total_size, purpose)
+    - GET /uploads/{id}/ → état et morceaux déjà reçus
+    - PUT /uploads/{id}/parts/{index}/ → envoyer un morceau (champ "chunk")
+    - POST /uploads/{id}/complete/ → assembler le fichier final
+    L'id obtenu est ensuite passé à l'inscription ou à la création d'annonce.
+    """
+    queryset = UploadSession.objects.all()
+    serializer_class = UploadSessionSerializer
+    permission_classes = [AllowAny]
+
+    def create(self, request):
+        try:
+            session = uploads.initiate(
+                purpose=request.data.get("purpose"),
+                filename=request.data.get("filename", ""),
+                total_size=int(request.data.get("total_size", 0)),
+                chunk_size=int(request.data.get("chunk_size") or 0) or None,
+            )
+        except (UploadError, ValueError) as exc:
+            return Response({"error": str(exc)}, status=status.HTTP_400_BAD_REQUEST)
+        return Response(self.get_serializer(session).data, status=status.HTTP_201_CREATED)
+
+    def retrieve(self, request, pk=None):
+        return Response(self.get_serializer(self.get_object()).data)
+
+    @action(detail=True, methods=['put', 'post'], url_path=r'parts/(?P<index>\d+)')
+    def upload_part(self, request, pk=None, index=None):
+        session = self.get_object()
+        chunk = request.FILES.get("chunk")
+        if not chunk:
+            return Response({"error": "Morceau manquant."}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            uploads.write_part(session, int(index), chunk)
+        except UploadError as exc:
+            return Response({"error": str(exc)}, status=status.HTTP_400_BAD_REQUEST)
+        return Response({"index": int(index), "received_parts": uploads.received_parts(session)})
+
+    @action(detail=True, methods=['post'])
+    def complete(self, request, pk=None):
+        session = self.get_object()
+        try:
+            session = uploads.complete(session)
+        except UploadError as exc:
+            return Response({"error": str(exc)}, status=status.HTTP_400_BAD_REQUEST)
+        return Response(self.get_serializer(session).data)
+
+
+class ItemActionsMixin:
+    """Actions communes aux ViewSets d'annonces (vente / location)."""
+
+    def get_serializer_context(self):
+        # ?currency=USD|EUR : une table de taux par requête, jamais d'appel sortant
+        context = super().get_serializer_context()
+        if not hasattr(self, '_conversion'):
+            code = self.request.query_params.get("currency") if self.request else None
+            try:
+                self._conversion = conversion_for(code) if code else None
+            except UnsupportedCurrency as e:
+                raise ParseError(str(e))
+        context['currency'] = self._conversion
+        return context
+
+    def retrieve(self, request, *args, **kwargs):
+        # Annonce archivée : toujours accessible par son id d'origine
+        try:
+            return super().retrieve(request, *args, **kwargs)
+        except Http404:
+            archived = get_object_or_404(
+                ArchivedItem.objects.prefetch_related('images'),
+                pk=kwargs.get(self.lookup_field), item_type=self.item_type,
+            )
+            return Response(ArchivedItemSerializer(archived, context=self.get_serializer_context()).data)
+
+    # 🔎 Annonces similaires (voisines pré-calculées)
+    @action(detail=True, methods=['get'])
+    def similar(self, request, pk=None):
+        try:
+            limit = int(request.query_params.get("k", settings.SIMILAR_ITEMS_K))
+        except ValueError:
+            limit = settings.SIMILAR_ITEMS_K
+        limit = max(1, min(limit, settings.SIMILAR_ITEMS_K))
+
+        if not str(pk).isdigit():
+            raise Http404
+        ids = similar_ids(pk, limit)
+        if ids is None:  # pas de vecteur : annonce inconnue, ou pas encore indexée
+            if not self.get_queryset().filter(pk=pk).exists():
+                raise Http404
+            ids = []
+        items = Item.objects.filter(is_available=True).prefetch_related('images').in_bulk(ids)
+        ordered = [items[i] for i in ids if i in items]
+        return Response(self.get_serializer(ordered, many=True).data)
+
+    # ✏️ Modification groupée (prix, disponibilité…) des annonces d'un vendeur
+    @action(detail=False, methods=['post'], url_path='bulk-update', permission_classes=[IsAuthenticated])
+    def bulk_update(self, request):
+        """
+        {"ids": [...], "patch": {...}} : mêmes valeurs pour toutes les annonces ;
+        {"items": [{"id": ..., "price": ...}, ...]} : valeurs par annonce.
+        Annonces du vendeur connecté uniquement. Nombre de requêtes constant,
+        quel que soit le nombre d'annonces.
+        """
+        try:
+            changes = self.bulk_changes(request.data)
+            updated = update_items(request.user, self.item_type, changes)
+        except BulkUpdateError as e:
+            return Response({"error": str(e), "details": e.errors}, status=status.HTTP_400_BAD_REQUEST)
+        except NotOwned as e:
+            return Response({"error": str(e), "item_ids": e.item_ids}, status=status.HTTP_403_FORBIDDEN)
+        return Response({"updated": updated, "ids": sorted(changes)})
+
+    def bulk_changes(self, data):
+        """{id: valeurs validées} à partir du corps de bulk_update."""
+        if 'items' in data:
+            rows = data.get('items')
+        else:
+            ids, patch = data.get('ids'), data.get('patch')
+            if not isinstance(ids, list) or not isinstance(patch, dict):
+                raise BulkUpdateError("Fournir 'ids' et 'patch', ou 'items'.")
+            rows = [{**patch, 'id': item_id} for item_id in ids]
+        if not isinstance(rows, list) or not rows:
+            raise BulkUpdateError("Aucune annonce à modifier.")
+        if len(rows) > settings.ITEM_BULK_UPDATE_MAX:
+            raise BulkUpdateError(f"{settings.ITEM_BULK_UPDATE_MAX} annonces maximum par requête.")
+
+        changes, validated = {}, {}
+        for row in rows:
+            if not isinstance(row, dict):
+                raise BulkUpdateError("Chaque élément de 'items' doit être un objet.")
+            values = dict(row)
+            try:
+                item_id = int(values.pop('id'))
+            except (KeyError, TypeError, ValueError):
+                raise BulkUpdateError("Identifiant d'annonce manquant ou invalide.")
+            if item_id in changes:
+                raise BulkUpdateError(f"Annonce {item_id} en double.")
+            unknown = sorted(set(values) - set(BULK_FIELDS))
+            if unknown or not values:
+                raise BulkUpdateError(f"Champs modifiables : {', '.join(BULK_FIELDS)}.", {item_id: unknown})
+
+            # Un même patch n'est validé qu'une fois
+            key = repr(sorted(values.items()))
+            if key not in validated:
+                serializer = self.get_serializer(data=values, partial=True)
+                if not serializer.is_valid():
+                    raise BulkUpdateError("Valeurs invalides.", {item_id: serializer.errors})
+                validated[key] = serializer.validated_data
+            changes[item_id] = validated[key]
+        return changes
+
+    # 📊 Statistiques de prix pré-calculées (?city=)
+    @action(detail=False, methods=['get'], url_path='price-insights')
+    def price_insights(self, request):
+        city = (request.query_params.get("city") or "").strip() or None
+        return Response(read_price_stats(self.item_type, city))
+
+
+class ArchivedItemViewSet(viewsets.ReadOnlyModelViewSet):
+    """Annonces archivées (GET /archived-items/{id}/, ?owner_email= pour la liste d'un vendeur)."""
+    serializer_class = ArchivedItemSerializer
+    permission_classes = [AllowAny]
+
+    def get_queryset(self):
+        archived = ArchivedItem.objects.prefetch_related('images').order_by('-archived_at', '-id')
+        if getattr(self, 'swagger_fake_view', False):  # génération du schéma OpenAPI
+            return archived.none()
+        email = self.request.query_params.get("owner_email")
+        if self.action == 'list':
+            return archived.filter(owner__email=email) if email else archived.none()
+        return archived
+
+
+class RentItemViewSet(ItemActionsMixin, viewsets.ModelViewSet):
+    item_type = 'RENT'
+    queryset = Item.objects.filter(item_type='RENT').prefetch_related('images')
     serializer_class = RentItemSerializer
     permission_classes = [AllowAny]
 
@@ -122,17 +473,23 @@ class RentItemViewSet(viewsets.ModelViewSet):
     def perform_create(self, serializer):
         email = self.request.data.get("owner_email")
         user = User.objects.filter(email=email).first()
+        upload_ids = uploaded_image_ids(self.request.data)
 
-        # ✅ On crée l’item avec le bon owner et type SELL
-        item = serializer.save(owner=user, item_type='RENT')
+        with transaction.atomic():
+            # ✅ On crée l’item avec le bon owner et type SELL
+            item = serializer.save(owner=user, item_type='RENT')
 
-        # ✅ Gérer les images multiples
-        images = self.request.FILES.getlist('images')
-        for img in images:
-            ItemImage.objects.create(item=item, image=img)
+            # ✅ Gérer les images multiples
+            images = self.request.FILES.getlist('images')
+            for img in images:
+                ItemImage.objects.create(item=item, image=store_file(img, "items/"))
 
-class SellItemViewSet(viewsets.ModelViewSet):
-    queryset = Item.objects.filter(item_type='SELL')
+            # ✅ Photos déjà envoyées via /uploads/ (upload fractionné)
+            attach_uploaded_images(item, upload_ids)
+
+class SellItemViewSet(ItemActionsMixin, viewsets.ModelViewSet):
+    item_type = 'SELL'
+    queryset = Item.objects.filter(item_type='SELL').prefetch_related('images')
     serializer_class = SellItemSerializer
     permission_classes = [AllowAny]
 
@@ -140,26 +497,37 @@ class SellItemViewSet(viewsets.ModelViewSet):
     def perform_create(self, serializer):
         email = self.request.data.get("owner_email")
         user = User.objects.filter(email=email).first()
+        upload_ids = uploaded_image_ids(self.request.data)
+
+        with transaction.atomic():
+            # ✅ On crée l’item avec le bon owner et type SELL
+            item = serializer.save(owner=user, item_type='SELL')
 
-        # ✅ On crée l’item avec le bon owner et type SELL
-        item = serializer.save(owner=user, item_type='SELL')
+            # ✅ Gérer les images multiples
+            images = self.request.FILES.getlist('images')
+            for img in images:
+                ItemImage.objects.create(item=item, image=store_file(img, "items/"))
 
-        # ✅ Gérer les images multiples
-        images = self.request.FILES.getlist('images')
-        for img in images:
-            ItemImage.objects.create(item=item, image=img)
+            # ✅ Photos déjà envoyées via /uploads/ (upload fractionné)
+            attach_uploaded_images(item, upload_ids)
 
 class CartViewSet(viewsets.ModelViewSet):
     queryset = Cart.objects.all()
     serializer_class = CartSerializer
     permission_classes = [AllowAny]
+    throttle_classes = [IPTokenBucketThrottle, EmailTokenBucketThrottle]
+    throttle_scopes = {"create": "cart", "add_to_cart": "cart", "remove_from_cart": "cart"}
 
     def get_queryset(self):
+        if getattr(self, 'swagger_fake_view', False):  # génération du schéma OpenAPI
+            return Cart.objects.none()
         email = self.request.query_params.get("email")
         if email:
             user = User.objects.filter(email=email).first()
             if user:
-                return Cart.objects.filter(user=user)
+                # Lignes, annonces, vendeurs et images en 3 requêtes, quel que soit le panier
+                lines = CartItem.objects.select_related('item__owner').prefetch_related('item__images')
+                return Cart.objects.filter(user=user).prefetch_related(Prefetch('items', queryset=lines))
         return Cart.objects.none()
 
     def create(self, request, *args, **kwargs):
@@ -187,11 +555,17 @@ class CartViewSet(viewsets.ModelViewSet):
         if not user or not item:
             return Response({"error": "Utilisateur ou article introuvable."}, status=status.HTTP_400_BAD_REQUEST)
 
+        if not item.is_available:
+            return Response({"error": "Article indisponible."}, status=status.HTTP_400_BAD_REQUEST)
+        if reservations.held_by_others([item.id], user):
+            return Response({"error": "Article en cours de réservation."}, status=status.HTTP_409_CONFLICT)
+
         cart, _ = Cart.objects.get_or_create(user=user)
         cart_item, created = CartItem.objects.get_or_create(cart=cart, item=item)
         if not created:
             cart_item.quantity += quantity
         cart_item.save()
+        cart.touch()
 
         return Response({"message": "✅ Article ajouté au panier."}, status=status.HTTP_200_OK)
 
@@ -211,65 +585,112 @@ class CartViewSet(viewsets.ModelViewSet):
 
         deleted, _ = CartItem.objects.filter(cart=cart, item_id=item_id).delete()
         if deleted:
+            cart.touch()
             return Response({"message": "🗑️ Article supprimé du panier."})
         return Response({"error": "Article non trouvé."}, status=status.HTTP_404_NOT_FOUND)
 
-import requests
-from django.conf import settings
-from rest_framework import viewsets, status
-from rest_framework.decorators import action
-from rest_framework.permissions import AllowAny
-from rest_framework.response import Response
-from .models import Payment, Cart, User
-from .serializers import PaymentSerializer
-
 
 class PaymentViewSet(viewsets.ModelViewSet):
-    queryset = Payment.objects.all()
+    queryset = Payment.objects.select_related('user')
     serializer_class = PaymentSerializer
     permission_classes = [AllowAny]
+    throttle_classes = [IPTokenBucketThrottle, EmailTokenBucketThrottle]
+    throttle_scopes = {
+        "create": "checkout",
+        "create_order": "checkout",
+        "capture_order": "checkout",
+        "create_payment_stripe": "checkout",
+        "confirm_stripe_payment": "checkout",
+    }
+
+    @idempotent
+    def create(self, request, *args, **kwargs):
+        return super().create(request, *args, **kwargs)
 
     # ===================================
-    # 🔹 Conversion MAD → USD
+    # 📜 Historique des paiements d'un utilisateur
     # ===================================
-    def convert_mad_to_usd(self, amount_mad):
+    @action(detail=False, methods=["get"], permission_classes=[IsAuthenticated])
+    def history(self, request):
         """
-        Convertit MAD en USD via une API gratuite.
-        Fallback vers un taux fixe si l’API ne répond pas.
+        Paiements de l'utilisateur connecté, du plus récent au plus ancien,
+        paginés par curseur. `totals` regroupe montants et nombres par
+        devise, puis par statut et par moyen de paiement, en une seule requête.
         """
-        try:
-            response = requests.get("https://api.exchangerate-api.com/v4/latest/MAD")
-            if response.status_code == 200:
-                data = response.json()
-                usd_rate = data["rates"].get("USD", 0.10)  # sécurité
-                return round(float(amount_mad) * usd_rate, 2)
-        except Exception:
-            pass  # en cas d'erreur réseau
-        # taux de secours : 1 MAD ≈ 0.10 USD
-        return round(float(amount_mad) * 0.10, 2)
+        payments = Payment.objects.filter(user=request.user).select_related('user')
+        paginator = PaymentHistoryPagination()
+        page = paginator.paginate_queryset(payments, request, view=self)
+        response = paginator.get_paginated_response(PaymentSerializer(page, many=True).data)
+
+        totals = {}
+        grouped = (
+            Payment.objects.filter(user=request.user)
+            .order_by()
+            .values('currency', 'status', 'payment_method')
+            .annotate(count=Count('id'), total=Sum('amount'))
+        )
+        for row in grouped:
+            # Montants jamais additionnés d'une devise à l'autre
+            currency = totals.setdefault(row['currency'], {"by_status": {}, "by_method": {}})
+            for bucket, key in ((currency["by_status"], row['status']), (currency["by_method"], row['payment_method'])):
+                entry = bucket.setdefault(key, {"count": 0, "total": Decimal("0")})
+                entry["count"] += row['count']
+                entry["total"] += row['total'] or 0
+        for currency in totals.values():
+            for bucket in currency.values():
+                for entry in bucket.values():
+                    entry["total"] = str(Decimal(entry["total"]).quantize(Decimal("0.01")))  # même format que `amount`
+        response.data["totals"] = totals
+        return response
 
     # ===================================
-    # 🔐 Token PayPal
+    # 🧾 Reçu : commande figée du paiement
     # ===================================
-    def get_paypal_access_token(self):
-        auth_response = requests.post(
-            f"{settings.PAYPAL_API_BASE}/v1/oauth2/token",
-            auth=(settings.PAYPAL_CLIENT_ID, settings.PAYPAL_SECRET),
-            data={"grant_type": "client_credentials"},
+    @action(detail=True, methods=["get"])
+    def receipt(self, request, pk=None):
+        """Paiement, commande et lignes en deux requêtes, sans relire le panier."""
+        payment = (
+            Payment.objects.select_related('user', 'order')
+            .prefetch_related('order__lines')
+            .filter(pk=pk)
+            .first()
         )
-        auth_response.raise_for_status()
-        return auth_response.json()["access_token"]
+        if not payment:
+            return Response({"error": "Paiement introuvable."}, status=status.HTTP_404_NOT_FOUND)
+        if not payment.order:
+            return Response({"error": "Aucune commande associée à ce paiement."}, status=status.HTTP_404_NOT_FOUND)
+        return Response({
+            "payment": PaymentSerializer(payment).data,
+            "order": OrderSerializer(payment.order).data,
+        })
+
+    # ===================================
+    # 🔹 Conversion MAD → USD
+    # ===================================
+    def convert_mad_to_usd(self, amount_mad):
+        """
+        Convertit MAD en USD (Decimal au centime) avec la table de taux relue
+        par le job ; RatesUnavailable si elle manque (jamais de taux de secours).
+        """
+        return convert(amount_mad, payment_rate("USD"))
+
+    def rates_unavailable(self, order, error):
+        reservations.release_orders([order.id])
+        return Response({"error": str(error)}, status=status.HTTP_503_SERVICE_UNAVAILABLE)
+
+    def abandon_order(self, order):
+        """Appel fournisseur en échec (réseau, réponse illisible…) : aucun paiement, les annonces sont libérées."""
+        logger.exception("Commande %s abandonnée : fournisseur de paiement en échec", order.id)
+        reservations.release_orders([order.id])
+        return Response({"error": "Fournisseur de paiement indisponible."}, status=status.HTTP_502_BAD_GATEWAY)
 
     # ===================================
     # 🧾 Créer une commande PayPal
     # ===================================
     @action(detail=False, methods=["post"], url_path="create-order")
+    @idempotent
     def create_order(self, request):
         email = request.data.get("email")
-        amount_mad = request.data.get("amount")
-
-        if not amount_mad:
-            return Response({"error": "Montant manquant."}, status=status.HTTP_400_BAD_REQUEST)
 
         user = User.objects.filter(email=email).first()
         if not user:
@@ -277,55 +698,62 @@ class PaymentViewSet(viewsets.ModelViewSet):
 
         cart = Cart.objects.filter(user=user).first()
 
+        # 🧾 Montant calculé côté serveur à partir de l'instantané du panier
+        try:
+            order = snapshot_cart(user, cart)
+        except OrderError as e:
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        except ReservationConflict as e:
+            return Response({"error": str(e), "item_ids": e.item_ids}, status=status.HTTP_409_CONFLICT)
+        amount_mad = order.total
+
         # 💱 Conversion MAD → USD
-        amount_usd = self.convert_mad_to_usd(amount_mad)
-
-        access_token = self.get_paypal_access_token()
-        headers = {
-            "Content-Type": "application/json",
-            "Authorization": f"Bearer {access_token}",
-        }
-
-        payload = {
-            "intent": "CAPTURE",
-            "purchase_units": [
-                {
-                    "amount": {
-                        "currency_code": "USD",
-                        "value": str(amount_usd)
-                    },
-                    "description": f"Achat meubles étudiant ({amount_mad} MAD ≈ {amount_usd} USD)"
+        try:
+            amount_usd = self.convert_mad_to_usd(amount_mad)
+        except RatesUnavailable as e:
+            return self.rates_unavailable(order, e)
+
+        try:
+            payload = {
+                "intent": "CAPTURE",
+                "purchase_units": [
+                    {
+                        "amount": {
+                            "currency_code": "USD",
+                            "value": str(amount_usd)
+                        },
+                        "description": f"Achat meubles étudiant ({amount_mad} MAD ≈ {amount_usd} USD)"
+                    }
+                ],
+                "application_context": {
+                    "return_url": "http://localhost:3000/payment-success",
+                    "cancel_url": "http://localhost:3000/payment-cancel"
                 }
-            ],
-            "application_context": {
-                "return_url": "http://localhost:3000/payment-success",
-                "cancel_url": "http://localhost:3000/payment-cancel"
             }
-        }
-
-        response = requests.post(
-            f"{settings.PAYPAL_API_BASE}/v2/checkout/orders",
-            json=payload,
-            headers=headers
-        )
-
-        if response.status_code != 201:
-            return Response(response.json(), status=response.status_code)
-
-        data = response.json()
-        order_id = data["id"]
-
-        # 💾 Sauvegarder la transaction
-        Payment.objects.create(
-            user=user,
-            cart=cart,
-            paypal_order_id=order_id,
-            payment_method="paypal",   # ✅ OBLIGATOIRE
-            amount=amount_mad,
-            currency="MAD",
-            status="PENDING"
-        )
 
+            response = providers.paypal_create_order(payload)
+            if response.status_code != 201:
+                reservations.release_orders([order.id])
+                return Response(response.json(), status=response.status_code)
+
+            data = response.json()
+            order_id = data["id"]
+
+            # 💾 Sauvegarder la transaction
+            Payment.objects.create(
+                user=user,
+                cart=cart,
+                order=order,
+                paypal_order_id=order_id,
+                payment_method="paypal",   # ✅ OBLIGATOIRE
+                amount=amount_mad,
+                currency="MAD",
+                provider_amount=amount_usd,
+                provider_currency="USD",
+                status="PENDING"
+            )
+        except Exception:
+            return self.abandon_order(order)
 
         approval_url = next(
             (link["href"] for link in data["links"] if link["rel"] == "approve"),
@@ -335,7 +763,7 @@ class PaymentViewSet(viewsets.ModelViewSet):
         return Response({
             "order_id": order_id,
             "approval_url": approval_url,
-            "amount_mad": amount_mad,
+            "amount_mad": str(amount_mad),
             "amount_usd": amount_usd
         }, status=status.HTTP_201_CREATED)
 
@@ -343,36 +771,55 @@ class PaymentViewSet(viewsets.ModelViewSet):
     # 💰 Capture de paiement
     # ===================================
     @action(detail=False, methods=["post"], url_path="capture-order")
+    @idempotent
     def capture_order(self, request):
         order_id = request.data.get("order_id")
         if not order_id:
             return Response({"error": "order_id manquant."}, status=status.HTTP_400_BAD_REQUEST)
 
-        access_token = self.get_paypal_access_token()
-        headers = {
-            "Content-Type": "application/json",
-            "Authorization": f"Bearer {access_token}",
-        }
-
-        response = requests.post(
-            f"{settings.PAYPAL_API_BASE}/v2/checkout/orders/{order_id}/capture",
-            headers=headers
-        )
+        payment = Payment.objects.filter(paypal_order_id=order_id).first()
+        if not payment:
+            return Response({"error": "Paiement introuvable."}, status=status.HTTP_404_NOT_FOUND)
+        if payment.status in ("CANCELLED", "FAILED"):
+            # Paiement abandonné (nettoyage) ou refusé : la commande PayPal ne doit plus être encaissée
+            return Response({"error": "Paiement annulé."}, status=status.HTTP_409_CONFLICT)
+        if payment.status == "PENDING" and not reservations.holds_live(payment.order_id):
+            # Blocage échu ou annonce vendue entre-temps : ne pas encaisser
+            tasks.settle_payments(Payment.objects.filter(pk=payment.pk), "CANCELLED")
+            return Response(
+                {"error": "Réservation expirée : annonce(s) plus disponible(s)."},
+                status=status.HTTP_409_CONFLICT,
+            )
 
+        response = providers.paypal_capture_order(order_id)
         data = response.json()
         if response.status_code not in [200, 201]:
+            # 🔁 Réconcilier plus tard avec l'état réel de la commande chez PayPal
+            tasks.sync_paypal_order.enqueue(order_id=order_id, delay=timedelta(minutes=1))
             return Response(data, status=response.status_code)
 
-        payment = Payment.objects.filter(paypal_order_id=order_id).first()
-        if payment:
-            payment.status = "COMPLETED"
-            payment.payer_email = data.get("payer", {}).get("email_address")
-            payment.payer_id = data.get("payer", {}).get("payer_id")
-            payment.save()
+        payments = Payment.objects.filter(pk=payment.pk)
+        if not providers.paypal_capture_matches(payment, data):
+            # Montant capturé ≠ montant demandé : pas de vente, remboursement à traiter à la main
+            logger.error("Capture PayPal %s : montant %s inattendu pour le paiement %s", order_id, providers.paypal_captured_amount(data), payment.id)
+            tasks.settle_payments(payments, "FAILED")
+            return Response({"error": "Montant capturé différent de la commande."}, status=status.HTTP_409_CONFLICT)
+
+        payer = data.get("payer", {})
+        settled = tasks.settle_payments(
+            payments, "COMPLETED",  # annonces vendues → indisponibles
+            payer_email=payer.get("email_address"), payer_id=payer.get("payer_id"),
+        )
+        payment.refresh_from_db()
+        if settled == "FAILED":
+            return Response(
+                {"error": "Annonce(s) vendue(s) entre-temps : le paiement sera remboursé.", "payment": PaymentSerializer(payment).data},
+                status=status.HTTP_409_CONFLICT,
+            )
 
         return Response({
             "message": "Paiement capturé avec succès.",
-            "payment": PaymentSerializer(payment).data if payment else None
+            "payment": PaymentSerializer(payment).data
         })
 
     # ===================================
@@ -384,15 +831,13 @@ class PaymentViewSet(viewsets.ModelViewSet):
         url_path="create-payment-stripe",
         permission_classes=[AllowAny]
     )
+    @idempotent
     def create_payment_stripe(self, request):
-        stripe.api_key = settings.STRIPE_SECRET_KEY
-
         email = request.data.get("email")
-        amount_mad = request.data.get("amount")
 
-        if not email or not amount_mad:
+        if not email:
             return Response(
-                {"error": "email ou amount manquant."},
+                {"error": "email manquant."},
                 status=status.HTTP_400_BAD_REQUEST
             )
 
@@ -405,29 +850,45 @@ class PaymentViewSet(viewsets.ModelViewSet):
 
         cart = Cart.objects.filter(user=user).first()
 
-        amount_usd = self.convert_mad_to_usd(amount_mad)
+        try:
+            order = snapshot_cart(user, cart)
+        except OrderError as e:
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        except ReservationConflict as e:
+            return Response({"error": str(e), "item_ids": e.item_ids}, status=status.HTTP_409_CONFLICT)
+        amount_mad = order.total
 
-        intent = stripe.PaymentIntent.create(
-            amount=int(float(amount_usd) * 100),
-            currency="usd",
-            payment_method_types=["card"],
-            description=f"Achat meubles étudiant ({amount_mad} MAD)",
-        )
+        try:
+            amount_usd = self.convert_mad_to_usd(amount_mad)
+        except RatesUnavailable as e:
+            return self.rates_unavailable(order, e)
 
-        payment = Payment.objects.create(
-            user=user,
-            cart=cart,
-            stripe_payment_intent_id=intent.id,
-            payment_method="stripe",
-            amount=amount_mad,
-            currency="MAD",
-            status="PENDING"
-        )
+        try:
+            amount_cents = int(amount_usd * 100)  # Decimal au centime : exact
+
+            intent = providers.stripe_create_intent(amount_cents, "usd", f"Achat meubles étudiant ({amount_mad} MAD)")
+
+            payment = Payment.objects.create(
+                user=user,
+                cart=cart,
+                order=order,
+                stripe_payment_intent_id=intent.id,
+                payment_method="stripe",
+                amount=amount_mad,
+                currency="MAD",
+                provider_amount=amount_usd,
+                provider_currency="USD",
+                status="PENDING"
+            )
+        except Exception:
+            return self.abandon_order(order)
 
         return Response(
             {
                 "client_secret": intent.client_secret,
-                "payment_id": payment.id
+                "payment_id": payment.id,
+                "order_id": order.id,
+                "amount_mad": str(amount_mad)
             },
             status=status.HTTP_201_CREATED
         )
@@ -441,6 +902,7 @@ class PaymentViewSet(viewsets.ModelViewSet):
         url_path="confirm-stripe-payment",
         permission_classes=[AllowAny]
     )
+    @idempotent
     def confirm_stripe_payment(self, request):
         payment_intent_id = request.data.get("payment_intent_id")
 
@@ -451,7 +913,11 @@ class PaymentViewSet(viewsets.ModelViewSet):
         if not payment:
             return Response({"error": "Paiement introuvable"}, status=404)
 
-        payment.status = "COMPLETED"
-        payment.save()
+        # 🔁 La confirmation du client ne prouve rien : paiement et blocages
+        # restent en l'état jusqu'à la vérification auprès de Stripe (manage.py run_jobs)
+        tasks.verify_stripe_payment.enqueue(payment_intent_id=payment_intent_id)
 
-        return Response({"message": "Paiement Stripe confirmé"})
+        return Response(
+            {"message": "Paiement Stripe en cours de vérification", "payment": PaymentSerializer(payment).data},
+            status=status.HTTP_202_ACCEPTED,
+        )
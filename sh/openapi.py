@@ -0,0 +1,56 @@
+import os
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.http import HttpResponse
+from drf_yasg import openapi
+from drf_yasg.renderers import OpenAPIRenderer, SwaggerJSONRenderer
+from drf_yasg.views import get_schema_view
+from rest_framework import permissions
+
+
+api_info = openapi.Info(
+    title="SH API (Simple Auth ViewSet)",
+    default_version='v1',
+    description="API simple pour vente et location de meubles (auth basique avec ViewSet)",
+)
+
+_prebuilt = None
+
+
+def load_prebuilt_schema():
+    """Schéma JSON généré par `manage.py build_openapi_schema`, lu une fois par process."""
+    global _prebuilt
+    if _prebuilt is None and os.path.exists(settings.OPENAPI_SCHEMA_PATH):
+        with open(settings.OPENAPI_SCHEMA_PATH, 'rb') as fh:
+            _prebuilt = fh.read()
+    return _prebuilt
+
+
+BaseSchemaView = get_schema_view(
+    api_info,
+    public=True,
+    permission_classes=[permissions.AllowAny],
+)
+
+
+class PrebuiltSchemaView(BaseSchemaView):
+    """
+    Sert le schéma pré-généré (gunicorn.conf.on_starting ou build) au lieu
+    d'introspecter tous les ViewSets à chaque appel. Sans fichier, la
+    génération à la volée n'est permise qu'en DEBUG ou avec
+    OPENAPI_LIVE_FALLBACK : en production, l'absence est une erreur.
+    """
+
+    def get(self, request, version="", format=None):
+        renderer = request.accepted_renderer
+        if isinstance(renderer, (OpenAPIRenderer, SwaggerJSONRenderer)):
+            schema = load_prebuilt_schema()
+            if schema is not None:
+                return HttpResponse(schema, content_type=renderer.media_type)
+            if not (settings.DEBUG or settings.OPENAPI_LIVE_FALLBACK):
+                raise ImproperlyConfigured(
+                    f"Schéma OpenAPI absent ({settings.OPENAPI_SCHEMA_PATH}) : "
+                    "lancer `python manage.py build_openapi_schema`."
+                )
+        return super().get(request, version, format)
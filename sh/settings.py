@@ -12,6 +12,8 @@ https://docs.djangoproject.com/en/5.2/ref/settings/
 
 from pathlib import Path
 import os
+import sys
+import tempfile
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
@@ -60,6 +62,7 @@ MIDDLEWARE = [
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'market.profiling.ProfilingMiddleware',  # X-Profile / ?_profile= (staff)
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
@@ -81,6 +84,9 @@ REST_FRAMEWORK = {
     'DEFAULT_PERMISSION_CLASSES': [
         'rest_framework.permissions.AllowAny',
     ],
+    # 🔹 Nombre de proxies devant gunicorn (Render) : l'IP client est prise
+    # dans X-Forwarded-For à partir de la fin, et ne peut pas être usurpée
+    'NUM_PROXIES': int(os.environ.get('NUM_PROXIES', 1)),
 }
 # CSRF_TRUSTED_ORIGINS = [
 #     "http://localhost:3000",
@@ -216,7 +222,7 @@ AWS_DEFAULT_ACL = None
 
 STORAGES = {
     "default": {
-        "BACKEND": "storages.backends.s3boto3.S3Boto3Storage",
+        "BACKEND": "market.storage.PooledS3Storage",
     },
     "staticfiles": {
         "BACKEND": "storages.backends.s3boto3.S3Boto3Storage",
@@ -226,9 +232,193 @@ STORAGES = {
 STATIC_URL = f"https://{AWS_S3_CUSTOM_DOMAIN}/static/"
 MEDIA_URL = f"https://{AWS_S3_CUSTOM_DOMAIN}/media/"
 
+# 🔹 Stockage des médias (market/storage.py)
+# Un client S3 partagé par worker ; MAX_POOL_CONNECTIONS doit couvrir
+# MAX_CONCURRENCY × uploads simultanés.
+MEDIA_STORAGE = {
+    "MAX_POOL_CONNECTIONS": 32,
+    "MAX_ATTEMPTS": 5,
+    "MULTIPART_THRESHOLD": 8 * 1024 * 1024,
+    "MULTIPART_CHUNKSIZE": 8 * 1024 * 1024,
+    "MAX_CONCURRENCY": 8,  # parts envoyées en parallèle par upload
+    # Cache disque des originaux relus (0 pour le désactiver)
+    "READ_CACHE_DIR": os.environ.get(
+        "MEDIA_READ_CACHE_DIR", os.path.join(tempfile.gettempdir(), "sh-media-cache")
+    ),
+    "READ_CACHE_MAX_BYTES": 512 * 1024 * 1024,
+    "READ_CACHE_MAX_ENTRY_BYTES": 20 * 1024 * 1024,
+    "READ_CACHE_PREFIXES": ("items/", "profiles/"),
+}
+
 
 # Stripe
 
 
 STRIPE_SECRET_KEY = os.environ.get("STRIPE_SECRET_KEY")
-STRIPE_PUBLIC_KEY = os.environ.get("STRIPE_PUBLIC_KEY")
\ No newline at end of file
+STRIPE_PUBLIC_KEY = os.environ.get("STRIPE_PUBLIC_KEY")
+
+# 🔹 Uploads fractionnés (reprenables)
+CHUNKED_UPLOAD_DIR = os.environ.get(
+    "CHUNKED_UPLOAD_DIR", os.path.join(tempfile.gettempdir(), "sh-uploads")
+)
+CHUNKED_UPLOAD_CHUNK_SIZE = 1024 * 1024  # 1 Mo, sous FILE_UPLOAD_MAX_MEMORY_SIZE
+CHUNKED_UPLOAD_MAX_SIZE = 20 * 1024 * 1024
+
+
+# 🔹 File de tâches en base (manage.py run_jobs, process `worker` du Procfile)
+# Sans worker, rien ne tourne : vérification Stripe, rapprochement PayPal,
+# taux de change, statistiques de prix, annonces similaires, nettoyage.
+JOB_QUEUES = {
+    "default": {"concurrency": 4},
+    "payments": {"concurrency": 2},
+    "media": {"concurrency": 2},
+}
+JOB_LOCK_TIMEOUT = 300  # secondes avant qu'un job RUNNING soit considéré abandonné
+JOB_RETRY_BACKOFF = 10  # secondes, doublées à chaque tentative
+JOB_RETRY_BACKOFF_MAX = 3600
+
+
+# 🔹 Clés d'idempotence (en-tête Idempotency-Key sur les paiements)
+IDEMPOTENCY_KEY_TTL = 24 * 60 * 60  # secondes de conservation des réponses
+IDEMPOTENCY_LOCK_TIMEOUT = 120  # secondes : une clé IN_PROGRESS plus ancienne est reprise (worker mort)
+
+
+# 🔹 Réservations d'annonces pendant le paiement (market/reservations.py)
+RESERVATION_TTL = 15 * 60  # secondes de blocage d'une annonce au checkout
+RESERVATION_EXPIRE_BATCH = 500
+
+
+# 🔹 Flux de changements /api/changes/ (market/changes.py)
+CHANGE_FEED_PAGE_SIZE = 500  # lignes max par flux et par appel
+CHANGE_FEED_LAG = 2  # secondes : les lignes plus récentes attendent l'appel suivant ; > plus longue transaction d'écriture
+CHANGE_FEED_RETENTION_DAYS = 30  # conservation des tombstones (purgés par manage.py cleanup, cible tombstones)
+
+
+# 🔹 Événements SSE /api/events/items/ (market/events.py, servi par sh.asgi)
+SSE_HEARTBEAT = 15  # secondes entre deux commentaires keep-alive
+SSE_QUEUE_SIZE = 100  # événements en attente max par connexion avant déconnexion
+SSE_POLL_INTERVAL = 2  # secondes entre deux relectures des écritures des autres process
+
+
+# 🔹 Profilage à la demande (market/profiling.py, rapports sur /api/profiles/)
+PROFILING_ENABLED = os.environ.get("PROFILING_ENABLED", "0") == "1"  # middleware retiré de la chaîne sinon
+PROFILING_DIR = os.environ.get("PROFILING_DIR", os.path.join(tempfile.gettempdir(), "sh-profiles"))
+PROFILING_DEFAULT_MODE = "sample"  # ou "cprofile" (déterministe, plus lent)
+PROFILING_SAMPLE_INTERVAL = 0.005  # secondes entre deux relevés de pile
+PROFILING_TOP_FUNCTIONS = 60  # lignes de la sortie pstats
+PROFILING_MAX_REPORTS = 200
+
+
+# 🔹 Devises d'affichage (?currency= sur les annonces, market/currency.py)
+DISPLAY_CURRENCIES = ("USD", "EUR")
+EXCHANGE_RATES_URL = "https://api.exchangerate-api.com/v4/latest/MAD"
+EXCHANGE_RATES_REFRESH = 6 * 60 * 60  # secondes avant qu'un job ne relise l'API
+EXCHANGE_RATES_TTL = 7 * 24 * 60 * 60  # conservation de la dernière table connue
+EXCHANGE_RATES_FALLBACK = {"USD": "0.10", "EUR": "0.092"}  # 1 MAD = …, sans table ; affichage seulement, jamais un paiement
+
+
+# 🔹 Nettoyage par lots (manage.py cleanup, tâche maintenance.cleanup)
+CLEANUP = {
+    "BATCH_SIZE": 500,  # lignes par transaction
+    "PAUSE": 0.2,  # secondes entre deux lots
+    "EMPTY_CART_DAYS": 7,
+    "ABANDONED_CART_DAYS": 90,  # panier non modifié depuis (Cart.updated_at)
+    "PENDING_PAYMENT_HOURS": 48,  # paiements PENDING rapprochés du fournisseur au-delà
+    "FINISHED_JOB_DAYS": 7,
+    "CLOSED_RESERVATION_DAYS": 30,
+    "UPLOAD_SESSION_DAYS": 2,
+}
+
+
+# 🔹 Modification groupée des annonces (POST /api/{sell,rent}-items/bulk-update/)
+ITEM_BULK_UPDATE_MAX = 500
+
+
+# 🔹 Archivage des annonces (manage.py archive_items)
+ARCHIVE_UNAVAILABLE_AFTER_DAYS = 30  # annonces vendues / retirées
+ARCHIVE_STALE_AFTER_DAYS = 180  # annonces en ligne jamais mises à jour
+ARCHIVE_BATCH_SIZE = 200
+
+# Index partiels (Meta.indexes avec condition) : ignorés par MySQL, qui
+# reçoit un index composite de repli (migration 0021).
+SILENCED_SYSTEM_CHECKS = ["models.W037"]
+
+
+TESTING = sys.argv[1:2] == ["test"]
+
+# Tests : plans EXPLAIN de chaque requête (rapport dans QUERY_PLAN_REPORT)
+TEST_RUNNER = "market.query_budget.QueryPlanTestRunner"
+
+# 🔹 Cache partagé entre workers (python manage.py createcachetable)
+# En test, un cache fichier local tient lieu de niveau partagé.
+CACHES = {
+    "default": {
+        "BACKEND": "django.core.cache.backends.db.DatabaseCache",
+        "LOCATION": "sh_cache",
+    },
+}
+if TESTING:
+    CACHES["default"] = {
+        "BACKEND": "django.core.cache.backends.filebased.FileBasedCache",
+        "LOCATION": os.path.join(tempfile.gettempdir(), "sh-test-cache"),
+    }
+    # Médias sur disque, avec le même cache de lecture et les mêmes compteurs
+    STORAGES["default"] = {
+        "BACKEND": "market.storage.LocalMediaStorage",
+        "OPTIONS": {"location": os.path.join(tempfile.gettempdir(), "sh-test-media")},
+    }
+    MEDIA_STORAGE["READ_CACHE_DIR"] = os.path.join(tempfile.gettempdir(), "sh-test-media-cache")
+
+# 🔹 Cache à deux niveaux (market/cache.py) : LRU local devant CACHES[SHARED_ALIAS]
+APP_CACHE = {
+    "SHARED_ALIAS": "default",
+    "LOCAL_MAX_ENTRIES": 2048,
+    "LOCAL_TTL": 30,  # secondes max d'une entrée locale
+    "VERSION_TTL": 2,  # secondes entre deux relectures des versions de namespace
+    "LOCK_TIMEOUT": 10,  # anti-stampede
+    "MAX_NAMESPACES": 4096,  # versions de namespace gardées par worker (LRU)
+}
+
+# 🔹 Throttling par seau à jetons (market/throttling.py)
+# capacity : rafale maximale ; rate : recharge (jetons / période)
+TOKEN_BUCKETS = {
+    "login": {
+        "ip": {"capacity": 20, "rate": "10/min"},
+        "email": {"capacity": 5, "rate": "5/min"},
+    },
+    "register": {
+        "ip": {"capacity": 5, "rate": "10/hour"},
+        "email": {"capacity": 3, "rate": "3/hour"},
+    },
+    "cart": {
+        "ip": {"capacity": 60, "rate": "60/min"},
+    },
+    "checkout": {
+        "ip": {"capacity": 10, "rate": "10/min"},
+        "email": {"capacity": 5, "rate": "5/min"},
+    },
+}
+
+
+# 🔹 Schéma OpenAPI pré-généré : écrit au démarrage du master gunicorn
+# (gunicorn.conf.on_starting) ou au build (python manage.py build_openapi_schema)
+OPENAPI_SCHEMA_PATH = os.environ.get("OPENAPI_SCHEMA_PATH", str(BASE_DIR / "openapi.json"))
+OPENAPI_LIVE_FALLBACK = os.environ.get("OPENAPI_LIVE_FALLBACK", "0") == "1"  # sinon fichier absent → erreur
+
+
+# 🔹 Statistiques de prix (market/price_stats.py)
+PRICE_STATS_GLOBAL_INTERVAL = 300  # secondes entre deux recalculs des groupes toutes villes
+
+
+# 🔹 Annonces similaires (market/similar.py)
+SIMILAR_ITEMS_K = 10
+SIMILAR_REFRESH_CANDIDATES = 5000  # annonces comparées par recalcul incrémental (les plus récentes)
+SIMILAR_REFRESH_LOCK_TIMEOUT = 120  # secondes : verrou de cache d'un recalcul (libéré à la fin)
+
+
+# 🔹 Autocomplétion en mémoire du worker (market/autocomplete.py)
+AUTOCOMPLETE_LIMIT = 8  # suggestions par liste (?limit= plafonné à 20)
+AUTOCOMPLETE_MAX_TERMS = 200_000  # termes vivants par index : mémoire bornée
+AUTOCOMPLETE_MAX_ITEMS = 500_000  # annonces suivies ; au-delà, non indexées (dropped_items)
+AUTOCOMPLETE_SYNC_INTERVAL = 5  # secondes entre deux rattrapages des écritures des autres workers
+AUTOCOMPLETE_SYNC_BATCH = 1000
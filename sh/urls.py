@@ -1,23 +1,17 @@
 from django.contrib import admin
 from django.urls import path, include
-from rest_framework import routers, permissions
-from drf_yasg.views import get_schema_view
-from drf_yasg import openapi
-from market.views import UserViewSet,RentItemViewSet,SellItemViewSet,CartViewSet,PaymentViewSet
+from rest_framework import routers
+from market.views import UserViewSet,RentItemViewSet,SellItemViewSet,CartViewSet,PaymentViewSet,UploadViewSet,ArchivedItemViewSet
 from django.conf import settings
 from django.conf.urls.static import static
-from market.views import get_csrf_token
+from market.views import autocomplete, changes, get_csrf_token, item_events, profile_report, profiles
 
 
-schema_view = get_schema_view(
-    openapi.Info(
-        title="SH API (Simple Auth ViewSet)",
-        default_version='v1',
-        description="API simple pour vente et location de meubles (auth basique avec ViewSet)",
-    ),
-    public=True,
-    permission_classes=[permissions.AllowAny],
-)
+from sh.openapi import PrebuiltSchemaView
+
+
+# Schéma pré-généré au build : python manage.py build_openapi_schema
+schema_view = PrebuiltSchemaView
 
 router = routers.DefaultRouter()
 router.register(r'users', UserViewSet, basename='user')
@@ -25,6 +19,8 @@ router.register(r'rent-items', RentItemViewSet, basename='rent-item')
 router.register(r'sell-items', SellItemViewSet, basename='sell-item')
 router.register(r'cart', CartViewSet, basename='cart')
 router.register(r'payments', PaymentViewSet, basename='payments')  # ✅ <--- ici
+router.register(r'uploads', UploadViewSet, basename='upload')
+router.register(r'archived-items', ArchivedItemViewSet, basename='archived-item')
 
 
 
@@ -33,6 +29,11 @@ urlpatterns = [
     path('admin/', admin.site.urls),
     path('api/', include(router.urls)),
     path('api/csrf/', get_csrf_token),  # 👈 ajoute cette ligne
+    path('api/changes/', changes, name='changes'),
+    path('api/autocomplete/', autocomplete, name='autocomplete'),
+    path('api/events/items/', item_events, name='item-events'),
+    path('api/profiles/', profiles, name='profiles'),
+    path('api/profiles/<str:report_id>/', profile_report, name='profile-report'),
     
 
     # Swagger